@@ -1,64 +1,66 @@
 from models import db, Apartamento, Cuarto, Pago, Limpieza, Gas
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from backend.cubo_diario import cubo_diario
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+from collections import OrderedDict
+import logging
 import statistics
+import threading
+import time
+import numpy as np
+
+DIAS_POR_MES = 30.44  # para prorratear los costos mensuales en rangos de días
 
 class AnalyticsManager:
     """Gestor de análisis y métricas comerciales para el sistema"""
     
-    def __init__(self):
+    def __init__(self, meses_tendencia: int = 6, tamaño_memo: int = 32, segundos_memo: int = 300):
         self.hoy = datetime.now()
         self.mes_actual = self.hoy.month
         self.año_actual = self.hoy.year
+        self.meses_tendencia = meses_tendencia
+        self.logger = logging.getLogger(__name__)
+        
+        # Reportes memoizados: (tipo, parámetros, mes) -> (versión de datos, resultado, calculado en), en orden LRU.
+        # La versión solo cambia con los commits de este proceso; segundos_memo acota cuánto tiempo
+        # se sirve un reporte sin ver lo que escribieron otros procesos (comandos flask, otros workers)
+        self.tamaño_memo = tamaño_memo
+        self.segundos_memo = segundos_memo
+        self._memo = OrderedDict()
+        self._version_datos = 0
+        self._refrescando = set()  # claves con un recálculo en segundo plano en curso
+        self._candado_memo = threading.Lock()
+        self._metricas_memo = {'aciertos': 0, 'obsoletos': 0, 'fallos': 0,
+                               'recalculos': 0, 'segundos_recalculo': 0.0, 'ultimo_recalculo': None}
+        self._app = None
+        
+        # Serie mensual de meses cerrados: (año, mes) -> (ingresos, cuartos con pago)
+        self._serie_cerrada = {}
+        self._serie_desde = None  # primer mes guardado
+        self._serie_hasta = None  # primer mes no guardado (el mes en curso al calcular)
+        self._candado_serie = threading.Lock()
+        self._iniciado = False
+    
+    def iniciar(self, app):
+        """Registra los eventos que invalidan la serie si se guardan pagos de meses cerrados
+        y que cambian la versión de datos de los reportes memoizados"""
+        if self._iniciado:
+            return
+        self._app = app
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._iniciado = True
     
     def calcular_rentabilidad_apartamento(self, apartamento_id: int) -> Dict:
         """Calcula la rentabilidad de un apartamento específico"""
-        apartamento = Apartamento.query.get(apartamento_id)
-        if not apartamento:
-            return {}
-        
-        cuartos = Cuarto.query.filter_by(apartamento_id=apartamento_id).all()
-        cuartos_activos = [c for c in cuartos if c.activo]
-        
-        # Ingresos potenciales vs reales
-        ingresos_potenciales = sum(c.renta for c in cuartos_activos)
-        ingresos_reales = self._calcular_ingresos_reales(apartamento_id)
-        
-        # Ocupación
-        tasa_ocupacion = len(cuartos_activos) / len(cuartos) * 100 if cuartos else 0
-        
-        # Análisis de pagos
-        pagos_analisis = self._analizar_pagos_apartamento(apartamento_id)
-        
-        # Costos operativos estimados
-        costos_operativos = self._calcular_costos_operativos(apartamento_id)
-        
-        # ROI estimado
-        roi_estimado = ((ingresos_reales - costos_operativos) / costos_operativos * 100) if costos_operativos > 0 else 0
-        
-        return {
-            'apartamento_id': apartamento_id,
-            'numero': apartamento.numero,
-            'ingresos_potenciales': ingresos_potenciales,
-            'ingresos_reales': ingresos_reales,
-            'tasa_ocupacion': round(tasa_ocupacion, 1),
-            'cuartos_activos': len(cuartos_activos),
-            'cuartos_totales': len(cuartos),
-            'pagos_analisis': pagos_analisis,
-            'costos_operativos': costos_operativos,
-            'roi_estimado': round(roi_estimado, 1),
-            'rentabilidad_score': self._calcular_rentabilidad_score(tasa_ocupacion, pagos_analisis['puntualidad'])
-        }
+        return self._memoizar('rentabilidad_apartamento', (apartamento_id,),
+                              lambda: self._calcular_rentabilidad_apartamento(apartamento_id))
     
     def obtener_analisis_comparativo(self) -> Dict:
         """Obtiene análisis comparativo entre apartamentos"""
-        apartamentos = Apartamento.query.all()
-        analisis = []
-        
-        for apto in apartamentos:
-            analisis_apto = self.calcular_rentabilidad_apartamento(apto.id)
-            if analisis_apto:
-                analisis.append(analisis_apto)
+        # Todas las rentabilidades salen de las mismas consultas agrupadas
+        analisis = self._calcular_rentabilidades()
         
         # Ordenar por rentabilidad
         analisis.sort(key=lambda x: x['rentabilidad_score'], reverse=True)
@@ -75,90 +77,144 @@ class AnalyticsManager:
         
         return stats
     
+    def calcular_rentabilidad_periodo(self, desde: date, hasta: date, apartamento_ids: List[int] = None) -> List[Dict]:
+        """Rentabilidad de un rango de fechas cualquiera sumando el cubo diario; los costos se
+        prorratean por días y la ocupación son los días-cuarto ocupados del rango"""
+        dias = (hasta - desde).days + 1
+        analisis = []
+        for fila in cubo_diario.resumen(desde, hasta, apartamento_ids):
+            costos_operativos = round(self._calcular_costos_operativos(fila['cuartos_totales']) * dias / DIAS_POR_MES, 2)
+            roi_estimado = ((fila['ingresos'] - costos_operativos) / costos_operativos * 100) if costos_operativos > 0 else 0
+            # Pagos recibidos sobre los esperados (uno al mes por cuarto ocupado)
+            esperados = fila['dias_cuarto_ocupados'] / DIAS_POR_MES
+            cumplimiento = min(fila['pagos'] / esperados * 100, 100) if esperados else 0
+            
+            analisis.append({
+                **fila,
+                'ingresos_reales': fila['ingresos'],
+                'costos_operativos': costos_operativos,
+                'roi_estimado': round(roi_estimado, 1),
+                'cumplimiento_pagos': round(cumplimiento, 1),
+                'rentabilidad_score': self._calcular_rentabilidad_score(fila['tasa_ocupacion'], cumplimiento)
+            })
+        
+        return analisis
+    
+    def obtener_analisis_periodo(self, desde: date, hasta: date, agrupar: str = 'mes') -> Dict:
+        """Análisis comparativo, totales y serie (por día o por mes) de un rango de fechas"""
+        analisis = self.calcular_rentabilidad_periodo(desde, hasta)
+        analisis.sort(key=lambda x: x['rentabilidad_score'], reverse=True)
+        totales = cubo_diario.totales(desde, hasta)
+        dias_cuarto = sum(a['dias_cuarto_ocupados'] for a in analisis)
+        dias_disponibles = sum(a['cuartos_totales'] for a in analisis) * ((hasta - desde).days + 1)
+        
+        return {
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'totales': {
+                **totales,
+                'ingresos': round(float(totales['ingresos']), 2),
+                'dias_cuarto_ocupados': round(dias_cuarto, 1),
+                'tasa_ocupacion': round(dias_cuarto / dias_disponibles * 100, 1) if dias_disponibles else 0,
+                'costos_operativos': round(sum(a['costos_operativos'] for a in analisis), 2)
+            },
+            'mejor_apartamento': analisis[0] if analisis else None,
+            'peor_apartamento': analisis[-1] if analisis else None,
+            'analisis_detallado': analisis,
+            'serie': cubo_diario.serie(desde, hasta, agrupar)
+        }
+    
     def predecir_ingresos_mes_siguiente(self) -> Dict:
         """Predice los ingresos del mes siguiente basado en tendencias"""
-        # Obtener datos de los últimos 3 meses
-        fecha_inicio = self.hoy - timedelta(days=90)
-        
-        # Calcular tendencia de ocupación
-        tendencia_ocupacion = self._calcular_tendencia_ocupacion()
+        # Tendencias de los últimos meses cerrados (regresión lineal sobre la serie mensual)
+        tendencia_pagos, tendencia_ocupacion = self._calcular_tendencias()
         
-        # Calcular tendencia de pagos
-        tendencia_pagos = self._calcular_tendencia_pagos()
-        
-        # Predecir ingresos
-        apartamentos = Apartamento.query.all()
-        prediccion_ingresos = 0
-        
-        for apto in apartamentos:
-            cuartos = Cuarto.query.filter_by(apartamento_id=apto.id).all()
-            cuartos_activos = [c for c in cuartos if c.activo]
-            
-            # Aplicar tendencia de ocupación
-            ocupacion_predicha = len(cuartos_activos) * (1 + tendencia_ocupacion / 100)
-            ocupacion_predicha = min(ocupacion_predicha, len(cuartos))  # No más del 100%
-            
-            # Calcular ingresos predichos
-            ingresos_apto = sum(c.renta for c in cuartos_activos) * (1 + tendencia_pagos / 100)
-            prediccion_ingresos += ingresos_apto
+        prediccion_ingresos = self._calcular_renta_activa() * (1 + tendencia_pagos / 100)
         
         return {
             'prediccion_ingresos': round(prediccion_ingresos, 2),
             'tendencia_ocupacion': round(tendencia_ocupacion, 1),
             'tendencia_pagos': round(tendencia_pagos, 1),
+            'meses_analizados': self.meses_tendencia,
             'confianza': self._calcular_confianza_prediccion(tendencia_ocupacion, tendencia_pagos)
         }
     
+    def obtener_serie_mensual(self, meses: int = None) -> Dict:
+        """Ingresos y cuartos con pago por mes: los `meses` meses cerrados más el mes en curso.
+        Los meses cerrados quedan en caché; cada llamada solo consulta desde el último guardado."""
+        meses = meses or self.meses_tendencia
+        hoy = datetime.utcnow()
+        mes_en_curso = (hoy.year, hoy.month)
+        desde = self._sumar_meses(mes_en_curso, -meses)
+        
+        with self._candado_serie:
+            if self._serie_desde is None or desde < self._serie_desde or self._serie_hasta > mes_en_curso:
+                consultar_desde = desde
+                self._serie_cerrada = {}
+                self._serie_desde = desde
+            else:
+                consultar_desde = self._serie_hasta
+            
+            nuevos = self._consultar_meses(consultar_desde)
+            for mes, valores in nuevos.items():
+                if mes < mes_en_curso:
+                    self._serie_cerrada[mes] = valores
+            self._serie_hasta = mes_en_curso
+            
+            etiquetas = [self._sumar_meses(desde, i) for i in range(meses + 1)]
+            valores = [self._serie_cerrada.get(m, (0.0, 0)) if m < mes_en_curso else nuevos.get(m, (0.0, 0))
+                       for m in etiquetas]
+        
+        return {
+            'meses': [f'{año}-{mes:02d}' for año, mes in etiquetas],
+            'ingresos': np.array([v[0] for v in valores], dtype=float),
+            'cuartos_con_pago': np.array([v[1] for v in valores], dtype=float)
+        }
+    
+    def invalidar_serie(self):
+        """Descarta la serie mensual en caché"""
+        with self._candado_serie:
+            self._serie_cerrada = {}
+            self._serie_desde = None
+            self._serie_hasta = None
+    
     def identificar_oportunidades_mejora(self) -> List[Dict]:
         """Identifica oportunidades de mejora en la rentabilidad"""
         oportunidades = []
         
-        apartamentos = Apartamento.query.all()
-        for apto in apartamentos:
-            cuartos = Cuarto.query.filter_by(apartamento_id=apto.id).all()
-            cuartos_activos = [c for c in cuartos if c.activo]
-            cuartos_libres = [c for c in cuartos if not c.activo]
-            
+        for numero, renta_base, libres, activos, renta_promedio, atrasados, ingresos_atrasados \
+                in self._consultar_oportunidades():
             # Oportunidad 1: Cuartos libres
-            if cuartos_libres:
-                ingresos_perdidos = sum(apto.renta_base for _ in cuartos_libres)
+            if libres:
+                ingresos_perdidos = renta_base * libres
                 oportunidades.append({
                     'tipo': 'ocupacion',
-                    'apartamento': apto.numero,
-                    'descripcion': f'{len(cuartos_libres)} cuartos disponibles',
+                    'apartamento': numero,
+                    'descripcion': f'{libres} cuartos disponibles',
                     'impacto_potencial': ingresos_perdidos,
-                    'prioridad': 'alta' if len(cuartos_libres) > 2 else 'media',
+                    'prioridad': 'alta' if libres > 2 else 'media',
                     'accion_sugerida': 'Promocionar cuartos disponibles'
                 })
             
             # Oportunidad 2: Pagos atrasados
-            cuartos_atrasados = []
-            for cuarto in cuartos_activos:
-                if cuarto.ultimo_pago:
-                    dias_atraso = (self.hoy - cuarto.ultimo_pago).days
-                    if dias_atraso > 5:
-                        cuartos_atrasados.append(cuarto)
-            
-            if cuartos_atrasados:
-                ingresos_atrasados = sum(c.renta for c in cuartos_atrasados)
+            if atrasados:
                 oportunidades.append({
                     'tipo': 'pagos',
-                    'apartamento': apto.numero,
-                    'descripcion': f'{len(cuartos_atrasados)} pagos atrasados',
+                    'apartamento': numero,
+                    'descripcion': f'{atrasados} pagos atrasados',
                     'impacto_potencial': ingresos_atrasados,
                     'prioridad': 'alta',
                     'accion_sugerida': 'Contactar inquilinos morosos'
                 })
             
             # Oportunidad 3: Optimización de precios
-            if cuartos_activos:
-                renta_promedio = statistics.mean([c.renta for c in cuartos_activos])
-                if renta_promedio < apto.renta_base * 1.1:  # Si está por debajo del 110% de la base
+            if activos:
+                if renta_promedio < renta_base * 1.1:  # Si está por debajo del 110% de la base
                     oportunidades.append({
                         'tipo': 'precios',
-                        'apartamento': apto.numero,
+                        'apartamento': numero,
                         'descripcion': 'Renta promedio por debajo del potencial',
-                        'impacto_potencial': (apto.renta_base * 1.1 - renta_promedio) * len(cuartos_activos),
+                        'impacto_potencial': (renta_base * 1.1 - renta_promedio) * activos,
                         'prioridad': 'media',
                         'accion_sugerida': 'Revisar y ajustar precios de renta'
                     })
@@ -170,7 +226,32 @@ class AnalyticsManager:
         return oportunidades
     
     def generar_reporte_comercial(self) -> Dict:
-        """Genera un reporte comercial completo"""
+        """Genera un reporte comercial completo. Se memoiza por versión de datos: si los datos
+        cambiaron se entrega el reporte anterior mientras uno nuevo se calcula en segundo plano."""
+        return self._memoizar('reporte_comercial', (), self._generar_reporte_comercial)
+    
+    def obtener_metricas_memo(self) -> Dict:
+        """Aciertos, reportes obsoletos servidos, fallos y tiempo de recálculo de la memoización"""
+        with self._candado_memo:
+            m = dict(self._metricas_memo)
+            consultas = m['aciertos'] + m['obsoletos'] + m['fallos']
+            return {
+                **m,
+                'segundos_recalculo': round(m['segundos_recalculo'], 3),
+                'promedio_recalculo': round(m['segundos_recalculo'] / m['recalculos'], 3) if m['recalculos'] else 0,
+                'tasa_aciertos': round(m['aciertos'] / consultas * 100, 1) if consultas else 0,
+                'entradas': len(self._memo),
+                'tamaño_memo': self.tamaño_memo,
+                'version_datos': self._version_datos
+            }
+    
+    def invalidar_memo(self):
+        """Marca como obsoletos todos los reportes memoizados (se siguen sirviendo mientras se recalculan)"""
+        with self._candado_memo:
+            self._version_datos += 1
+    
+    # Métodos privados
+    def _generar_reporte_comercial(self) -> Dict:
         analisis_comparativo = self.obtener_analisis_comparativo()
         prediccion = self.predecir_ingresos_mes_siguiente()
         oportunidades = self.identificar_oportunidades_mejora()
@@ -193,58 +274,174 @@ class AnalyticsManager:
             'recomendaciones': self._generar_recomendaciones(analisis_comparativo, oportunidades)
         }
     
-    # Métodos privados
-    def _calcular_ingresos_reales(self, apartamento_id: int) -> float:
-        """Calcula ingresos reales del apartamento en el mes actual"""
-        cuartos = Cuarto.query.filter_by(apartamento_id=apartamento_id).all()
-        ingresos = 0
-        
-        for cuarto in cuartos:
-            pagos = Pago.query.filter(
-                Pago.cuarto_id == cuarto.id,
-                db.extract('year', Pago.fecha) == self.año_actual,
-                db.extract('month', Pago.fecha) == self.mes_actual
-            ).all()
-            ingresos += sum(pago.monto for pago in pagos)
-        
-        return ingresos
-    
-    def _analizar_pagos_apartamento(self, apartamento_id: int) -> Dict:
-        """Analiza los patrones de pago de un apartamento"""
-        cuartos = Cuarto.query.filter_by(apartamento_id=apartamento_id).all()
-        cuartos_activos = [c for c in cuartos if c.activo]
-        
-        pagos_puntuales = 0
-        pagos_atrasados = 0
-        total_pagos = 0
-        
-        for cuarto in cuartos_activos:
-            if cuarto.ultimo_pago:
-                dias_atraso = (self.hoy - cuarto.ultimo_pago).days
-                if dias_atraso <= 5:
-                    pagos_puntuales += 1
-                else:
-                    pagos_atrasados += 1
-                total_pagos += 1
-        
-        puntualidad = (pagos_puntuales / total_pagos * 100) if total_pagos > 0 else 0
+    def _calcular_rentabilidad_apartamento(self, apartamento_id: int) -> Dict:
+        analisis = self._calcular_rentabilidades([apartamento_id])
+        return analisis[0] if analisis else {}
+    
+    def _memoizar(self, tipo: str, parametros: Tuple, calcular: Callable[[], Dict]) -> Dict:
+        """Devuelve el resultado guardado si es de la versión de datos actual y tiene menos de
+        segundos_memo; si no, lo devuelve igual y lanza un solo recálculo en segundo plano;
+        si no hay nada guardado (o cambió el mes), calcula en el momento"""
+        self._actualizar_fecha()
+        clave = (tipo, parametros, (self.año_actual, self.mes_actual))
+        with self._candado_memo:
+            version = self._version_datos
+            entrada = self._memo.get(clave)
+            if entrada is not None:
+                self._memo.move_to_end(clave)
+                if entrada[0] == version and time.monotonic() - entrada[2] < self.segundos_memo:
+                    self._metricas_memo['aciertos'] += 1
+                    return entrada[1]
+                self._metricas_memo['obsoletos'] += 1
+                refrescar = self._app is not None and clave not in self._refrescando
+                if refrescar:
+                    self._refrescando.add(clave)
+            else:
+                self._metricas_memo['fallos'] += 1
+        
+        if entrada is None:
+            return self._recalcular(clave, version, calcular)
+        if refrescar:
+            threading.Thread(target=self._recalcular_en_segundo_plano, args=(clave, version, calcular),
+                             name=f'analytics-{tipo}', daemon=True).start()
+        elif self._app is None:
+            # Sin aplicación registrada no hay hilo de fondo: se recalcula en el momento
+            return self._recalcular(clave, version, calcular)
+        return entrada[1]
+    
+    def _actualizar_fecha(self):
+        """La fecha de referencia avanza con el reloj (la instancia vive lo que el proceso)"""
+        self.hoy = datetime.now()
+        self.mes_actual = self.hoy.month
+        self.año_actual = self.hoy.year
+    
+    def _recalcular(self, clave: Tuple, version: int, calcular: Callable[[], Dict]) -> Dict:
+        inicio = time.perf_counter()
+        resultado = calcular()
+        segundos = time.perf_counter() - inicio
+        
+        with self._candado_memo:
+            self._metricas_memo['recalculos'] += 1
+            self._metricas_memo['segundos_recalculo'] += segundos
+            self._metricas_memo['ultimo_recalculo'] = round(segundos, 3)
+            # No pisar un resultado calculado con datos más nuevos
+            actual = self._memo.get(clave)
+            if actual is None or actual[0] <= version:
+                self._memo[clave] = (version, resultado, time.monotonic())
+                self._memo.move_to_end(clave)
+            while len(self._memo) > self.tamaño_memo:
+                self._memo.popitem(last=False)
+        return resultado
+    
+    def _recalcular_en_segundo_plano(self, clave: Tuple, version: int, calcular: Callable[[], Dict]):
+        with self._app.app_context():
+            try:
+                self._recalcular(clave, version, calcular)
+            except Exception as e:
+                self.logger.error(f'Error recalculando {clave[0]}: {e}')
+            finally:
+                db.session.remove()
+                with self._candado_memo:
+                    self._refrescando.discard(clave)
+    
+    def _calcular_rentabilidades(self, apartamento_ids: List[int] = None) -> List[Dict]:
+        """Rentabilidad de varios apartamentos a partir de los conteos agrupados por apartamento"""
+        filas, ingresos = self._consultar_rentabilidades(apartamento_ids)
         
-        return {
-            'pagos_puntuales': pagos_puntuales,
-            'pagos_atrasados': pagos_atrasados,
-            'total_pagos': total_pagos,
-            'puntualidad': round(puntualidad, 1)
-        }
+        analisis = []
+        for apto_id, numero, total, activos, potenciales, con_pago, puntuales in filas:
+            ingresos_reales = ingresos.get(apto_id, 0)
+            tasa_ocupacion = activos / total * 100 if total else 0
+            costos_operativos = self._calcular_costos_operativos(total)
+            roi_estimado = ((ingresos_reales - costos_operativos) / costos_operativos * 100) if costos_operativos > 0 else 0
+            
+            pagos_analisis = {
+                'pagos_puntuales': puntuales,
+                'pagos_atrasados': con_pago - puntuales,
+                'total_pagos': con_pago,
+                'puntualidad': round(puntuales / con_pago * 100, 1) if con_pago else 0
+            }
+            
+            analisis.append({
+                'apartamento_id': apto_id,
+                'numero': numero,
+                'ingresos_potenciales': float(potenciales),
+                'ingresos_reales': ingresos_reales,
+                'tasa_ocupacion': round(tasa_ocupacion, 1),
+                'cuartos_activos': activos,
+                'cuartos_totales': total,
+                'pagos_analisis': pagos_analisis,
+                'costos_operativos': costos_operativos,
+                'roi_estimado': round(roi_estimado, 1),
+                'rentabilidad_score': self._calcular_rentabilidad_score(tasa_ocupacion, pagos_analisis['puntualidad'])
+            })
+        
+        return analisis
+    
+    def _consultar_rentabilidades(self, apartamento_ids: List[int] = None) -> Tuple[List[Tuple], Dict[int, float]]:
+        """Conteos de cuartos por apartamento e ingresos del mes, con dos consultas agrupadas en total
+        sin importar cuántos apartamentos haya"""
+        inicio_mes = datetime(self.año_actual, self.mes_actual, 1)
+        fin_mes = datetime(self.año_actual + self.mes_actual // 12, self.mes_actual % 12 + 1, 1)
+        limite_puntual = self.hoy - timedelta(days=6)  # (hoy - ultimo_pago).days <= 5
+        
+        activo = Cuarto.activo == True
+        query = db.session.query(
+            Apartamento.id,
+            Apartamento.numero,
+            db.func.count(Cuarto.id),
+            db.func.count(db.case((activo, 1))),
+            db.func.coalesce(db.func.sum(db.case((activo, Cuarto.renta), else_=0)), 0),
+            db.func.count(db.case((db.and_(activo, Cuarto.ultimo_pago.isnot(None)), 1))),
+            db.func.count(db.case((db.and_(activo, Cuarto.ultimo_pago > limite_puntual), 1)))
+        ).outerjoin(Cuarto, Cuarto.apartamento_id == Apartamento.id).group_by(Apartamento.id)
+        
+        ingresos_query = db.session.query(Cuarto.apartamento_id, db.func.sum(Pago.monto))\
+            .join(Pago, Pago.cuarto_id == Cuarto.id)\
+            .filter(Pago.fecha >= inicio_mes, Pago.fecha < fin_mes)\
+            .group_by(Cuarto.apartamento_id)
+        
+        if apartamento_ids is not None:
+            query = query.filter(Apartamento.id.in_(apartamento_ids))
+            ingresos_query = ingresos_query.filter(Cuarto.apartamento_id.in_(apartamento_ids))
+        ingresos = {apto_id: float(total or 0) for apto_id, total in ingresos_query.all()}
+        
+        return query.all(), ingresos
     
-    def _calcular_costos_operativos(self, apartamento_id: int) -> float:
+    def _consultar_oportunidades(self) -> List[Tuple]:
+        """Por apartamento: (numero, renta_base, cuartos libres, cuartos activos, renta promedio
+        de los activos, cuartos con más de 5 días desde el último pago, renta de esos cuartos),
+        con una sola consulta agrupada sin importar cuántos apartamentos haya"""
+        limite_puntual = self.hoy - timedelta(days=6)  # (hoy - ultimo_pago).days > 5
+        
+        activo = Cuarto.activo == True
+        atrasado = db.and_(activo, Cuarto.ultimo_pago <= limite_puntual)
+        filas = db.session.query(
+            Apartamento.numero,
+            Apartamento.renta_base,
+            db.func.count(Cuarto.id) - db.func.count(db.case((activo, 1))),
+            db.func.count(db.case((activo, 1))),
+            db.func.coalesce(db.func.avg(db.case((activo, Cuarto.renta))), 0),
+            db.func.count(db.case((atrasado, 1))),
+            db.func.coalesce(db.func.sum(db.case((atrasado, Cuarto.renta), else_=0)), 0)
+        ).outerjoin(Cuarto, Cuarto.apartamento_id == Apartamento.id)\
+            .group_by(Apartamento.id).order_by(Apartamento.id).all()
+        return [tuple(fila) for fila in filas]
+    
+    def _calcular_renta_activa(self) -> float:
+        """Renta de los cuartos ocupados en una sola consulta"""
+        renta_activa = db.session.query(db.func.coalesce(db.func.sum(Cuarto.renta), 0))\
+            .filter(Cuarto.activo == True).scalar()
+        return float(renta_activa)
+    
+    def _calcular_costos_operativos(self, numero_cuartos: int) -> float:
         """Calcula costos operativos estimados del apartamento"""
         # Costos estimados por apartamento (mantenimiento, servicios, etc.)
         costo_base = 200.0  # Costo base mensual
         
         # Ajustar por número de cuartos
-        cuartos = Cuarto.query.filter_by(apartamento_id=apartamento_id).all()
         costo_por_cuarto = 50.0
-        costo_total = costo_base + (len(cuartos) * costo_por_cuarto)
+        costo_total = costo_base + (numero_cuartos * costo_por_cuarto)
         
         return costo_total
     
@@ -255,14 +452,66 @@ class AnalyticsManager:
         return round(score, 1)
     
     def _calcular_tendencia_ocupacion(self) -> float:
-        """Calcula la tendencia de ocupación en los últimos meses"""
-        # Implementación simplificada - en un sistema real se usarían datos históricos
-        return 2.5  # 2.5% de crecimiento mensual estimado
+        """Calcula la tendencia de ocupación en los últimos meses (% mensual)"""
+        return self._calcular_tendencias()[1]
     
     def _calcular_tendencia_pagos(self) -> float:
-        """Calcula la tendencia de pagos en los últimos meses"""
-        # Implementación simplificada
-        return 1.0  # 1% de mejora mensual estimada
+        """Calcula la tendencia de pagos en los últimos meses (% mensual)"""
+        return self._calcular_tendencias()[0]
+    
+    def _calcular_tendencias(self) -> Tuple[float, float]:
+        """Pendiente de la recta de mínimos cuadrados de cada serie (meses cerrados),
+        como porcentaje del promedio; las dos series se ajustan en una sola llamada"""
+        serie = self.obtener_serie_mensual()
+        y = np.column_stack([serie['ingresos'][:-1], serie['cuartos_con_pago'][:-1]])
+        
+        # Descartar los meses iniciales sin ningún pago (antes de empezar a usar el sistema)
+        con_datos = np.flatnonzero(y[:, 0] > 0)
+        if con_datos.size < 2:
+            return 0.0, 0.0
+        y = y[con_datos[0]:]
+        
+        pendientes = np.polyfit(np.arange(len(y), dtype=float), y, 1)[0]
+        promedios = y.mean(axis=0)
+        tendencias = np.divide(pendientes * 100, promedios, out=np.zeros_like(pendientes), where=promedios > 0)
+        return float(tendencias[0]), float(tendencias[1])
+    
+    def _consultar_meses(self, desde: Tuple[int, int]) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        """Ingresos y cuartos distintos con pago por mes desde el mes dado, en una consulta agrupada"""
+        año = db.extract('year', Pago.fecha)
+        mes = db.extract('month', Pago.fecha)
+        filas = db.session.query(año, mes, db.func.sum(Pago.monto), db.func.count(db.distinct(Pago.cuarto_id)))\
+            .filter(Pago.fecha >= datetime(desde[0], desde[1], 1))\
+            .group_by(año, mes).all()
+        return {(int(a), int(m)): (float(total or 0), int(cuartos)) for a, m, total, cuartos in filas}
+    
+    def _sumar_meses(self, mes: Tuple[int, int], n: int) -> Tuple[int, int]:
+        indice = mes[0] * 12 + mes[1] - 1 + n
+        return indice // 12, indice % 12 + 1
+    
+    def _al_hacer_flush(self, session, flush_context):
+        """Un pago nuevo de un mes ya cerrado cambia la serie guardada; cualquier cambio de
+        pagos, cuartos o apartamentos cambia la versión de los reportes"""
+        if any(isinstance(obj, (Pago, Cuarto, Apartamento))
+               for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+            session.info['analytics_datos_sucios'] = True
+        
+        hasta = self._serie_hasta
+        if hasta is None:
+            return
+        inicio = datetime(hasta[0], hasta[1], 1)
+        if any(isinstance(obj, Pago) and obj.fecha is not None and obj.fecha < inicio for obj in session.new):
+            session.info['serie_mensual_sucia'] = True
+    
+    def _al_hacer_commit(self, session):
+        if session.info.pop('serie_mensual_sucia', False):
+            self.invalidar_serie()
+        if session.info.pop('analytics_datos_sucios', False):
+            self.invalidar_memo()
+    
+    def _al_hacer_rollback(self, session):
+        session.info.pop('serie_mensual_sucia', None)
+        session.info.pop('analytics_datos_sucios', None)
     
     def _calcular_confianza_prediccion(self, tendencia_ocupacion: float, tendencia_pagos: float) -> str:
         """Calcula el nivel de confianza de la predicción"""
@@ -275,18 +524,14 @@ class AnalyticsManager:
     
     def _calcular_ingresos_totales_mes(self) -> float:
         """Calcula ingresos totales del mes actual"""
-        ingresos = db.session.query(db.func.sum(Pago.monto)).filter(
-            db.extract('year', Pago.fecha) == self.año_actual,
-            db.extract('month', Pago.fecha) == self.mes_actual
-        ).scalar()
-        return float(ingresos) if ingresos else 0.0
+        inicio = date(self.año_actual, self.mes_actual, 1)
+        fin = date(self.año_actual + self.mes_actual // 12, self.mes_actual % 12 + 1, 1) - timedelta(days=1)
+        return float(cubo_diario.totales(inicio, fin)['ingresos'])
     
     def _calcular_ingresos_totales_año(self) -> float:
         """Calcula ingresos totales del año actual"""
-        ingresos = db.session.query(db.func.sum(Pago.monto)).filter(
-            db.extract('year', Pago.fecha) == self.año_actual
-        ).scalar()
-        return float(ingresos) if ingresos else 0.0
+        inicio, fin = date(self.año_actual, 1, 1), date(self.año_actual, 12, 31)
+        return float(cubo_diario.totales(inicio, fin)['ingresos'])
     
     def _generar_recomendaciones(self, analisis: Dict, oportunidades: List[Dict]) -> List[str]:
         """Genera recomendaciones basadas en el análisis"""
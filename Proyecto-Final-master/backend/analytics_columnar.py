@@ -0,0 +1,300 @@
+"""
+Módulo del snapshot columnar de analytics: los hechos se exportan a arreglos NumPy (.npy)
+que se abren con memoria mapeada y se agregan de forma vectorizada, sin pasar por el ORM
+"""
+import glob
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+from flask import current_app
+
+from models import db, Apartamento, Cuarto, Pago, Limpieza, Gas, OcupacionCuarto
+from backend.analytics import AnalyticsManager
+
+EPOCA = datetime(1970, 1, 1)
+NULO = np.iinfo(np.int64).min  # fecha faltante
+ABIERTO = np.iinfo(np.int64).max  # intervalo de ocupación sin fecha de salida
+MANIFIESTO = 'manifest.json'
+
+
+def _segundos(fecha: datetime) -> int:
+    """Segundos desde 1970 de una fecha sin zona, igual que strftime('%s') en SQLite"""
+    return int((fecha - EPOCA).total_seconds())
+
+
+class ExportadorColumnar:
+    """Escribe y carga el snapshot: un .npy por columna y un manifiesto JSON que lo describe"""
+
+    def __init__(self, filas_por_lote: int = 50000):
+        self.filas_por_lote = filas_por_lote
+
+    def exportar(self, directorio: str = None) -> Dict:
+        """Exporta todas las tablas de hechos en una sola transacción de lectura. Los archivos
+        nuevos llevan el número de generación; el manifiesto se reemplaza al final, así que
+        quien lea el snapshot anterior no ve nunca uno a medio escribir."""
+        directorio = directorio or self._directorio_por_defecto()
+        os.makedirs(directorio, exist_ok=True)
+        generado = datetime.utcnow()
+        generacion = generado.strftime('%Y%m%dT%H%M%S%f')
+
+        # Conexión propia: la transacción de la sesión del llamador no se confirma ni se descarta
+        with db.engine.connect() as conexion:
+            conexion.exec_driver_sql("BEGIN")  # una sola vista consistente de todas las tablas
+            try:
+                tablas = {}
+                for nombre, (consulta, columnas) in self._consultas().items():
+                    tablas[nombre] = self._exportar_tabla(conexion, directorio, generacion, nombre, consulta, columnas)
+            finally:
+                conexion.rollback()
+
+        manifiesto = {
+            'version': 1,
+            'generacion': generacion,
+            'generado': generado.isoformat(),
+            'tablas': tablas
+        }
+        temporal = os.path.join(directorio, MANIFIESTO + '.tmp')
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, indent=2)
+        os.replace(temporal, os.path.join(directorio, MANIFIESTO))
+
+        # Las generaciones anteriores ya no están en el manifiesto
+        vigentes = {c['archivo'] for t in tablas.values() for c in t['columnas'].values()}
+        for archivo in glob.glob(os.path.join(directorio, '*.npy')):
+            if os.path.basename(archivo) not in vigentes:
+                os.remove(archivo)
+
+        return manifiesto
+
+    def cargar(self, directorio: str = None) -> Tuple[Dict, Dict[str, Dict[str, np.ndarray]]]:
+        """Abre el snapshot en modo solo lectura con memoria mapeada; devuelve (manifiesto, datos)"""
+        directorio = directorio or self._directorio_por_defecto()
+        with open(os.path.join(directorio, MANIFIESTO), encoding='utf-8') as f:
+            manifiesto = json.load(f)
+
+        datos = {}
+        for nombre, tabla in manifiesto['tablas'].items():
+            datos[nombre] = {
+                columna: np.load(os.path.join(directorio, info['archivo']),
+                                 mmap_mode='r' if tabla['filas'] else None)
+                for columna, info in tabla['columnas'].items()
+            }
+        return manifiesto, datos
+
+    def crear_analytics(self, directorio: str = None) -> 'AnalyticsColumnar':
+        """AnalyticsManager que calcula sobre el snapshot en lugar de la base"""
+        manifiesto, datos = self.cargar(directorio)
+        return AnalyticsColumnar(datos, manifiesto)
+
+    # Métodos privados
+    def _directorio_por_defecto(self) -> str:
+        return current_app.config.get('ANALYTICS_SNAPSHOT_DIR') or \
+            os.path.join(current_app.instance_path, 'snapshot_analytics')
+
+    def _consultas(self) -> Dict[str, Tuple]:
+        """Por tabla: la consulta (ordenada por fecha para poder cortar rangos con búsqueda
+        binaria) y el nombre y tipo de cada columna, en el mismo orden"""
+        def segundos(columna, nulo=NULO):
+            return db.func.coalesce(db.cast(db.func.strftime('%s', columna), db.BigInteger), int(nulo))
+
+        return {
+            'apartamentos': (
+                db.select(Apartamento.id, Apartamento.numero, Apartamento.renta_base)
+                .order_by(Apartamento.id),
+                [('id', np.int32), ('numero', np.int32), ('renta_base', np.float64)]
+            ),
+            'cuartos': (
+                db.select(Cuarto.id, Cuarto.apartamento_id, db.func.coalesce(Cuarto.activo, False),
+                          db.func.coalesce(Cuarto.renta, 0), segundos(Cuarto.ultimo_pago))
+                .order_by(Cuarto.id),
+                [('id', np.int32), ('apartamento_id', np.int32), ('activo', np.bool_),
+                 ('renta', np.float64), ('ultimo_pago', np.int64)]
+            ),
+            'pagos': (
+                db.select(segundos(Pago.fecha), Pago.monto, Pago.cuarto_id, Cuarto.apartamento_id)
+                .join(Cuarto, Pago.cuarto_id == Cuarto.id).order_by(Pago.fecha),
+                [('fecha', np.int64), ('monto', np.float64), ('cuarto_id', np.int32), ('apartamento_id', np.int32)]
+            ),
+            'limpiezas': (
+                db.select(segundos(Limpieza.fecha), db.func.coalesce(Limpieza.minutos, 0),
+                          Limpieza.cuarto_id, Cuarto.apartamento_id)
+                .join(Cuarto, Limpieza.cuarto_id == Cuarto.id).order_by(Limpieza.fecha),
+                [('fecha', np.int64), ('minutos', np.int32), ('cuarto_id', np.int32), ('apartamento_id', np.int32)]
+            ),
+            'gas': (
+                db.select(segundos(Gas.fecha), Gas.cuarto_id, Cuarto.apartamento_id)
+                .join(Cuarto, Gas.cuarto_id == Cuarto.id).order_by(Gas.fecha),
+                [('fecha', np.int64), ('cuarto_id', np.int32), ('apartamento_id', np.int32)]
+            ),
+            'ocupaciones': (
+                db.select(segundos(OcupacionCuarto.desde), segundos(OcupacionCuarto.hasta, ABIERTO),
+                          OcupacionCuarto.cuarto_id, Cuarto.apartamento_id)
+                .join(Cuarto, OcupacionCuarto.cuarto_id == Cuarto.id).order_by(OcupacionCuarto.desde),
+                [('desde', np.int64), ('hasta', np.int64), ('cuarto_id', np.int32), ('apartamento_id', np.int32)]
+            )
+        }
+
+    def _exportar_tabla(self, conexion, directorio, generacion, nombre, consulta, columnas) -> Dict:
+        """Escribe las columnas de una tabla por lotes directamente en archivos mapeados"""
+        filas = conexion.execute(db.select(db.func.count()).select_from(consulta.subquery())).scalar()
+        archivos = {col: f'{nombre}.{col}.{generacion}.npy' for col, _ in columnas}
+        arreglos = {col: np.lib.format.open_memmap(os.path.join(directorio, archivos[col]), mode='w+',
+                                                   dtype=tipo, shape=(filas,))
+                    if filas else np.empty(0, dtype=tipo) for col, tipo in columnas}
+
+        posicion = 0
+        resultado = conexion.execution_options(yield_per=self.filas_por_lote).execute(consulta)
+        for lote in resultado.partitions():
+            fin = posicion + len(lote)
+            for i, (col, tipo) in enumerate(columnas):
+                arreglos[col][posicion:fin] = np.fromiter((fila[i] for fila in lote), dtype=tipo, count=len(lote))
+            posicion = fin
+
+        for col, arreglo in arreglos.items():
+            if filas:
+                arreglo.flush()
+            else:
+                np.save(os.path.join(directorio, archivos[col]), arreglo)
+
+        return {
+            'filas': filas,
+            'columnas': {col: {'archivo': archivos[col], 'dtype': np.dtype(tipo).str} for col, tipo in columnas}
+        }
+
+
+class AnalyticsColumnar(AnalyticsManager):
+    """Mismos KPIs que AnalyticsManager, calculados con operaciones vectorizadas sobre el snapshot"""
+
+    def __init__(self, datos: Dict[str, Dict[str, np.ndarray]], manifiesto: Dict = None, meses_tendencia: int = 6):
+        super().__init__(meses_tendencia)
+        self.datos = datos
+        self.manifiesto = manifiesto or {}
+
+        # Índice de apartamento de cada cuarto (los ids de apartamento vienen ordenados)
+        aptos = datos['apartamentos']
+        cuartos = datos['cuartos']
+        self._indice_cuarto = np.searchsorted(aptos['id'], cuartos['apartamento_id'])
+        self._activo = np.asarray(cuartos['activo'], dtype=bool)
+
+    def obtener_actividad_mes(self, año: int = None, mes: int = None) -> List[Dict]:
+        """Limpiezas, minutos de limpieza, recargas de gas y días-cuarto ocupados del mes por apartamento"""
+        año = año or self.año_actual
+        mes = mes or self.mes_actual
+        inicio = datetime(año, mes, 1)
+        fin = datetime(año + mes // 12, mes % 12 + 1, 1)
+
+        limpiezas = self._rango('limpiezas', inicio, fin)
+        gas = self._rango('gas', inicio, fin)
+
+        # Parte de cada intervalo de ocupación que cae dentro del mes
+        ocupaciones = self.datos['ocupaciones']
+        desde = np.asarray(ocupaciones['desde'])
+        hasta = np.minimum(np.asarray(ocupaciones['hasta']), _segundos(min(fin, datetime.utcnow())))
+        segundos = np.clip(hasta - np.maximum(desde, _segundos(inicio)), 0, None)
+
+        dias_ocupados = self._por_apartamento(ocupaciones['apartamento_id'], segundos / 86400)
+        numero_limpiezas = self._por_apartamento(limpiezas['apartamento_id'])
+        minutos = self._por_apartamento(limpiezas['apartamento_id'], limpiezas['minutos'])
+        recargas_gas = self._por_apartamento(gas['apartamento_id'])
+
+        return [{
+            'apartamento': int(numero),
+            'limpiezas': int(numero_limpiezas[i]),
+            'minutos_limpieza': int(minutos[i]),
+            'recargas_gas': int(recargas_gas[i]),
+            'dias_ocupados': round(float(dias_ocupados[i]), 1)
+        } for i, numero in enumerate(self.datos['apartamentos']['numero'])]
+
+    # Métodos privados
+    def _rango(self, tabla: str, inicio: datetime = None, fin: datetime = None) -> Dict[str, np.ndarray]:
+        """Filas con fecha en [inicio, fin) por búsqueda binaria (el snapshot viene ordenado por fecha)"""
+        columnas = self.datos[tabla]
+        fechas = columnas['fecha']
+        a = np.searchsorted(fechas, _segundos(inicio)) if inicio else 0
+        b = np.searchsorted(fechas, _segundos(fin)) if fin else len(fechas)
+        return {col: arreglo[a:b] for col, arreglo in columnas.items()}
+
+    def _por_apartamento(self, apartamento_ids: np.ndarray, pesos: np.ndarray = None) -> np.ndarray:
+        """Suma (o cuenta, sin pesos) agrupada por apartamento, en el orden del snapshot"""
+        aptos = self.datos['apartamentos']['id']
+        return np.bincount(np.searchsorted(aptos, apartamento_ids), weights=pesos, minlength=len(aptos))
+
+    def _consultar_rentabilidades(self, apartamento_ids: List[int] = None) -> Tuple[List[Tuple], Dict[int, float]]:
+        inicio_mes = datetime(self.año_actual, self.mes_actual, 1)
+        fin_mes = datetime(self.año_actual + self.mes_actual // 12, self.mes_actual % 12 + 1, 1)
+        limite_puntual = _segundos(self.hoy - timedelta(days=6))  # (hoy - ultimo_pago).days <= 5
+
+        aptos = self.datos['apartamentos']
+        cuartos = self.datos['cuartos']
+        indice = self._indice_cuarto
+        n = len(aptos['id'])
+        activo = self._activo
+        ultimo_pago = np.asarray(cuartos['ultimo_pago'])
+
+        total = np.bincount(indice, minlength=n)
+        activos = np.bincount(indice, weights=activo, minlength=n)
+        potenciales = np.bincount(indice, weights=np.where(activo, cuartos['renta'], 0), minlength=n)
+        con_pago = np.bincount(indice, weights=activo & (ultimo_pago != NULO), minlength=n)
+        puntuales = np.bincount(indice, weights=activo & (ultimo_pago > limite_puntual), minlength=n)
+
+        pagos = self._rango('pagos', inicio_mes, fin_mes)
+        ingresos = self._por_apartamento(pagos['apartamento_id'], pagos['monto'])
+
+        seleccion = np.arange(n) if apartamento_ids is None else np.flatnonzero(np.isin(aptos['id'], apartamento_ids))
+        filas = [(int(aptos['id'][i]), int(aptos['numero'][i]), int(total[i]), int(activos[i]),
+                  float(potenciales[i]), int(con_pago[i]), int(puntuales[i])) for i in seleccion]
+        return filas, {int(aptos['id'][i]): float(ingresos[i]) for i in seleccion}
+
+    def _consultar_oportunidades(self) -> List[Tuple]:
+        aptos = self.datos['apartamentos']
+        cuartos = self.datos['cuartos']
+        indice = self._indice_cuarto
+        n = len(aptos['id'])
+        activo = self._activo
+        ultimo_pago = np.asarray(cuartos['ultimo_pago'])
+        renta = np.asarray(cuartos['renta'])
+
+        atrasado = activo & (ultimo_pago != NULO) & (ultimo_pago <= _segundos(self.hoy - timedelta(days=6)))
+        total = np.bincount(indice, minlength=n)
+        activos = np.bincount(indice, weights=activo, minlength=n)
+        renta_activa = np.bincount(indice, weights=np.where(activo, renta, 0), minlength=n)
+        atrasados = np.bincount(indice, weights=atrasado, minlength=n)
+        renta_atrasada = np.bincount(indice, weights=np.where(atrasado, renta, 0), minlength=n)
+        promedio = np.divide(renta_activa, activos, out=np.zeros(n), where=activos > 0)
+
+        return [(int(aptos['numero'][i]), float(aptos['renta_base'][i]), int(total[i] - activos[i]),
+                 int(activos[i]), float(promedio[i]), int(atrasados[i]), float(renta_atrasada[i]))
+                for i in range(n)]
+
+    def _calcular_renta_activa(self) -> float:
+        return float(np.sum(self.datos['cuartos']['renta'], where=self._activo))
+
+    def _consultar_meses(self, desde: Tuple[int, int]) -> Dict[Tuple[int, int], Tuple[float, int]]:
+        pagos = self._rango('pagos', datetime(desde[0], desde[1], 1))
+        if not len(pagos['fecha']):
+            return {}
+        meses = np.asarray(pagos['fecha']).astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+        claves, inverso = np.unique(meses, return_inverse=True)
+        ingresos = np.bincount(inverso, weights=pagos['monto'])
+        # Cuartos distintos por mes: pares (mes, cuarto) únicos codificados en un solo entero
+        cuarto_ids = np.asarray(pagos['cuarto_id'], dtype=np.int64)
+        base = int(cuarto_ids.max()) + 1
+        pares = np.unique(inverso * base + cuarto_ids)
+        cuartos = np.bincount(pares // base, minlength=len(claves))
+        return {(1970 + int(m) // 12, int(m) % 12 + 1): (float(ingresos[i]), int(cuartos[i]))
+                for i, m in enumerate(claves)}
+
+    def _calcular_ingresos_totales_mes(self) -> float:
+        inicio = datetime(self.año_actual, self.mes_actual, 1)
+        fin = datetime(self.año_actual + self.mes_actual // 12, self.mes_actual % 12 + 1, 1)
+        return float(np.sum(self._rango('pagos', inicio, fin)['monto']))
+
+    def _calcular_ingresos_totales_año(self) -> float:
+        inicio = datetime(self.año_actual, 1, 1)
+        return float(np.sum(self._rango('pagos', inicio, datetime(self.año_actual + 1, 1, 1))['monto']))
+
+# Instancia global del exportador columnar
+exportador_columnar = ExportadorColumnar()
@@ -0,0 +1,310 @@
+"""
+Módulo del calendario de cuotas: materializa las fechas de pago de cada contrato. Las cuotas
+pertenecen a la estadía (OcupacionCuarto) en que se generaron, no solo al cuarto.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from models import db, iniciar_escritura, Apartamento, Cuarto, CuotaPago, OcupacionCuarto
+from backend.cuentas import libro_cuentas
+
+
+def sumar_meses(fecha: date, meses: int, dia_ancla: int = None) -> date:
+    """Suma meses de calendario conservando el día (ajustado al fin de mes)"""
+    dia_ancla = dia_ancla or fecha.day
+    mes = fecha.month - 1 + meses
+    año = fecha.year + mes // 12
+    mes = mes % 12 + 1
+    return date(año, mes, min(dia_ancla, calendar.monthrange(año, mes)[1]))
+
+
+class CalendarioPagos:
+    """Genera y consulta las cuotas de pago de los contratos activos"""
+
+    def __init__(self, horizonte_meses: int = 3):
+        self.horizonte_meses = horizonte_meses
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Asigna su estadía a las cuotas generadas antes de que existiera la columna
+        (va después de historial_ocupacion.iniciar, que abre las estadías faltantes)"""
+        if self._iniciado:
+            return
+        with app.app_context():
+            self.asignar_estadias()
+        self._iniciado = True
+
+    def asignar_estadias(self) -> int:
+        """Cuotas sin estadía: la última estadía del cuarto que empezó a más tardar el día del
+        vencimiento, o la primera del cuarto si todas empezaron después"""
+        cuota = CuotaPago.__table__
+        ocupacion = OcupacionCuarto.__table__
+        anterior = db.select(ocupacion.c.id).where(
+            ocupacion.c.cuarto_id == cuota.c.cuarto_id,
+            db.func.date(ocupacion.c.desde) <= cuota.c.fecha_vencimiento
+        ).order_by(ocupacion.c.desde.desc()).limit(1).scalar_subquery()
+        primera = db.select(ocupacion.c.id).where(ocupacion.c.cuarto_id == cuota.c.cuarto_id)\
+            .order_by(ocupacion.c.desde).limit(1).scalar_subquery()
+        resultado = db.session.execute(
+            cuota.update().where(cuota.c.ocupacion_id.is_(None))
+            .values(ocupacion_id=db.func.coalesce(anterior, primera))
+        )
+        db.session.commit()
+        return resultado.rowcount
+
+    def fechas_cuotas(self, inicio: date, tipo_contrato: str, hasta: date) -> List[date]:
+        """Fechas de vencimiento posteriores a `inicio` hasta `hasta` inclusive"""
+        fechas = []
+        n = 1
+        while True:
+            if tipo_contrato == "quincenal":
+                fecha = inicio + timedelta(days=15 * n)
+            else:
+                fecha = sumar_meses(inicio, n)
+            if fecha > hasta:
+                return fechas
+            fechas.append(fecha)
+            n += 1
+
+    def generar_cuotas(self, cuarto: Cuarto, hasta: date = None, desde: date = None,
+                       ancla: date = None, incluir_ancla: bool = False,
+                       ocupacion_id: int = None) -> List[CuotaPago]:
+        """Agrega a la sesión las cuotas del cuarto posteriores a `desde`, contadas desde
+        `ancla` (por defecto la fecha de entrada), en la estadía indicada (por defecto la abierta)"""
+        hasta = hasta or self._fecha_horizonte()
+        ancla = ancla or cuarto.fecha_entrada or cuarto.proximo_pago
+        if not cuarto.activo or ancla is None:
+            return []
+
+        ancla = ancla.date() if isinstance(ancla, datetime) else ancla
+        fechas = self.fechas_cuotas(ancla, cuarto.tipo_contrato, hasta)
+        if incluir_ancla:
+            fechas.insert(0, ancla)
+        if ocupacion_id is None:
+            ocupacion_id = self._estadias_abiertas([cuarto.id]).get(cuarto.id)
+
+        cuotas = []
+        for fecha in fechas:
+            if desde is not None and fecha <= desde:
+                continue
+            cuotas.append(CuotaPago(
+                cuarto_id=cuarto.id,
+                ocupacion_id=ocupacion_id,
+                fecha_vencimiento=fecha,
+                monto=cuarto.renta,
+                estado='pendiente'
+            ))
+        db.session.add_all(cuotas)
+        return cuotas
+
+    def reiniciar_contrato(self, cuarto: Cuarto):
+        """Cierra las cuotas del contrato anterior y genera las del nuevo. El flush abre antes
+        la estadía nueva (historial de ocupación), a la que quedan asignadas las cuotas."""
+        self.cerrar_estadia(cuarto.id)
+        db.session.flush()
+        return self.generar_cuotas(cuarto, desde=self._ultima_cuota(cuarto.id))
+
+    def cerrar_estadia(self, cuarto_id: int) -> int:
+        """Al liberar el cuarto o cambiar de contrato: elimina las cuotas que aún no vencen y
+        pasa las vencidas sin pagar al libro de cuentas como cargos (estado 'transferida'),
+        para que los pagos del siguiente inquilino no las salden. Devuelve las transferidas."""
+        # El saldo del cuarto se lee y se escribe bajo el mismo candado
+        iniciar_escritura()
+        self.cancelar_futuras(cuarto_id)
+        vencidas = CuotaPago.query.filter(
+            CuotaPago.cuarto_id == cuarto_id,
+            CuotaPago.estado == 'pendiente'
+        ).order_by(CuotaPago.fecha_vencimiento).all()
+        libro_cuentas.contabilizar_cuotas(vencidas)
+        for cuota in vencidas:
+            cuota.estado = 'transferida'
+        return len(vencidas)
+
+    def cancelar_futuras(self, cuarto_id: int) -> int:
+        """Elimina las cuotas pendientes que aún no vencen (p. ej. al liberar el cuarto).
+        Las ya vencidas se conservan porque siguen siendo deuda."""
+        return CuotaPago.query.filter(
+            CuotaPago.cuarto_id == cuarto_id,
+            CuotaPago.estado == 'pendiente',
+            CuotaPago.fecha_vencimiento >= datetime.utcnow().date()
+        ).delete(synchronize_session=False)
+
+    def aplicar_pago(self, cuarto_id: int, monto: float, fecha_pago: datetime = None) -> List[CuotaPago]:
+        """Aplica un pago a las cuotas pendientes más antiguas de la estadía actual del cuarto"""
+        return self.aplicar_pagos([(cuarto_id, monto, fecha_pago or datetime.utcnow())])
+
+    def aplicar_pagos(self, pagos: List[tuple]) -> List[CuotaPago]:
+        """Aplica varios pagos (cuarto_id, monto, fecha) cargando las cuotas pendientes en una consulta"""
+        if not pagos:
+            return []
+
+        # Solo las cuotas de la estadía abierta: la deuda de inquilinos anteriores no se salda
+        # con pagos del actual
+        pendientes: Dict[int, List[CuotaPago]] = {}
+        for cuota in CuotaPago.query.join(OcupacionCuarto, CuotaPago.ocupacion_id == OcupacionCuarto.id).filter(
+            CuotaPago.cuarto_id.in_({cuarto_id for cuarto_id, _, _ in pagos}),
+            OcupacionCuarto.hasta.is_(None),
+            CuotaPago.estado == 'pendiente'
+        ).order_by(CuotaPago.fecha_vencimiento).all():
+            pendientes.setdefault(cuota.cuarto_id, []).append(cuota)
+
+        afectadas = []
+        for cuarto_id, monto, fecha_pago in sorted(pagos, key=lambda p: p[2]):
+            restante = monto
+            cuotas = pendientes.get(cuarto_id, [])
+            while cuotas and restante > 0:
+                cuota = cuotas[0]
+                abono = min(restante, cuota.monto - (cuota.monto_pagado or 0))
+                cuota.monto_pagado = (cuota.monto_pagado or 0) + abono
+                restante -= abono
+                if cuota.monto_pagado >= cuota.monto - 0.005:
+                    cuota.estado = 'pagada'
+                    cuota.fecha_pago = fecha_pago
+                    cuotas.pop(0)
+                afectadas.append(cuota)
+        return afectadas
+
+    def proximos_vencimientos(self, cuarto_ids: List[int]) -> Dict[int, date]:
+        """Vencimiento de la cuota pendiente más antigua de la estadía actual de cada cuarto"""
+        if not cuarto_ids:
+            return {}
+        return {
+            cuarto_id: self._a_fecha(fecha)
+            for cuarto_id, fecha in db.session.query(CuotaPago.cuarto_id, db.func.min(CuotaPago.fecha_vencimiento))
+            .join(OcupacionCuarto, CuotaPago.ocupacion_id == OcupacionCuarto.id)
+            .filter(CuotaPago.cuarto_id.in_(cuarto_ids), OcupacionCuarto.hasta.is_(None),
+                    CuotaPago.estado == 'pendiente')
+            .group_by(CuotaPago.cuarto_id).all()
+        }
+
+    def extender_horizonte(self, meses: int = None, hasta: date = None) -> int:
+        """Genera las cuotas faltantes de todos los cuartos activos hasta el horizonte
+        (o hasta la fecha indicada)"""
+        hasta = hasta or self._fecha_horizonte(meses)
+
+        # Primera y última cuota de la estadía abierta de cada cuarto, y última del cuarto
+        # (de estadías anteriores), en consultas agrupadas
+        estadias = self._estadias_abiertas()
+        extremos = {
+            cuarto_id: (self._a_fecha(primera), self._a_fecha(ultima))
+            for cuarto_id, primera, ultima in db.session.query(
+                CuotaPago.cuarto_id, db.func.min(CuotaPago.fecha_vencimiento), db.func.max(CuotaPago.fecha_vencimiento)
+            ).join(OcupacionCuarto, CuotaPago.ocupacion_id == OcupacionCuarto.id)
+            .filter(OcupacionCuarto.hasta.is_(None)).group_by(CuotaPago.cuarto_id).all()
+        }
+        ultimas = {
+            cuarto_id: self._a_fecha(ultima)
+            for cuarto_id, ultima in db.session.query(CuotaPago.cuarto_id, db.func.max(CuotaPago.fecha_vencimiento))
+            .group_by(CuotaPago.cuarto_id).all()
+        }
+
+        total = 0
+        for cuarto in Cuarto.query.filter_by(activo=True).all():
+            primera, desde = extremos.get(cuarto.id, (None, None))
+            if desde is not None and desde >= hasta:
+                continue
+            if desde is None:
+                # Estadías sin calendario: empezar en su próximo pago, no reconstruir el pasado
+                # ni repetir fechas de la estadía anterior
+                ancla = cuarto.proximo_pago
+                desde_cuarto = ultimas.get(cuarto.id)
+            else:
+                # Continuar con el mismo ancla con que se generó el calendario existente
+                ancla = self._ancla_calendario(cuarto, primera)
+                desde_cuarto = desde
+            total += len(self.generar_cuotas(cuarto, hasta=hasta, desde=desde_cuarto, ancla=ancla,
+                                             incluir_ancla=desde is None,
+                                             ocupacion_id=estadias.get(cuarto.id)))
+
+        db.session.commit()
+        return total
+
+    def cuotas_por_vencer(self, dias: int = 3, hoy: date = None) -> List[Dict]:
+        """Cuotas pendientes que vencen entre hoy y hoy + dias"""
+        hoy = hoy or datetime.utcnow().date()
+        filas = db.session.query(CuotaPago, Cuarto, Apartamento.numero)\
+            .join(Cuarto, CuotaPago.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(
+                CuotaPago.estado == 'pendiente',
+                CuotaPago.fecha_vencimiento >= hoy,
+                CuotaPago.fecha_vencimiento < hoy + timedelta(days=dias + 1)
+            ).order_by(CuotaPago.fecha_vencimiento).all()
+
+        return [self._cuota_a_dict(cuota, cuarto, apto_num) for cuota, cuarto, apto_num in filas]
+
+    def cuotas_vencidas(self, hoy: date = None, limite: int = None) -> List[Dict]:
+        """Cuotas pendientes con vencimiento anterior a hoy"""
+        hoy = hoy or datetime.utcnow().date()
+        query = db.session.query(CuotaPago, Cuarto, Apartamento.numero)\
+            .join(Cuarto, CuotaPago.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(CuotaPago.estado == 'pendiente', CuotaPago.fecha_vencimiento < hoy)\
+            .order_by(CuotaPago.fecha_vencimiento)
+        if limite:
+            query = query.limit(limite)
+
+        return [self._cuota_a_dict(cuota, cuarto, apto_num) for cuota, cuarto, apto_num in query.all()]
+
+    def monto_vencido_por_apartamento(self, hoy: date = None) -> List[Dict]:
+        """Suma de lo vencido y no pagado agrupada por apartamento"""
+        hoy = hoy or datetime.utcnow().date()
+        filas = db.session.query(
+            Apartamento.numero,
+            db.func.count(CuotaPago.id),
+            db.func.sum(CuotaPago.monto - db.func.coalesce(CuotaPago.monto_pagado, 0))
+        ).join(Cuarto, CuotaPago.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(CuotaPago.estado == 'pendiente', CuotaPago.fecha_vencimiento < hoy)\
+            .group_by(Apartamento.numero).order_by(Apartamento.numero).all()
+
+        return [{
+            'apartamento': numero,
+            'cuotas_vencidas': cuotas,
+            'monto_vencido': round(float(monto or 0), 2)
+        } for numero, cuotas, monto in filas]
+
+    # Métodos privados
+    def _fecha_horizonte(self, meses: int = None) -> date:
+        return sumar_meses(datetime.utcnow().date(), meses or self.horizonte_meses)
+
+    def _ancla_calendario(self, cuarto: Cuarto, primera: date) -> date:
+        """La fecha de entrada si la primera cuota sale de ella; si no (calendarios que empezaron
+        en el próximo pago), la primera cuota"""
+        entrada = cuarto.fecha_entrada.date() if cuarto.fecha_entrada else None
+        if entrada and self.fechas_cuotas(entrada, cuarto.tipo_contrato, primera)[:1] == [primera]:
+            return entrada
+        return primera
+
+    def _a_fecha(self, valor) -> Optional[date]:
+        if valor is None or isinstance(valor, date):
+            return valor
+        return date.fromisoformat(str(valor))
+
+    def _estadias_abiertas(self, cuarto_ids: List[int] = None) -> Dict[int, int]:
+        """Id de la estadía abierta de cada cuarto"""
+        query = db.session.query(OcupacionCuarto.cuarto_id, OcupacionCuarto.id)\
+            .filter(OcupacionCuarto.hasta.is_(None))
+        if cuarto_ids is not None:
+            query = query.filter(OcupacionCuarto.cuarto_id.in_(cuarto_ids))
+        return dict(query.all())
+
+    def _ultima_cuota(self, cuarto_id: int) -> Optional[date]:
+        return db.session.query(db.func.max(CuotaPago.fecha_vencimiento))\
+            .filter(CuotaPago.cuarto_id == cuarto_id).scalar()
+
+    def _cuota_a_dict(self, cuota: CuotaPago, cuarto: Cuarto, apto_num: int) -> Dict:
+        return {
+            'id': cuota.id,
+            'apartamento': apto_num,
+            'cuarto': cuarto.numero,
+            'inquilino': cuarto.inquilino,
+            'fecha_vencimiento': cuota.fecha_vencimiento.isoformat(),
+            'monto': cuota.monto,
+            'monto_pagado': cuota.monto_pagado or 0,
+            'estado': cuota.estado
+        }
+
+# Instancia global del calendario
+calendario_pagos = CalendarioPagos()
@@ -0,0 +1,161 @@
+"""
+Módulo de cohortes de inquilinos: retención por mes de entrada y rotación mensual, a partir
+de los intervalos de ocupación y con funciones de ventana en SQL
+"""
+import threading
+from datetime import date, datetime
+from typing import Dict, List
+
+import numpy as np
+
+from models import db, OcupacionCuarto
+from backend.calendario_pagos import sumar_meses
+
+
+class AnalisisCohortes:
+    """Cohortes (mes de entrada × meses de permanencia) y rotación, en caché por mes"""
+
+    def __init__(self):
+        self._cache = {}
+        self._candado = threading.Lock()
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Registra los eventos que descartan la caché cuando cambian las estadías"""
+        if self._iniciado:
+            return
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._iniciado = True
+
+    def obtener_cohortes(self, meses: int = 12) -> Dict:
+        """Retención de las cohortes de los últimos `meses` meses y rotación mensual del mismo
+        período, con los datos listos para graficar"""
+        ahora = datetime.utcnow()
+        clave = (ahora.strftime('%Y-%m'), meses)
+        with self._candado:
+            if clave in self._cache:
+                return self._cache[clave]
+
+        mes_actual = date(ahora.year, ahora.month, 1)
+        etiquetas = [sumar_meses(mes_actual, i - meses).strftime('%Y-%m') for i in range(meses + 1)]
+        cohortes = self._consultar_retencion(etiquetas, ahora)
+        rotacion = self._consultar_rotacion(etiquetas, ahora)
+        resultado = {
+            'mes_calculo': clave[0],
+            'cohortes': cohortes,
+            'rotacion': rotacion,
+            'grafico': {
+                'meses_permanencia': [f'Mes {k}' for k in range(meses + 1)],
+                'retencion': [{'cohorte': c['cohorte'], 'datos': c['retencion']} for c in cohortes],
+                'meses': [r['mes'] for r in rotacion],
+                'bajas': [r['bajas'] for r in rotacion],
+                'tasa_rotacion': [r['tasa_rotacion'] for r in rotacion]
+            }
+        }
+
+        with self._candado:
+            self._cache = {k: v for k, v in self._cache.items() if k[0] == clave[0]}
+            self._cache[clave] = resultado
+        return resultado
+
+    def invalidar(self):
+        """Descarta las cohortes en caché"""
+        with self._candado:
+            self._cache = {}
+
+    # Métodos privados
+    def _indice_mes(self, columna):
+        """Meses desde el año 0 de una fecha, en SQL"""
+        return db.cast(db.func.strftime('%Y', columna), db.Integer) * 12 + \
+            db.cast(db.func.strftime('%m', columna), db.Integer)
+
+    def _consultar_retencion(self, etiquetas: List[str], ahora: datetime) -> List[Dict]:
+        """Por cohorte y meses de permanencia, cuántos inquilinos siguieron al menos esos meses:
+        una suma acumulada descendente (ventana) sobre los conteos agrupados"""
+        cohorte = db.func.strftime('%Y-%m', OcupacionCuarto.desde)
+        permanencia = self._indice_mes(db.func.coalesce(OcupacionCuarto.hasta, ahora)) - \
+            self._indice_mes(OcupacionCuarto.desde)
+        conteos = db.session.query(cohorte.label('cohorte'), permanencia.label('meses'),
+                                   db.func.count().label('inquilinos'))\
+            .filter(OcupacionCuarto.desde >= datetime.strptime(etiquetas[0], '%Y-%m'))\
+            .group_by(cohorte, permanencia).subquery()
+        retenidos = db.func.sum(conteos.c.inquilinos).over(
+            partition_by=conteos.c.cohorte, order_by=conteos.c.meses.desc())
+        filas = db.session.query(conteos.c.cohorte, conteos.c.meses, retenidos)\
+            .order_by(conteos.c.cohorte, conteos.c.meses).all()
+
+        por_cohorte = {}
+        for nombre, meses, acumulado in filas:
+            por_cohorte.setdefault(nombre, ([], []))
+            por_cohorte[nombre][0].append(meses)
+            por_cohorte[nombre][1].append(acumulado)
+
+        maximo = len(etiquetas) - 1
+        k = np.arange(maximo + 1)
+        resultado = []
+        for edad, nombre in zip(range(maximo, -1, -1), etiquetas):
+            if nombre not in por_cohorte:
+                continue
+            meses, acumulado = (np.array(v) for v in por_cohorte[nombre])
+            # Retenidos en el mes k: los de la menor permanencia registrada que sea >= k
+            posicion = np.searchsorted(meses, k)
+            cuenta = np.append(acumulado, 0)[posicion].tolist()
+            tamaño = int(acumulado[0])
+            resultado.append({
+                'cohorte': nombre,
+                'inquilinos': tamaño,
+                'retenidos': [int(c) if i <= edad else None for i, c in enumerate(cuenta)],
+                'retencion': [round(c / tamaño * 100, 1) if i <= edad else None for i, c in enumerate(cuenta)]
+            })
+        return resultado
+
+    def _consultar_rotacion(self, etiquetas: List[str], ahora: datetime) -> List[Dict]:
+        """Altas y bajas por mes y activos al cierre como suma acumulada (ventana) de altas - bajas"""
+        eventos = db.union_all(
+            db.select(db.func.strftime('%Y-%m', OcupacionCuarto.desde).label('mes'),
+                      db.literal(1).label('alta'), db.literal(0).label('baja')),
+            db.select(db.func.strftime('%Y-%m', OcupacionCuarto.hasta).label('mes'),
+                      db.literal(0).label('alta'), db.literal(1).label('baja'))
+            .where(OcupacionCuarto.hasta.isnot(None))
+        ).subquery()
+        por_mes = db.select(eventos.c.mes, db.func.sum(eventos.c.alta).label('altas'),
+                            db.func.sum(eventos.c.baja).label('bajas'))\
+            .group_by(eventos.c.mes).subquery()
+        activos = db.func.sum(por_mes.c.altas - por_mes.c.bajas).over(order_by=por_mes.c.mes)
+        filas = db.session.execute(db.select(por_mes.c.mes, por_mes.c.altas, por_mes.c.bajas, activos)
+                                   .order_by(por_mes.c.mes)).all()
+
+        # Los meses sin movimientos conservan los activos del último mes con datos
+        meses = [f[0] for f in filas]
+        posiciones = np.searchsorted(meses, etiquetas, side='right') - 1
+        por_mes_dict = {f[0]: f for f in filas}
+        resultado = []
+        for etiqueta, posicion in zip(etiquetas, posiciones):
+            activos_cierre = int(filas[posicion][3]) if posicion >= 0 else 0
+            _, altas, bajas, _ = por_mes_dict.get(etiqueta, (etiqueta, 0, 0, 0))
+            activos_inicio = activos_cierre - int(altas) + int(bajas)
+            resultado.append({
+                'mes': etiqueta,
+                'activos_inicio': activos_inicio,
+                'altas': int(altas),
+                'bajas': int(bajas),
+                'tasa_rotacion': round(bajas / activos_inicio * 100, 1) if activos_inicio else None
+            })
+        return resultado
+
+    def _al_hacer_flush(self, session, flush_context):
+        if any(isinstance(obj, OcupacionCuarto)
+               for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+            session.info['cohortes_sucias'] = True
+
+    def _al_hacer_commit(self, session):
+        if session.info.pop('cohortes_sucias', False):
+            self.invalidar()
+
+    def _al_hacer_rollback(self, session):
+        session.info.pop('cohortes_sucias', None)
+
+# Instancia global del análisis de cohortes
+analisis_cohortes = AnalisisCohortes()
@@ -0,0 +1,134 @@
+"""
+Módulo de conciliación de pagos contra solicitudes de pago abiertas
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from models import db, iniciar_escritura, AplicacionPago, Pago, SolicitudPago
+
+ESTADOS_ABIERTOS = ('pendiente', 'vencido')
+TOLERANCIA = 0.005
+
+
+class ConciliacionPagos:
+    """Asigna pagos a solicitudes por cuarto, monto y ventana de fechas, en una sola pasada"""
+
+    def __init__(self, ventana_dias: int = 45, limite_reporte: int = 100):
+        self.ventana_dias = ventana_dias
+        self.limite_reporte = limite_reporte
+
+    def conciliar(self, pagos: List[Pago] = None, ventana_dias: int = None) -> Dict:
+        """Concilia los pagos dados (ya guardados) o, sin argumento, todos los pagos con saldo
+        sin aplicar dentro de la ventana de alguna solicitud abierta. Con pagos dados solo se
+        cargan (y se reportan) las solicitudes de sus cuartos. No hace commit."""
+        ventana = timedelta(days=ventana_dias or self.ventana_dias)
+        ahora = datetime.utcnow()
+
+        # Leer saldos y aplicar bajo el candado de escritura: dos conciliaciones a la vez
+        # no pueden aplicar el mismo saldo (la transacción queda abierta hasta el commit del llamador)
+        iniciar_escritura()
+
+        # Solicitudes abiertas con lo ya aplicado, agrupadas por cuarto (más antigua primero)
+        query = db.session.query(
+            SolicitudPago, db.func.coalesce(db.func.sum(AplicacionPago.monto), 0)
+        ).outerjoin(AplicacionPago, AplicacionPago.solicitud_id == SolicitudPago.id)\
+            .filter(SolicitudPago.estado.in_(ESTADOS_ABIERTOS))
+        if pagos is not None:
+            query = query.filter(SolicitudPago.cuarto_id.in_({p.cuarto_id for p in pagos}))
+        abiertas: Dict[int, List[Dict]] = {}
+        for solicitud, aplicado in query.group_by(SolicitudPago.id).all():
+            abiertas.setdefault(solicitud.cuarto_id, []).append({
+                'solicitud': solicitud,
+                'vencimiento': solicitud.fecha_vencimiento or solicitud.fecha_solicitud or ahora,
+                'restante': round(solicitud.monto - aplicado, 2)
+            })
+        for solicitudes in abiertas.values():
+            solicitudes.sort(key=lambda s: (s['vencimiento'], s['solicitud'].id))
+
+        candidatos = self._pagos_con_saldo(pagos, abiertas, ventana)
+
+        aplicaciones = []
+        sin_conciliar = []
+        for pago, saldo in candidatos:
+            fecha = pago.fecha or ahora
+            en_ventana = [s for s in abiertas.get(pago.cuarto_id, [])
+                          if s['restante'] > TOLERANCIA and abs(fecha - s['vencimiento']) <= ventana]
+
+            # Primero una solicitud con el monto exacto; si no, de la más antigua a la más nueva
+            exacta = next((s for s in en_ventana if abs(s['restante'] - saldo) <= TOLERANCIA), None)
+            for s in ([exacta] if exacta else en_ventana):
+                if saldo <= TOLERANCIA:
+                    break
+                abono = round(min(saldo, s['restante']), 2)
+                s['restante'] = round(s['restante'] - abono, 2)
+                saldo = round(saldo - abono, 2)
+                aplicaciones.append({'pago_id': pago.id, 'solicitud_id': s['solicitud'].id,
+                                     'monto': abono, 'fecha': ahora})
+
+            if saldo > TOLERANCIA:
+                sin_conciliar.append({
+                    'pago_id': pago.id,
+                    'cuarto_id': pago.cuarto_id,
+                    'fecha': fecha.strftime('%d/%m/%Y'),
+                    'monto': pago.monto,
+                    'sin_aplicar': saldo
+                })
+
+        # Un INSERT en lote para las aplicaciones; los estados se guardan con el flush
+        if aplicaciones:
+            db.session.execute(db.insert(AplicacionPago), aplicaciones)
+        tocadas = {a['solicitud_id'] for a in aplicaciones}
+        pagadas = [s for solicitudes in abiertas.values() for s in solicitudes
+                   if s['solicitud'].id in tocadas and s['restante'] <= TOLERANCIA]
+        for s in pagadas:
+            s['solicitud'].estado = 'pagado'
+
+        pendientes = [s for solicitudes in abiertas.values() for s in solicitudes
+                      if s['restante'] > TOLERANCIA]
+        return {
+            'pagos_revisados': len(candidatos),
+            'aplicaciones': len(aplicaciones),
+            'monto_aplicado': round(sum(a['monto'] for a in aplicaciones), 2),
+            'solicitudes_pagadas': len(pagadas),
+            'solicitudes_parciales': sum(1 for s in pendientes if s['solicitud'].id in tocadas),
+            'pagos_sin_conciliar': len(sin_conciliar),
+            'solicitudes_sin_pago': len(pendientes),
+            'detalle_pagos_sin_conciliar': sin_conciliar[:self.limite_reporte],
+            'detalle_solicitudes_sin_pago': [{
+                'solicitud_id': s['solicitud'].id,
+                'cuarto_id': s['solicitud'].cuarto_id,
+                'vencimiento': s['vencimiento'].strftime('%d/%m/%Y'),
+                'monto': s['solicitud'].monto,
+                'restante': s['restante']
+            } for s in pendientes[:self.limite_reporte]]
+        }
+
+    # Métodos privados
+    def _pagos_con_saldo(self, pagos, abiertas, ventana) -> List[tuple]:
+        """Pagos con monto sin aplicar, ordenados por fecha, en una consulta"""
+        aplicado = db.session.query(
+            AplicacionPago.pago_id, db.func.sum(AplicacionPago.monto).label('monto')
+        ).group_by(AplicacionPago.pago_id).subquery()
+        query = db.session.query(Pago, Pago.monto - db.func.coalesce(aplicado.c.monto, 0))\
+            .outerjoin(aplicado, aplicado.c.pago_id == Pago.id)
+
+        if pagos is not None:
+            ids = [p.id for p in pagos]
+            if not ids:
+                return []
+            query = query.filter(Pago.id.in_(ids))
+        else:
+            vencimientos = [s['vencimiento'] for solicitudes in abiertas.values() for s in solicitudes]
+            if not vencimientos:
+                return []
+            query = query.filter(
+                Pago.cuarto_id.in_(list(abiertas)),
+                Pago.fecha >= min(vencimientos) - ventana,
+                Pago.fecha <= max(vencimientos) + ventana
+            )
+
+        return [(pago, round(saldo, 2)) for pago, saldo in
+                query.order_by(Pago.fecha, Pago.id).all() if saldo > TOLERANCIA]
+
+# Instancia global de conciliación
+conciliacion_pagos = ConciliacionPagos()
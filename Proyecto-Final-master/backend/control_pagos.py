@@ -1,13 +1,39 @@
 """
 Módulo para el control de pagos, recordatorios y cálculo de fechas
 """
-from datetime import datetime, timedelta
-from models import db, Cuarto, Pago, Notificacion
-from backend.notificaciones import SistemaNotificaciones
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from models import db, iniciar_escritura, Apartamento, Cuarto, CuotaPago, Pago, PagoDiario, Notificacion, SolicitudPago
+from backend.notificaciones import sistema_notificaciones
+from backend.calendario_pagos import calendario_pagos, sumar_meses
+from backend.recordatorios import programador_recordatorios
 
 class ControlPagos:
-    def __init__(self):
-        self.sistema_notificaciones = SistemaNotificaciones()
+    # Tope de cuartos por grupo en el resumen (también acota las entradas de la caché)
+    LIMITE_RESUMEN_MAXIMO = 500
+    
+    def __init__(self, segundos_cache_resumen=30):
+        self.sistema_notificaciones = sistema_notificaciones
+        self.segundos_cache_resumen = segundos_cache_resumen
+        self._cache_resumen = {}
+        self._version_resumen = 0
+        self._candado_resumen = threading.Lock()
+        self._iniciado = False
+    
+    def iniciar(self, app):
+        """
+        Registra los eventos de sesión que invalidan el resumen al haber pagos o
+        cambios en los cuartos (asignaciones, liberaciones)
+        """
+        if self._iniciado:
+            return
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._iniciado = True
     
     def verificar_pago_duplicado(self, cuarto_id, fecha_pago):
         """
@@ -26,7 +52,8 @@ class ControlPagos:
     
     def calcular_proximo_pago(self, fecha_entrada, tipo_contrato, ultimo_pago=None):
         """
-        Calcula la fecha del próximo pago basado en el tipo de contrato
+        Calcula la fecha del próximo pago con los mismos pasos que el calendario de cuotas;
+        se usa cuando la estadía no tiene cuotas pendientes (ver sincronizar_proximo_pago)
         """
         if ultimo_pago:
             fecha_base = ultimo_pago
@@ -37,18 +64,36 @@ class ControlPagos:
             # Cada 15 días
             return fecha_base + timedelta(days=15)
         else:  # mensual
-            # Cada 30 días (aproximadamente un mes)
-            return fecha_base + timedelta(days=30)
+            # Un mes de calendario, conservando el día de entrada
+            siguiente = sumar_meses(fecha_base.date(), 1, fecha_entrada.day)
+            return datetime.combine(siguiente, fecha_base.time())
     
-    def registrar_pago(self, cuarto_id, monto, fecha_pago=None):
+    def sincronizar_proximo_pago(self, cuartos):
         """
-        Registra un pago con validaciones y actualizaciones automáticas
+        Toma el próximo pago de la siguiente cuota pendiente de la estadía actual, para que
+        vencimientos, recordatorios y el resumen coincidan con el calendario de cuotas
+        """
+        vencimientos = calendario_pagos.proximos_vencimientos([c.id for c in cuartos])
+        for cuarto in cuartos:
+            if cuarto.id in vencimientos:
+                hora = (cuarto.proximo_pago or cuarto.fecha_entrada or datetime.min).time()
+                cuarto.proximo_pago = datetime.combine(vencimientos[cuarto.id], hora)
+    
+    def registrar_pago(self, cuarto_id, monto, fecha_pago=None, verificar_duplicado=True):
+        """
+        Registra un pago con validaciones y actualizaciones automáticas.
+        Con verificar_duplicado=False (peticiones con clave de idempotencia) se permite
+        más de un pago el mismo día.
         """
         if fecha_pago is None:
             fecha_pago = datetime.utcnow()
         
+        # La verificación y la escritura van en la misma transacción de escritura
+        iniciar_escritura()
+        
         # Verificar pago duplicado
-        if self.verificar_pago_duplicado(cuarto_id, fecha_pago):
+        if verificar_duplicado and self.verificar_pago_duplicado(cuarto_id, fecha_pago):
+            db.session.rollback()
             return {
                 'success': False,
                 'msg': 'Ya existe un pago registrado para este cuarto en la fecha de hoy'
@@ -57,6 +102,7 @@ class ControlPagos:
         # Obtener cuarto
         cuarto = Cuarto.query.get(cuarto_id)
         if not cuarto:
+            db.session.rollback()
             return {
                 'success': False,
                 'msg': 'Cuarto no encontrado'
@@ -77,9 +123,12 @@ class ControlPagos:
             cuarto.tipo_contrato,
             fecha_pago
         )
+        calendario_pagos.aplicar_pago(cuarto_id, monto, fecha_pago)
+        self.sincronizar_proximo_pago([cuarto])
         
         db.session.add(pago)
-        db.session.commit()
+        if verificar_duplicado:
+            db.session.add(PagoDiario(fecha=fecha_pago.date(), cuarto_id=cuarto_id, pago=pago))
         
         # Crear notificación de pago registrado
         self.sistema_notificaciones.crear_notificacion(
@@ -87,15 +136,152 @@ class ControlPagos:
             titulo='Pago Registrado',
             mensaje=f'Pago de ${monto:.2f} registrado para habitación {cuarto.numero}',
             prioridad='info',
-            cuarto_id=cuarto_id
+            cuarto_id=cuarto_id,
+            apartamento_id=cuarto.apartamento_id
         )
         
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro registro del mismo cuarto y día ganó la carrera
+            db.session.rollback()
+            return {
+                'success': False,
+                'msg': 'Ya existe un pago registrado para este cuarto en la fecha de hoy'
+            }
+        
         return {
             'success': True,
             'msg': f'Pago de ${monto:.2f} registrado exitosamente',
             'proximo_pago': cuarto.proximo_pago.strftime('%d/%m/%Y') if cuarto.proximo_pago else None
         }
     
+    def importar_pagos(self, filas):
+        """
+        Registra un lote de pagos (p. ej. de un estado de cuenta) en una sola transacción.
+        Cada fila trae apartamento, cuarto, opcionalmente monto (sin monto se toma la renta
+        del cuarto) y opcionalmente fecha; devuelve un resultado por fila.
+        """
+        resultados = []
+        validas = []
+        
+        # Validar y normalizar las filas
+        for i, fila in enumerate(filas, start=1):
+            if not isinstance(fila, dict):
+                resultados.append({'fila': i, 'success': False, 'msg': 'Fila con datos inválidos'})
+                continue
+            try:
+                apto_num = int(fila.get('apartamento'))
+                cuarto_num = int(fila.get('cuarto'))
+                monto = None if fila.get('monto') in (None, '') else float(fila.get('monto'))
+                fecha = self._parsear_fecha(fila.get('fecha'))
+            except (TypeError, ValueError):
+                resultados.append({'fila': i, 'success': False, 'msg': 'Fila con datos inválidos'})
+                continue
+            if monto is not None and not (math.isfinite(monto) and monto > 0):
+                resultados.append({'fila': i, 'success': False, 'msg': 'El monto debe ser mayor que cero'})
+                continue
+            
+            resultado = {'fila': i, 'apartamento': apto_num, 'cuarto': cuarto_num, 'monto': monto}
+            resultados.append(resultado)
+            validas.append((resultado, fecha))
+        
+        if not validas:
+            return {'success': False, 'registrados': 0, 'resultados': resultados}
+        
+        # La detección de duplicados y los inserts van en la misma transacción de escritura
+        iniciar_escritura()
+        
+        # Resolver todos los pares (apartamento, cuarto) en una consulta
+        pares = {(r['apartamento'], r['cuarto']) for r, _ in validas}
+        cuartos = {
+            (apto_num, cuarto.numero): cuarto
+            for cuarto, apto_num in db.session.query(Cuarto, Apartamento.numero)
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)
+            .filter(Apartamento.activo == True, db.tuple_(Apartamento.numero, Cuarto.numero).in_(list(pares)))
+            .all()
+        }
+        cuartos_por_id = {c.id: c for c in cuartos.values()}
+        
+        # Pagos existentes en el rango de fechas del lote, como conjunto (cuarto, día)
+        ids = [c.id for c in cuartos.values()]
+        fechas = [f for _, f in validas]
+        inicio = min(fechas).replace(hour=0, minute=0, second=0, microsecond=0)
+        fin = max(fechas).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        existentes = {
+            (cuarto_id, fecha.date())
+            for cuarto_id, fecha in db.session.query(Pago.cuarto_id, Pago.fecha).filter(
+                Pago.cuarto_id.in_(ids), Pago.fecha >= inicio, Pago.fecha < fin
+            ).all()
+        } if ids else set()
+        
+        pagos = []
+        for resultado, fecha in validas:
+            cuarto = cuartos.get((resultado['apartamento'], resultado['cuarto']))
+            if not cuarto:
+                resultado.update(success=False, msg='Habitación no encontrada')
+                continue
+            
+            clave = (cuarto.id, fecha.date())
+            if clave in existentes:
+                resultado.update(success=False, msg='Ya existe un pago registrado para este cuarto en esa fecha')
+                continue
+            existentes.add(clave)
+            
+            monto = resultado['monto'] if resultado['monto'] is not None else cuarto.renta
+            resultado['monto'] = monto
+            pago = Pago(fecha=fecha, monto=monto, estado='pagado', cuarto_id=cuarto.id)
+            pagos.append(pago)
+            db.session.add(PagoDiario(fecha=fecha.date(), cuarto_id=cuarto.id, pago=pago))
+            
+            # Quedarse con el pago más reciente de cada cuarto
+            if not cuarto.ultimo_pago or fecha >= cuarto.ultimo_pago:
+                cuarto.ultimo_pago = fecha
+                cuarto.proximo_pago = self.calcular_proximo_pago(
+                    cuarto.fecha_entrada or fecha,
+                    cuarto.tipo_contrato,
+                    fecha
+                )
+            resultado.update(success=True, msg=f'Pago de ${monto:.2f} registrado')
+        
+        if pagos:
+            db.session.add_all(pagos)
+            calendario_pagos.aplicar_pagos([(p.cuarto_id, p.monto, p.fecha) for p in pagos])
+            self.sincronizar_proximo_pago({cuartos_por_id[p.cuarto_id] for p in pagos})
+            self.sistema_notificaciones.crear_notificacion(
+                tipo='pagos_importados',
+                titulo='Pagos Importados',
+                mensaje=f'{len(pagos)} pagos importados por ${sum(p.monto for p in pagos):.2f}',
+                prioridad='info'
+            )
+        db.session.commit()
+        
+        return {
+            'success': True,
+            'registrados': len(pagos),
+            'rechazados': len(resultados) - len(pagos),
+            'resultados': resultados
+        }
+    
+    def _parsear_fecha(self, valor):
+        """
+        Acepta fechas ISO (2025-09-17) o dd/mm/aaaa; sin fecha usa la actual.
+        Las fechas con zona horaria se pasan a UTC sin zona, como las guarda la base.
+        """
+        if not valor:
+            return datetime.utcnow()
+        if isinstance(valor, datetime):
+            fecha = valor
+        else:
+            valor = str(valor).strip()
+            try:
+                fecha = datetime.fromisoformat(valor)
+            except ValueError:
+                fecha = datetime.strptime(valor, '%d/%m/%Y')
+        if fecha.tzinfo is not None:
+            fecha = fecha.astimezone(timezone.utc).replace(tzinfo=None)
+        return fecha
+    
     def asignar_inquilino(self, cuarto_id, nombre, renta, tipo_contrato="mensual", fecha_entrada=None):
         """
         Asigna un inquilino a un cuarto con configuración de contrato
@@ -117,6 +303,8 @@ class ControlPagos:
         cuarto.tipo_contrato = tipo_contrato
         cuarto.fecha_entrada = fecha_entrada
         cuarto.proximo_pago = self.calcular_proximo_pago(fecha_entrada, tipo_contrato)
+        calendario_pagos.reiniciar_contrato(cuarto)
+        self.sincronizar_proximo_pago([cuarto])
         
         db.session.commit()
         
@@ -126,7 +314,8 @@ class ControlPagos:
             titulo='Inquilino Asignado',
             mensaje=f'{nombre} asignado a habitación {cuarto.numero} - Contrato {tipo_contrato}',
             prioridad='info',
-            cuarto_id=cuarto_id
+            cuarto_id=cuarto_id,
+            apartamento_id=cuarto.apartamento_id
         )
         
         return {
@@ -135,111 +324,255 @@ class ControlPagos:
             'proximo_pago': cuarto.proximo_pago.strftime('%d/%m/%Y') if cuarto.proximo_pago else None
         }
     
+    def generar_solicitudes_periodo(self, inicio=None, fin=None):
+        """
+        Genera en una transacción las solicitudes de pago de todos los cuartos activos con
+        vencimientos en [inicio, fin) (por defecto el mes en curso). Los vencimientos son las
+        cuotas pendientes del calendario de pagos (meses de calendario, no saltos de 30 días);
+        se omiten los que ya tienen solicitud para ese cuarto y día.
+        """
+        if inicio is None:
+            inicio = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if fin is None:
+            fin = datetime.combine(sumar_meses(inicio.date(), 1, 1), datetime.min.time())
+        
+        # El periodo puede quedar más allá del horizonte ya generado del calendario
+        calendario_pagos.extender_horizonte(hasta=(fin - timedelta(days=1)).date())
+        
+        iniciar_escritura()
+        
+        # Solo columnas: no hace falta cargar los objetos completos
+        cuotas = db.session.query(
+            CuotaPago.cuarto_id, CuotaPago.monto, Cuarto.tipo_contrato, CuotaPago.fecha_vencimiento
+        ).join(Cuarto, CuotaPago.cuarto_id == Cuarto.id).filter(
+            Cuarto.activo == True,
+            CuotaPago.estado == 'pendiente',
+            CuotaPago.fecha_vencimiento >= inicio.date(),
+            CuotaPago.fecha_vencimiento < fin.date()
+        ).order_by(CuotaPago.fecha_vencimiento, CuotaPago.cuarto_id).all()
+        
+        existentes = {
+            (cuarto_id, vencimiento.date())
+            for cuarto_id, vencimiento in db.session.query(
+                SolicitudPago.cuarto_id, SolicitudPago.fecha_vencimiento
+            ).filter(
+                SolicitudPago.fecha_vencimiento >= inicio - timedelta(days=1),
+                SolicitudPago.fecha_vencimiento < fin + timedelta(days=1)
+            ).all()
+        }
+        
+        ahora = datetime.utcnow()
+        nuevas = []
+        omitidas = 0
+        for cuarto_id, monto, tipo_contrato, fecha_vencimiento in cuotas:
+            if (cuarto_id, fecha_vencimiento) in existentes:
+                omitidas += 1
+                continue
+            vencimiento = datetime.combine(fecha_vencimiento, datetime.min.time())
+            nuevas.append({
+                'cuarto_id': cuarto_id,
+                'monto': monto,
+                'fecha_solicitud': ahora,
+                'fecha_vencimiento': vencimiento,
+                'estado': 'pendiente',
+                'nota': f'Renta {tipo_contrato} con vencimiento {vencimiento.strftime("%d/%m/%Y")}',
+                'recordatorios_enviados': 0
+            })
+        
+        monto_total = round(sum(s['monto'] for s in nuevas), 2)
+        if nuevas:
+            # Un INSERT en lote y una sola notificación de resumen
+            db.session.execute(db.insert(SolicitudPago), nuevas)
+            self.sistema_notificaciones.crear_notificacion(
+                tipo='solicitudes_generadas',
+                titulo='Solicitudes de Pago Generadas',
+                mensaje=f'{len(nuevas)} solicitudes por ${monto_total:.2f} con vencimiento entre '
+                        f'{inicio.strftime("%d/%m/%Y")} y {(fin - timedelta(days=1)).strftime("%d/%m/%Y")}',
+                prioridad='info'
+            )
+        db.session.commit()
+        
+        return {
+            'success': True,
+            'creadas': len(nuevas),
+            'omitidas': omitidas,
+            'monto_total': monto_total,
+            'desde': inicio.strftime('%d/%m/%Y'),
+            'hasta': (fin - timedelta(days=1)).strftime('%d/%m/%Y')
+        }
+    
     def verificar_pagos_vencidos(self):
         """
         Verifica pagos vencidos y crea notificaciones
         """
         hoy = datetime.utcnow().date()
-        cuartos_vencidos = []
+        inicio_hoy = datetime.combine(hoy, datetime.min.time())
+        
+        # La búsqueda de avisos de hoy y el insert van en la misma transacción de escritura
+        iniciar_escritura()
+        
+        # Solo los cuartos vencidos (índice sobre activo, proximo_pago)
+        cuartos = Cuarto.query.filter(
+            Cuarto.activo == True,
+            Cuarto.proximo_pago < inicio_hoy
+        ).order_by(Cuarto.proximo_pago).all()
         
-        # Buscar cuartos con pagos vencidos
-        cuartos = Cuarto.query.filter_by(activo=True).all()
+        # Cuartos que ya recibieron su aviso de hoy, en una sola consulta
+        avisados = {
+            cuarto_id for (cuarto_id,) in db.session.query(Notificacion.cuarto_id).filter(
+                Notificacion.tipo == 'pago_vencido',
+                Notificacion.cuarto_id.in_([c.id for c in cuartos]),
+                Notificacion.fecha >= inicio_hoy
+            ).all()
+        } if cuartos else set()
         
+        cuartos_vencidos = []
+        notificaciones = []
         for cuarto in cuartos:
-            if cuarto.proximo_pago and cuarto.proximo_pago.date() < hoy:
-                dias_vencido = (hoy - cuarto.proximo_pago.date()).days
-                
-                # Crear notificación de pago vencido
-                self.sistema_notificaciones.crear_notificacion(
-                    tipo='pago_vencido',
-                    titulo='Pago Vencido',
-                    mensaje=f'Habitación {cuarto.numero} - {cuarto.inquilino}: Pago vencido hace {dias_vencido} días',
-                    prioridad='alta' if dias_vencido > 7 else 'media',
-                    cuarto_id=cuarto.id
-                )
-                
-                cuartos_vencidos.append({
-                    'cuarto': cuarto.numero,
-                    'inquilino': cuarto.inquilino,
-                    'dias_vencido': dias_vencido,
-                    'proximo_pago': cuarto.proximo_pago
-                })
+            dias_vencido = (hoy - cuarto.proximo_pago.date()).days
+            
+            cuartos_vencidos.append({
+                'cuarto': cuarto.numero,
+                'inquilino': cuarto.inquilino,
+                'dias_vencido': dias_vencido,
+                'proximo_pago': cuarto.proximo_pago
+            })
+            if cuarto.id in avisados:
+                continue
+            
+            notificaciones.append({
+                'tipo': 'pago_vencido',
+                'titulo': 'Pago Vencido',
+                'mensaje': f'Habitación {cuarto.numero} - {cuarto.inquilino}: Pago vencido hace {dias_vencido} días',
+                'prioridad': 'alta' if dias_vencido > 7 else 'media',
+                'cuarto_id': cuarto.id,
+                'apartamento_id': cuarto.apartamento_id
+            })
+        
+        # Todas las notificaciones en un solo insert
+        if notificaciones:
+            self.sistema_notificaciones.crear_notificaciones(notificaciones)
+        db.session.commit()
         
         return cuartos_vencidos
     
     def verificar_recordatorios_pago(self):
         """
-        Verifica y crea recordatorios de pagos próximos a vencer
+        Dispara los recordatorios de pago cuyo instante ya llegó (3 y 1 día antes).
+        El programador los mantiene ordenados en memoria, así que no recorre todos los cuartos
         """
-        hoy = datetime.utcnow().date()
-        cuartos_recordatorio = []
+        return programador_recordatorios.procesar_vencidos()
+    
+    def obtener_resumen_pagos(self, limite=50):
+        """
+        Obtiene un resumen de todos los pagos y estados.
+        Se sirve de caché por unos segundos; los pagos y cambios de cuartos la invalidan
+        """
+        limite = max(1, min(int(limite), self.LIMITE_RESUMEN_MAXIMO))
+        with self._candado_resumen:
+            en_cache = self._cache_resumen.get(limite)
+            if en_cache and en_cache[0] > time.monotonic():
+                return en_cache[1]
+            version = self._version_resumen
         
-        # Buscar cuartos con pagos próximos a vencer (3 días antes)
-        cuartos = Cuarto.query.filter_by(activo=True).all()
+        resumen = self._calcular_resumen_pagos(limite)
         
-        for cuarto in cuartos:
-            if cuarto.proximo_pago:
-                dias_restantes = (cuarto.proximo_pago.date() - hoy).days
-                
-                # Recordatorio 3 días antes
-                if dias_restantes == 3:
-                    self.sistema_notificaciones.crear_notificacion(
-                        tipo='recordatorio_pago',
-                        titulo='Recordatorio de Pago',
-                        mensaje=f'Habitación {cuarto.numero} - {cuarto.inquilino}: Pago vence en 3 días ({cuarto.proximo_pago.strftime("%d/%m/%Y")})',
-                        prioridad='media',
-                        cuarto_id=cuarto.id
-                    )
-                    cuartos_recordatorio.append(cuarto)
-                
-                # Recordatorio 1 día antes
-                elif dias_restantes == 1:
-                    self.sistema_notificaciones.crear_notificacion(
-                        tipo='recordatorio_pago',
-                        titulo='Recordatorio Urgente',
-                        mensaje=f'Habitación {cuarto.numero} - {cuarto.inquilino}: Pago vence mañana ({cuarto.proximo_pago.strftime("%d/%m/%Y")})',
-                        prioridad='alta',
-                        cuarto_id=cuarto.id
-                    )
-                    cuartos_recordatorio.append(cuarto)
-        
-        return cuartos_recordatorio
-    
-    def obtener_resumen_pagos(self):
-        """
-        Obtiene un resumen de todos los pagos y estados
-        """
-        cuartos = Cuarto.query.filter_by(activo=True).all()
+        with self._candado_resumen:
+            # Si hubo una invalidación mientras se calculaba, no guardar el resultado viejo
+            if version == self._version_resumen:
+                ahora = time.monotonic()
+                # Descartar las entradas vencidas para que la caché no crezca sin límite
+                for clave in [c for c, (expira, _) in self._cache_resumen.items() if expira <= ahora]:
+                    del self._cache_resumen[clave]
+                self._cache_resumen[limite] = (ahora + self.segundos_cache_resumen, resumen)
+        return resumen
+    
+    def invalidar_resumen(self):
+        """
+        Descarta el resumen en caché
+        """
+        with self._candado_resumen:
+            self._version_resumen += 1
+            self._cache_resumen.clear()
+    
+    def _calcular_resumen_pagos(self, limite):
+        """
+        Clasifica los cuartos activos en una sola consulta: el CASE asigna el grupo y las
+        funciones de ventana dan el conteo, la suma de rentas y la posición dentro del grupo
+        """
         hoy = datetime.utcnow().date()
+        inicio_hoy = datetime.combine(hoy, datetime.min.time())
+        
+        grupo = db.case(
+            (Cuarto.proximo_pago.is_(None), 'sin_fecha'),
+            (Cuarto.proximo_pago < inicio_hoy, 'pagos_vencidos'),
+            (Cuarto.proximo_pago < inicio_hoy + timedelta(days=4), 'pagos_proximos'),
+            else_='pagos_al_dia'
+        )
+        consulta = db.session.query(
+            Cuarto.numero,
+            Cuarto.inquilino,
+            Cuarto.renta,
+            Cuarto.tipo_contrato,
+            Cuarto.proximo_pago,
+            grupo.label('grupo'),
+            db.func.count().over(partition_by=grupo).label('cantidad'),
+            db.func.sum(Cuarto.renta).over(partition_by=grupo).label('monto'),
+            db.func.row_number().over(partition_by=grupo, order_by=Cuarto.proximo_pago).label('posicion')
+        ).filter(Cuarto.activo == True).subquery()
+        
+        filas = db.session.query(consulta).filter(consulta.c.posicion <= limite)\
+            .order_by(consulta.c.grupo, consulta.c.posicion).all()
         
         resumen = {
-            'total_cuartos': len(cuartos),
+            'total_cuartos': 0,
             'pagos_vencidos': [],
             'pagos_proximos': [],
-            'pagos_al_dia': []
+            'pagos_al_dia': [],
+            'totales': {
+                nombre: {'cantidad': 0, 'monto': 0.0}
+                for nombre in ('pagos_vencidos', 'pagos_proximos', 'pagos_al_dia')
+            }
         }
         
-        for cuarto in cuartos:
-            if cuarto.proximo_pago:
-                dias_restantes = (cuarto.proximo_pago.date() - hoy).days
-                
-                cuarto_info = {
-                    'numero': cuarto.numero,
-                    'inquilino': cuarto.inquilino,
-                    'renta': cuarto.renta,
-                    'tipo_contrato': cuarto.tipo_contrato,
-                    'proximo_pago': cuarto.proximo_pago,
-                    'dias_restantes': dias_restantes
-                }
-                
-                if dias_restantes < 0:
-                    resumen['pagos_vencidos'].append(cuarto_info)
-                elif dias_restantes <= 3:
-                    resumen['pagos_proximos'].append(cuarto_info)
-                else:
-                    resumen['pagos_al_dia'].append(cuarto_info)
+        grupos_contados = set()
+        for fila in filas:
+            if fila.grupo not in grupos_contados:
+                grupos_contados.add(fila.grupo)
+                resumen['total_cuartos'] += fila.cantidad
+                if fila.grupo in resumen['totales']:
+                    resumen['totales'][fila.grupo] = {
+                        'cantidad': fila.cantidad,
+                        'monto': round(float(fila.monto or 0), 2)
+                    }
+            if fila.grupo == 'sin_fecha':
+                continue
+            
+            resumen[fila.grupo].append({
+                'numero': fila.numero,
+                'inquilino': fila.inquilino,
+                'renta': fila.renta,
+                'tipo_contrato': fila.tipo_contrato,
+                'proximo_pago': fila.proximo_pago,
+                'dias_restantes': (fila.proximo_pago.date() - hoy).days
+            })
         
         return resumen
+    
+    def _al_hacer_flush(self, session, flush_context):
+        if any(isinstance(obj, Pago) for obj in session.new) or any(
+                isinstance(obj, Cuarto) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+            session.info['resumen_pagos_sucio'] = True
+    
+    def _al_hacer_commit(self, session):
+        if session.info.pop('resumen_pagos_sucio', False):
+            self.invalidar_resumen()
+    
+    def _al_hacer_rollback(self, session):
+        session.info.pop('resumen_pagos_sucio', None)
+
+# Instancia global del control de pagos
+control_pagos = ControlPagos()
 
 
 
@@ -0,0 +1,254 @@
+"""
+Módulo del cubo diario de analytics: hechos pre-agregados por apartamento y día (ingresos,
+pagos, limpiezas, gas y altas/bajas de ocupación), mantenidos en la misma transacción de
+cada escritura para responder cualquier rango de fechas sin recorrer las tablas crudas
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db, iniciar_escritura, Apartamento, Cuarto, Pago, Limpieza, Gas, OcupacionCuarto, HechoDiario
+
+MEDIDAS = ('ingresos', 'pagos', 'limpiezas', 'minutos_limpieza', 'recargas_gas', 'entradas', 'salidas')
+AGRUPACIONES = ('dia', 'mes')
+
+# Atributos de los que depende cada hecho; su valor anterior se necesita al modificarlos
+ATRIBUTOS = {
+    Pago: ('cuarto_id', 'fecha', 'monto'),
+    Limpieza: ('cuarto_id', 'fecha', 'minutos'),
+    Gas: ('cuarto_id', 'fecha'),
+    OcupacionCuarto: ('cuarto_id', 'desde', 'hasta'),
+}
+
+
+class CuboDiario:
+    """Una fila por apartamento y día con actividad. Los cuartos ocupados no se guardan como
+    nivel sino como altas y bajas: un cambio retroactivo toca una sola fila y el nivel en
+    cualquier fecha es la suma acumulada hasta ella."""
+
+    def __init__(self):
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Reconstruye el cubo si está vacío y registra los eventos que lo mantienen al día"""
+        if self._iniciado:
+            return
+        with app.app_context():
+            if HechoDiario.query.first() is None:
+                self.reconstruir()
+        # Los valores anteriores de estos atributos se cargan aunque estén expirados
+        for modelo, atributos in ATRIBUTOS.items():
+            for atributo in atributos:
+                db.event.listen(getattr(modelo, atributo), 'set', self._al_asignar, active_history=True)
+        db.event.listen(db.session, 'before_flush', self._antes_de_flush)
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._iniciado = True
+
+    def reconstruir(self) -> int:
+        """Recalcula el cubo completo desde pagos, limpiezas, gas y ocupaciones en una sola
+        sentencia INSERT ... SELECT agrupada; devuelve las filas generadas"""
+        fuentes = db.union_all(
+            self._fuente(Pago, Pago.fecha, ingresos=Pago.monto, pagos=1),
+            self._fuente(Limpieza, Limpieza.fecha, limpiezas=1,
+                         minutos_limpieza=db.func.coalesce(Limpieza.minutos, 0)),
+            self._fuente(Gas, Gas.fecha, recargas_gas=1),
+            self._fuente(OcupacionCuarto, OcupacionCuarto.desde, entradas=1),
+            self._fuente(OcupacionCuarto, OcupacionCuarto.hasta, salidas=1)
+            .where(OcupacionCuarto.hasta.isnot(None))
+        ).subquery()
+        agrupado = db.select(fuentes.c.apartamento_id, fuentes.c.fecha,
+                             *[db.func.sum(fuentes.c[m]) for m in MEDIDAS])\
+            .group_by(fuentes.c.apartamento_id, fuentes.c.fecha)
+
+        iniciar_escritura()
+        db.session.execute(db.delete(HechoDiario))
+        db.session.execute(db.insert(HechoDiario).from_select(['apartamento_id', 'fecha', *MEDIDAS], agrupado))
+        db.session.commit()
+        return HechoDiario.query.count()
+
+    def resumen(self, desde: date, hasta: date, apartamento_ids: List[int] = None) -> List[Dict]:
+        """Totales del rango [desde, hasta] por apartamento, con los cuartos ocupados al cierre
+        y los días-cuarto ocupados, en una consulta agrupada sobre el cubo"""
+        dias = (hasta - desde).days + 1
+        en_rango = HechoDiario.fecha >= desde
+        neto = HechoDiario.entradas - HechoDiario.salidas
+        # Un alta (o baja) del día d cambia la ocupación de cada día entre d y hasta
+        dias_restantes = db.func.julianday(hasta) - db.func.julianday(HechoDiario.fecha) + 1
+        dias_cuarto = db.func.sum(db.case((en_rango, neto * dias_restantes), else_=neto * dias))
+
+        query = db.session.query(
+            HechoDiario.apartamento_id,
+            *[db.func.sum(db.case((en_rango, getattr(HechoDiario, m)), else_=0)) for m in MEDIDAS],
+            db.func.sum(neto),
+            dias_cuarto
+        ).filter(HechoDiario.fecha <= hasta).group_by(HechoDiario.apartamento_id)
+        aptos = db.session.query(Apartamento.id, Apartamento.numero, db.func.count(Cuarto.id))\
+            .outerjoin(Cuarto, Cuarto.apartamento_id == Apartamento.id)\
+            .group_by(Apartamento.id).order_by(Apartamento.numero)
+        if apartamento_ids is not None:
+            query = query.filter(HechoDiario.apartamento_id.in_(apartamento_ids))
+            aptos = aptos.filter(Apartamento.id.in_(apartamento_ids))
+        hechos = {fila[0]: fila[1:] for fila in query.all()}
+
+        resultado = []
+        for apto_id, numero, cuartos in aptos.all():
+            ingresos, *conteos, ocupados, ocupados_dias = hechos.get(apto_id, (0,) * (len(MEDIDAS) + 2))
+            ocupados_dias = float(ocupados_dias or 0)
+            resultado.append({
+                'apartamento_id': apto_id,
+                'numero': numero,
+                'ingresos': round(float(ingresos or 0), 2),
+                **{m: int(v or 0) for m, v in zip(MEDIDAS[1:], conteos)},
+                'cuartos_totales': cuartos,
+                'cuartos_ocupados': int(ocupados or 0),
+                'dias_cuarto_ocupados': round(ocupados_dias, 1),
+                'tasa_ocupacion': round(ocupados_dias / (cuartos * dias) * 100, 1) if cuartos else 0
+            })
+        return resultado
+
+    def totales(self, desde: date, hasta: date) -> Dict:
+        """Suma de cada medida del rango para todo el portafolio"""
+        fila = db.session.query(*[db.func.coalesce(db.func.sum(getattr(HechoDiario, m)), 0) for m in MEDIDAS])\
+            .filter(HechoDiario.fecha >= desde, HechoDiario.fecha <= hasta).one()
+        return dict(zip(MEDIDAS, fila))
+
+    def serie(self, desde: date, hasta: date, agrupar: str = 'dia', apartamento_ids: List[int] = None) -> List[Dict]:
+        """Medidas del rango por día o por mes, incluidos los períodos sin actividad, con los
+        cuartos ocupados al cierre de cada período"""
+        formato = '%Y-%m-%d' if agrupar == 'dia' else '%Y-%m'
+        periodo = db.func.strftime(formato, HechoDiario.fecha)
+        query = db.session.query(periodo, *[db.func.sum(getattr(HechoDiario, m)) for m in MEDIDAS])\
+            .filter(HechoDiario.fecha >= desde, HechoDiario.fecha <= hasta)\
+            .group_by(periodo)
+        base = db.session.query(db.func.coalesce(db.func.sum(HechoDiario.entradas - HechoDiario.salidas), 0))\
+            .filter(HechoDiario.fecha < desde)
+        if apartamento_ids is not None:
+            query = query.filter(HechoDiario.apartamento_id.in_(apartamento_ids))
+            base = base.filter(HechoDiario.apartamento_id.in_(apartamento_ids))
+        por_periodo = {fila[0]: fila[1:] for fila in query.all()}
+
+        ocupados = int(base.scalar())
+        resultado = []
+        for etiqueta in self._periodos(desde, hasta, agrupar):
+            valores = dict(zip(MEDIDAS, por_periodo.get(etiqueta, (0,) * len(MEDIDAS))))
+            ocupados += int(valores['entradas']) - int(valores['salidas'])
+            resultado.append({
+                'periodo': etiqueta,
+                'ingresos': round(float(valores['ingresos']), 2),
+                **{m: int(valores[m]) for m in MEDIDAS[1:]},
+                'cuartos_ocupados': ocupados
+            })
+        return resultado
+
+    # Métodos privados
+    def _periodos(self, desde: date, hasta: date, agrupar: str) -> List[str]:
+        if agrupar == 'dia':
+            return [(desde + timedelta(days=i)).isoformat() for i in range((hasta - desde).days + 1)]
+        inicio, fin = desde.year * 12 + desde.month - 1, hasta.year * 12 + hasta.month - 1
+        return [f'{i // 12}-{i % 12 + 1:02d}' for i in range(inicio, fin + 1)]
+
+    def _fuente(self, modelo, columna_fecha, **valores):
+        """SELECT de los hechos de una tabla con todas las medidas (las ausentes en 0)"""
+        columnas = [db.literal(valores.get(m, 0)) if isinstance(valores.get(m, 0), int) else valores[m]
+                    for m in MEDIDAS]
+        return db.select(Cuarto.apartamento_id.label('apartamento_id'),
+                         db.func.date(columna_fecha).label('fecha'),
+                         *[c.label(m) for c, m in zip(columnas, MEDIDAS)])\
+            .select_from(modelo).join(Cuarto, modelo.cuarto_id == Cuarto.id)
+
+    def _aportes(self, obj, valores: Dict) -> List[Tuple]:
+        """(cuarto_id, día, medida, valor) que un registro suma al cubo"""
+        cuarto_id = valores['cuarto_id']
+        if isinstance(obj, Pago):
+            return [(cuarto_id, valores['fecha'], 'ingresos', valores['monto'] or 0),
+                    (cuarto_id, valores['fecha'], 'pagos', 1)]
+        if isinstance(obj, Limpieza):
+            return [(cuarto_id, valores['fecha'], 'limpiezas', 1),
+                    (cuarto_id, valores['fecha'], 'minutos_limpieza', valores['minutos'] or 0)]
+        if isinstance(obj, Gas):
+            return [(cuarto_id, valores['fecha'], 'recargas_gas', 1)]
+        aportes = [(cuarto_id, valores['desde'], 'entradas', 1)]
+        if valores['hasta'] is not None:
+            aportes.append((cuarto_id, valores['hasta'], 'salidas', 1))
+        return aportes
+
+    def _valores(self, obj, anteriores: bool = False) -> Dict:
+        """Valores actuales de los atributos del hecho o, con anteriores=True, los que tenía
+        en la base antes de este flush"""
+        estado = db.inspect(obj)
+        valores = {}
+        for atributo in ATRIBUTOS[type(obj)]:
+            historia = estado.attrs[atributo].history
+            if anteriores and historia.deleted:
+                valores[atributo] = historia.deleted[0]
+            elif anteriores and historia.added:
+                valores[atributo] = None  # no tenía valor
+            else:
+                valores[atributo] = getattr(obj, atributo)
+        return valores
+
+    def _acumular(self, conexion, aportes: List[Tuple], signo: int, deltas: Dict):
+        """Suma los aportes a los deltas por (apartamento, día), resolviendo el apartamento
+        de cada cuarto con una consulta"""
+        aportes = [a for a in aportes if a[0] is not None and a[1] is not None]
+        cuartos = {a[0] for a in aportes}
+        if not cuartos:
+            return
+        apartamentos = dict(conexion.execute(
+            db.select(Cuarto.id, Cuarto.apartamento_id).where(Cuarto.id.in_(cuartos))).all())
+        for cuarto_id, fecha, medida, valor in aportes:
+            if cuarto_id in apartamentos:
+                deltas[(apartamentos[cuarto_id], fecha.date())][medida] += signo * valor
+
+    def _al_asignar(self, objetivo, valor, anterior, iniciador):
+        """Solo existe para registrar active_history en los atributos del cubo"""
+
+    def _antes_de_flush(self, session, flush_context, instances):
+        """Los registros borrados restan antes del flush, mientras su cuarto todavía existe"""
+        borrados = [obj for obj in session.deleted if type(obj) in ATRIBUTOS]
+        apartamentos = [obj.id for obj in session.deleted if isinstance(obj, Apartamento)]
+        if not borrados and not apartamentos:
+            return
+        deltas = session.info.setdefault('cubo_deltas', defaultdict(lambda: defaultdict(float)))
+        aportes = [a for obj in borrados for a in self._aportes(obj, self._valores(obj, anteriores=True))]
+        self._acumular(session.connection(), aportes, -1, deltas)
+        session.info.setdefault('cubo_apartamentos_borrados', set()).update(apartamentos)
+
+    def _al_hacer_flush(self, session, flush_context):
+        """Suma los registros nuevos, reemplaza los modificados y guarda los deltas del flush
+        con INSERT ... ON CONFLICT DO UPDATE, dentro de la misma transacción"""
+        deltas = session.info.pop('cubo_deltas', None) or defaultdict(lambda: defaultdict(float))
+        borrados = session.info.pop('cubo_apartamentos_borrados', set())
+        conexion = session.connection()
+
+        nuevos = [obj for obj in session.new if type(obj) in ATRIBUTOS]
+        modificados = [obj for obj in session.dirty if type(obj) in ATRIBUTOS and any(
+            db.inspect(obj).attrs[a].history.has_changes() for a in ATRIBUTOS[type(obj)])]
+        self._acumular(conexion, [a for obj in nuevos + modificados
+                                  for a in self._aportes(obj, self._valores(obj))], 1, deltas)
+        self._acumular(conexion, [a for obj in modificados
+                                  for a in self._aportes(obj, self._valores(obj, anteriores=True))], -1, deltas)
+
+        if borrados:
+            conexion.execute(db.delete(HechoDiario).where(HechoDiario.apartamento_id.in_(borrados)))
+        filas = [{'apartamento_id': apto_id, 'fecha': dia, 'ingresos': valores.get('ingresos', 0),
+                  **{m: int(round(valores.get(m, 0))) for m in MEDIDAS[1:]}}
+                 for (apto_id, dia), valores in deltas.items()
+                 if apto_id not in borrados and any(valores.values())]
+        if not filas:
+            return
+        sentencia = insert(HechoDiario.__table__)
+        conexion.execute(sentencia.on_conflict_do_update(
+            index_elements=['apartamento_id', 'fecha'],
+            set_={m: HechoDiario.__table__.c[m] + sentencia.excluded[m] for m in MEDIDAS}
+        ), filas)
+
+    def _al_hacer_rollback(self, session):
+        session.info.pop('cubo_deltas', None)
+        session.info.pop('cubo_apartamentos_borrados', None)
+
+# Instancia global del cubo diario
+cubo_diario = CuboDiario()
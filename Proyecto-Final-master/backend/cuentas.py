@@ -0,0 +1,181 @@
+"""
+Módulo del libro de cuentas por cuarto: cargos, pagos y ajustes con saldo acumulado
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from models import db, iniciar_escritura, Apartamento, Cuarto, CuotaPago, MovimientoCuenta, Pago, SaldoCuarto
+
+
+class LibroCuentas:
+    """Libro de solo inserción; el saldo de cada cuarto se mantiene al insertar"""
+
+    def __init__(self):
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Registra el evento que asienta automáticamente cada Pago nuevo"""
+        if self._iniciado:
+            return
+        db.event.listen(db.session, 'before_flush', self._al_hacer_flush)
+        self._iniciado = True
+
+    def registrar_movimientos(self, movimientos: List[Dict], session=None) -> List[MovimientoCuenta]:
+        """Agrega movimientos calculando el saldo acumulado de cada cuarto.
+        Cada movimiento trae cuarto_id, tipo, monto y opcionalmente concepto, fecha, pago o cuota_id."""
+        session = session or db.session
+        if not movimientos:
+            return []
+
+        saldos = self._cargar_saldos(session, {m['cuarto_id'] for m in movimientos})
+        creados = []
+        for datos in movimientos:
+            saldo = saldos[datos['cuarto_id']]
+            saldo.saldo = round((saldo.saldo or 0) + datos['monto'], 2)
+            saldo.fecha_actualizacion = datetime.utcnow()
+            movimiento = MovimientoCuenta(saldo=saldo.saldo, **datos)
+            session.add(movimiento)
+            creados.append(movimiento)
+        return creados
+
+    def registrar_ajuste(self, cuarto_id: int, monto: float, concepto: str = "") -> MovimientoCuenta:
+        """Ajuste manual (positivo aumenta la deuda, negativo la reduce)"""
+        # El saldo se lee y se actualiza bajo el mismo candado de escritura
+        iniciar_escritura()
+        movimiento = self.registrar_movimientos([{
+            'cuarto_id': cuarto_id,
+            'tipo': 'ajuste',
+            'monto': monto,
+            'concepto': concepto or 'Ajuste manual'
+        }])[0]
+        db.session.commit()
+        return movimiento
+
+    def contabilizar_cargos(self, hasta: date = None) -> int:
+        """Asienta como cargo cada cuota del calendario ya vencida que aún no tenga movimiento"""
+        hasta = hasta or datetime.utcnow().date()
+        iniciar_escritura()
+        cuotas = CuotaPago.query.outerjoin(MovimientoCuenta, MovimientoCuenta.cuota_id == CuotaPago.id)\
+            .filter(MovimientoCuenta.id.is_(None), CuotaPago.fecha_vencimiento <= hasta)\
+            .order_by(CuotaPago.fecha_vencimiento, CuotaPago.id).all()
+
+        self.registrar_movimientos([self._cargo_de_cuota(cuota) for cuota in cuotas])
+        db.session.commit()
+        return len(cuotas)
+
+    def contabilizar_cuotas(self, cuotas: List[CuotaPago]) -> List[MovimientoCuenta]:
+        """Asienta como cargo las cuotas indicadas que aún no tengan movimiento, sin confirmar
+        (p. ej. la deuda de una estadía que se cierra)"""
+        if not cuotas:
+            return []
+        contabilizadas = {cuota_id for cuota_id, in db.session.query(MovimientoCuenta.cuota_id)
+                          .filter(MovimientoCuenta.cuota_id.in_([c.id for c in cuotas])).all()}
+        return self.registrar_movimientos([self._cargo_de_cuota(cuota) for cuota in cuotas
+                                           if cuota.id not in contabilizadas])
+
+    def obtener_saldo(self, cuarto_id: int) -> float:
+        """Saldo actual del cuarto (lectura por llave primaria)"""
+        saldo = db.session.get(SaldoCuarto, cuarto_id)
+        return saldo.saldo if saldo else 0.0
+
+    def obtener_movimientos(self, cuarto_id: int, limite: int = 50) -> List[Dict]:
+        """Últimos movimientos del cuarto, del más reciente al más antiguo"""
+        movimientos = MovimientoCuenta.query.filter_by(cuarto_id=cuarto_id)\
+            .order_by(MovimientoCuenta.id.desc()).limit(limite).all()
+        return [{
+            'id': m.id,
+            'fecha': m.fecha.strftime('%d/%m/%Y %H:%M'),
+            'tipo': m.tipo,
+            'concepto': m.concepto,
+            'monto': m.monto,
+            'saldo': m.saldo
+        } for m in movimientos]
+
+    def obtener_cuentas_por_cobrar(self, hoy: date = None) -> Dict:
+        """Total por cobrar del portafolio y antigüedad de la deuda (0-30, 31-60, 60+ días)"""
+        hoy = hoy or datetime.utcnow().date()
+        total = db.session.query(db.func.sum(SaldoCuarto.saldo)).filter(SaldoCuarto.saldo > 0).scalar()
+
+        # La antigüedad sale del mismo libro que el total: los pagos saldan primero los cargos
+        # más viejos, así que el saldo de cada cuarto se reparte entre sus cargos y ajustes
+        # positivos más recientes (suma acumulada del más nuevo al más viejo). La ventana va en el
+        # orden del índice (cuarto_id, fecha, id) y suma desde cada fila hasta el final, sin ordenar
+        acumulado = db.func.sum(MovimientoCuenta.monto).over(
+            partition_by=MovimientoCuenta.cuarto_id,
+            order_by=(MovimientoCuenta.fecha, MovimientoCuenta.id),
+            rows=(0, None)
+        )
+        cargos = db.session.query(
+            MovimientoCuenta.cuarto_id,
+            MovimientoCuenta.fecha,
+            MovimientoCuenta.monto,
+            acumulado.label('acumulado'),
+            SaldoCuarto.saldo
+        ).join(SaldoCuarto, SaldoCuarto.cuarto_id == MovimientoCuenta.cuarto_id)\
+            .filter(MovimientoCuenta.monto > 0, SaldoCuarto.saldo > 0).subquery()
+
+        anterior = cargos.c.acumulado - cargos.c.monto  # lo ya cubierto por cargos más nuevos
+        pendiente = db.case((cargos.c.acumulado <= cargos.c.saldo, cargos.c.monto), else_=cargos.c.saldo - anterior)
+        tramo = db.case(
+            (cargos.c.fecha >= datetime.combine(hoy - timedelta(days=30), datetime.min.time()), '0-30'),
+            (cargos.c.fecha >= datetime.combine(hoy - timedelta(days=60), datetime.min.time()), '31-60'),
+            else_='60+'
+        )
+        filas = db.session.query(Apartamento.numero, tramo, db.func.sum(pendiente))\
+            .select_from(cargos)\
+            .join(Cuarto, cargos.c.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(anterior < cargos.c.saldo)\
+            .group_by(Apartamento.numero, tramo).all()
+
+        antiguedad = {'0-30': 0.0, '31-60': 0.0, '60+': 0.0}
+        por_apartamento = {}
+        for numero, nombre_tramo, monto in filas:
+            monto = round(float(monto or 0), 2)
+            antiguedad[nombre_tramo] += monto
+            por_apartamento.setdefault(numero, {'0-30': 0.0, '31-60': 0.0, '60+': 0.0})[nombre_tramo] = monto
+
+        return {
+            'total_por_cobrar': round(float(total or 0), 2),
+            'antiguedad': antiguedad,
+            'por_apartamento': [{'apartamento': n, **tramos} for n, tramos in sorted(por_apartamento.items())]
+        }
+
+    # Métodos privados
+    def _cargo_de_cuota(self, cuota: CuotaPago) -> Dict:
+        return {
+            'cuarto_id': cuota.cuarto_id,
+            'tipo': 'cargo',
+            'monto': cuota.monto,
+            'concepto': f'Renta con vencimiento {cuota.fecha_vencimiento.strftime("%d/%m/%Y")}',
+            'fecha': datetime.combine(cuota.fecha_vencimiento, datetime.min.time()),
+            'cuota_id': cuota.id
+        }
+
+    def _cargar_saldos(self, session, cuarto_ids) -> Dict[int, SaldoCuarto]:
+        """Saldos de los cuartos en una consulta, creando los que falten"""
+        saldos = {s.cuarto_id: s for s in session.query(SaldoCuarto)
+                  .filter(SaldoCuarto.cuarto_id.in_(cuarto_ids)).all()}
+        for cuarto_id in cuarto_ids:
+            if cuarto_id not in saldos:
+                saldos[cuarto_id] = SaldoCuarto(cuarto_id=cuarto_id, saldo=0.0)
+                session.add(saldos[cuarto_id])
+        return saldos
+
+    def _al_hacer_flush(self, session, flush_context, instances):
+        """Cada Pago nuevo genera su movimiento de pago en el mismo flush"""
+        pagos = [obj for obj in session.new if isinstance(obj, Pago)]
+        if not pagos:
+            return
+        with session.no_autoflush:
+            self.registrar_movimientos([{
+                'cuarto_id': pago.cuarto_id,
+                'tipo': 'pago',
+                'monto': -(pago.monto or 0),
+                'concepto': f'Pago ({pago.estado or "pagado"})',
+                'fecha': pago.fecha or datetime.utcnow(),
+                'pago': pago
+            } for pago in pagos], session=session)
+
+# Instancia global del libro de cuentas
+libro_cuentas = LibroCuentas()
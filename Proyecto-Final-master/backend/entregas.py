@@ -0,0 +1,391 @@
+"""
+Módulo para la entrega de notificaciones a los inquilinos (email y SMS)
+"""
+import logging
+import math
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+from models import db, ContactoInquilino, EnvioNotificacion, Notificacion
+
+# Tipos de notificación que le interesan al inquilino
+TIPOS_ENTREGABLES = {
+    'pago_vencido', 'recordatorio_pago', 'solicitud_pago',
+    'pago_registrado', 'gas_agotado', 'limpieza_pendiente'
+}
+
+
+class LimitadorTasa:
+    """Token bucket para limitar los envíos por segundo de un canal"""
+
+    def __init__(self, por_segundo: float, rafaga: int = 1):
+        self.por_segundo = por_segundo
+        self.rafaga = max(1, rafaga)
+        self.tokens = float(self.rafaga)
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible"""
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.rafaga, self.tokens + (ahora - self.ultimo) * self.por_segundo)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.por_segundo
+            time.sleep(espera)
+
+
+class CanalEntrega:
+    """Canal de salida; envía un lote y devuelve un error (o None) por mensaje"""
+    nombre = ''
+
+    def __init__(self, limitador: LimitadorTasa):
+        self.limitador = limitador
+
+    def enviar_lote(self, envios: List[Dict]) -> List[Optional[str]]:
+        raise NotImplementedError
+
+
+class CanalEmail(CanalEntrega):
+    """Envía correos por SMTP reutilizando una conexión por lote"""
+    nombre = 'email'
+
+    def __init__(self, limitador: LimitadorTasa, host: str = 'localhost', port: int = 1025,
+                 usuario: str = None, password: str = None, usar_tls: bool = False,
+                 remitente: str = 'apartamentos@localhost', timeout: int = 10):
+        super().__init__(limitador)
+        self.host = host
+        self.port = port
+        self.usuario = usuario
+        self.password = password
+        self.usar_tls = usar_tls
+        self.remitente = remitente
+        self.timeout = timeout
+
+    def enviar_lote(self, envios: List[Dict]) -> List[Optional[str]]:
+        try:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        except Exception as e:
+            return [f'Conexión SMTP fallida: {e}'] * len(envios)
+
+        errores = []
+        try:
+            if self.usar_tls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.password)
+
+            for envio in envios:
+                self.limitador.adquirir()
+                mensaje = EmailMessage()
+                mensaje['From'] = self.remitente
+                mensaje['To'] = envio['destino']
+                mensaje['Subject'] = envio['titulo']
+                mensaje.set_content(envio['mensaje'] or envio['titulo'])
+                try:
+                    smtp.send_message(mensaje)
+                    errores.append(None)
+                except Exception as e:
+                    errores.append(str(e))
+        except Exception as e:
+            errores.extend([str(e)] * (len(envios) - len(errores)))
+        finally:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+        return errores
+
+
+class PasarelaSMS:
+    """Interfaz para proveedores de SMS; sustituir por la del proveedor real"""
+
+    def enviar(self, telefono: str, texto: str):
+        raise NotImplementedError
+
+
+class PasarelaSMSLog(PasarelaSMS):
+    """Pasarela de desarrollo: solo registra el mensaje en el log, no envía nada.
+    Hay que configurarla a propósito en SMS_PASARELA."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def enviar(self, telefono: str, texto: str):
+        self.logger.info(f'SMS a {telefono}: {texto}')
+
+
+class CanalSMS(CanalEntrega):
+    """Envía SMS a través de una pasarela intercambiable"""
+    nombre = 'sms'
+
+    def __init__(self, limitador: LimitadorTasa, pasarela: PasarelaSMS):
+        super().__init__(limitador)
+        self.pasarela = pasarela
+
+    def enviar_lote(self, envios: List[Dict]) -> List[Optional[str]]:
+        errores = []
+        for envio in envios:
+            self.limitador.adquirir()
+            try:
+                self.pasarela.enviar(envio['destino'], f"{envio['titulo']}: {envio['mensaje'] or ''}"[:160])
+                errores.append(None)
+            except Exception as e:
+                errores.append(str(e))
+        return errores
+
+
+class SistemaEntregas:
+    """Cola persistente y pool de trabajadores para entregar notificaciones"""
+
+    def __init__(self, max_trabajadores: int = 4, tamaño_lote: int = 50, max_intentos: int = 5,
+                 espera_base: int = 30, intervalo_sondeo: float = 5.0, plazo_reclamo: int = 600):
+        self.max_trabajadores = max_trabajadores
+        self.tamaño_lote = tamaño_lote
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base  # segundos; se duplica en cada reintento
+        self.intervalo_sondeo = intervalo_sondeo
+        self.plazo_reclamo = plazo_reclamo  # segundos tras los que un envío 'enviando' se da por abandonado
+        # Sin SMS_PASARELA no hay canal SMS: no se encolan SMS que nadie enviaría
+        self.canales: Dict[str, CanalEntrega] = {
+            'email': CanalEmail(LimitadorTasa(5, rafaga=10))
+        }
+        self.logger = logging.getLogger(__name__)
+        self._app = None
+        self._hilo = None
+        self._pool = None
+        self._lock_arranque = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._iniciado = False
+
+    def configurar_desde_app(self, app):
+        """Toma la configuración SMTP/SMS de app.config"""
+        config = app.config
+        self.canales['email'] = CanalEmail(
+            LimitadorTasa(config.get('EMAIL_POR_SEGUNDO', 5), rafaga=config.get('EMAIL_RAFAGA', 10)),
+            host=config.get('SMTP_HOST', 'localhost'),
+            port=int(config.get('SMTP_PORT', 1025)),
+            usuario=config.get('SMTP_USUARIO'),
+            password=config.get('SMTP_PASSWORD'),
+            usar_tls=config.get('SMTP_TLS', False),
+            remitente=config.get('SMTP_REMITENTE', 'apartamentos@localhost')
+        )
+        self.plazo_reclamo = int(config.get('ENTREGAS_PLAZO_RECLAMO', self.plazo_reclamo))
+        pasarela = config.get('SMS_PASARELA')
+        if pasarela is not None:
+            self.canales['sms'] = CanalSMS(
+                LimitadorTasa(config.get('SMS_POR_SEGUNDO', 1), rafaga=config.get('SMS_RAFAGA', 5)),
+                pasarela=pasarela
+            )
+        else:
+            self.canales.pop('sms', None)
+
+    def iniciar(self, app):
+        """Toma la configuración y deja el despachador para la primera petición: así solo
+        corre en el proceso que sirve (ni en los comandos flask ni en el padre del recargador)"""
+        self._app = app
+        self.configurar_desde_app(app)
+        app.before_request(self.arrancar)
+        if not self._iniciado:
+            # Despertar al despachador recién cuando sus envíos son visibles: tras el commit
+            db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+            db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+            self._iniciado = True
+
+    def arrancar(self):
+        """Arranca el hilo despachador y el pool de trabajadores (una sola vez por proceso)"""
+        if self._hilo is not None:
+            return
+        with self._lock_arranque:
+            if self._hilo is not None:
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.max_trabajadores, thread_name_prefix='entregas')
+            self._hilo = threading.Thread(target=self._bucle, name='despachador-entregas', daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """Detiene el despachador y espera a los envíos en curso"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._detener.clear()
+
+    def encolar(self, notif: Notificacion) -> List[EnvioNotificacion]:
+        """Agrega a la sesión los envíos de una notificación (se guardan con su commit)"""
+        return self.encolar_lote([notif])
+
+    def encolar_lote(self, notificaciones: List[Notificacion]) -> List[EnvioNotificacion]:
+        """Como encolar, pero buscando los contactos de todas las notificaciones en una consulta"""
+        candidatas = [n for n in notificaciones if n.tipo in TIPOS_ENTREGABLES and n.cuarto_id]
+        if not candidatas:
+            return []
+
+        contactos = {
+            c.cuarto_id: c for c in ContactoInquilino.query.filter(
+                ContactoInquilino.cuarto_id.in_({n.cuarto_id for n in candidatas})
+            ).all()
+        }
+
+        envios = []
+        for notif in candidatas:
+            contacto = contactos.get(notif.cuarto_id)
+            if not contacto:
+                continue
+            if contacto.email:
+                envios.append(EnvioNotificacion(canal='email', destino=contacto.email, notificacion=notif))
+            if contacto.telefono and 'sms' in self.canales:
+                envios.append(EnvioNotificacion(canal='sms', destino=contacto.telefono, notificacion=notif))
+
+        db.session.add_all(envios)
+
+        if envios:
+            db.session.info['entregas_encoladas'] = True
+        return envios
+
+    def procesar_pendientes(self) -> Dict:
+        """Reclama un lote de envíos vencidos, los envía en paralelo y guarda el resultado"""
+        ahora = datetime.utcnow()
+        lote = uuid.uuid4().hex
+        # Reclamar en un solo UPDATE: otro proceso despachador no puede tomar las mismas filas
+        vencidos = db.select(EnvioNotificacion.id).filter(
+            EnvioNotificacion.estado == 'pendiente',
+            EnvioNotificacion.proximo_intento <= ahora
+        ).order_by(EnvioNotificacion.proximo_intento).limit(self.tamaño_lote)
+        EnvioNotificacion.query.filter(EnvioNotificacion.id.in_(vencidos)).update(
+            {'estado': 'enviando', 'reclamado_por': lote, 'reclamado_en': ahora},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        envios = EnvioNotificacion.query.filter_by(reclamado_por=lote, estado='enviando') \
+            .order_by(EnvioNotificacion.proximo_intento).all()
+        if not envios:
+            return {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+
+        # Agrupar por canal y partir cada grupo para repartirlo entre los trabajadores del pool
+        por_canal: Dict[str, List[EnvioNotificacion]] = {}
+        for envio in envios:
+            por_canal.setdefault(envio.canal, []).append(envio)
+
+        futuros = []
+        for canal, envios_canal in por_canal.items():
+            tamaño = math.ceil(len(envios_canal) / self.max_trabajadores)
+            for i in range(0, len(envios_canal), tamaño):
+                grupo = envios_canal[i:i + tamaño]
+                datos = [{
+                    'destino': e.destino,
+                    'titulo': e.notificacion.titulo,
+                    'mensaje': e.notificacion.mensaje
+                } for e in grupo]
+                futuros.append((grupo, self._pool.submit(self._enviar_grupo, canal, datos)))
+
+        resultado = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+        for grupo, futuro in futuros:
+            for envio, error in zip(grupo, futuro.result()):
+                self._registrar_resultado(envio, error, resultado)
+
+        db.session.commit()
+        return resultado
+
+    def obtener_estadisticas(self) -> Dict:
+        """Cuenta los envíos por canal y estado"""
+        filas = db.session.query(
+            EnvioNotificacion.canal, EnvioNotificacion.estado, db.func.count(EnvioNotificacion.id)
+        ).group_by(EnvioNotificacion.canal, EnvioNotificacion.estado).all()
+
+        stats = {}
+        for canal, estado, total in filas:
+            stats.setdefault(canal, {})[estado] = total
+        return stats
+
+    # Métodos privados
+    def _al_hacer_commit(self, session):
+        """Despierta al despachador si el commit guardó envíos nuevos"""
+        if session.info.pop('entregas_encoladas', False):
+            self._despertar.set()
+
+    def _al_hacer_rollback(self, session):
+        """Los envíos descartados no despiertan a nadie"""
+        session.info.pop('entregas_encoladas', None)
+
+    def _enviar_grupo(self, canal: str, datos: List[Dict]) -> List[Optional[str]]:
+        """Ejecuta el envío de un sub-lote en un hilo del pool"""
+        implementacion = self.canales.get(canal)
+        if implementacion is None:
+            return [f'Canal no configurado: {canal}'] * len(datos)
+        try:
+            return implementacion.enviar_lote(datos)
+        except Exception as e:
+            return [str(e)] * len(datos)
+
+    def _registrar_resultado(self, envio: EnvioNotificacion, error: Optional[str], resultado: Dict):
+        """Actualiza el envío según el resultado, programando un reintento con backoff"""
+        envio.intentos = (envio.intentos or 0) + 1
+        envio.reclamado_por = None
+        envio.reclamado_en = None
+        if error is None:
+            envio.estado = 'enviado'
+            envio.fecha_envio = datetime.utcnow()
+            envio.ultimo_error = None
+            resultado['enviados'] += 1
+        elif envio.intentos >= self.max_intentos:
+            envio.estado = 'fallido'
+            envio.ultimo_error = error[:255]
+            resultado['fallidos'] += 1
+        else:
+            envio.estado = 'pendiente'
+            envio.ultimo_error = error[:255]
+            envio.proximo_intento = datetime.utcnow() + timedelta(
+                seconds=self.espera_base * 2 ** (envio.intentos - 1))
+            resultado['reintentos'] += 1
+
+    def _recuperar_en_curso(self):
+        """Devuelve a la cola los envíos reclamados hace más de plazo_reclamo (su proceso
+        murió a medias); los que otro despachador sigue enviando no se tocan"""
+        limite = datetime.utcnow() - timedelta(seconds=self.plazo_reclamo)
+        EnvioNotificacion.query.filter(
+            EnvioNotificacion.estado == 'enviando',
+            db.or_(EnvioNotificacion.reclamado_en.is_(None), EnvioNotificacion.reclamado_en < limite)
+        ).update({'estado': 'pendiente', 'reclamado_por': None, 'reclamado_en': None},
+                 synchronize_session=False)
+        db.session.commit()
+
+    def _bucle(self):
+        """Bucle del despachador; se despierta al encolar o cada intervalo_sondeo"""
+        with self._app.app_context():
+            while not self._detener.is_set():
+                # Limpiar antes de consultar: un commit que llegue durante el lote vuelve a despertar
+                self._despertar.clear()
+                try:
+                    self._recuperar_en_curso()
+                    resultado = self.procesar_pendientes()
+                except Exception as e:
+                    self.logger.error(f'Error procesando envíos: {e}')
+                    db.session.rollback()
+                    resultado = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+                finally:
+                    db.session.remove()
+
+                # Si el lote vino lleno puede quedar más trabajo: seguir sin esperar
+                if sum(resultado.values()) < self.tamaño_lote:
+                    self._despertar.wait(self.intervalo_sondeo)
+
+# Instancia global del sistema de entregas
+sistema_entregas = SistemaEntregas()
@@ -0,0 +1,107 @@
+"""
+Módulo de prueba de carga: registra pagos desde varios hilos sobre una base temporal
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from flask import Flask
+
+from models import db, configurar_sqlite, Apartamento, Cuarto, Pago
+from backend.control_pagos import ControlPagos
+
+
+class PruebaEstresPagos:
+    """Todos los hilos intentan los mismos pagos (cuarto, día): solo uno de cada par debe quedar"""
+
+    def __init__(self, hilos: int = 8, pagos_por_hilo: int = 30, cuartos: int = 10):
+        self.hilos = hilos
+        self.pagos_por_hilo = pagos_por_hilo
+        self.cuartos = cuartos
+
+    def comparar(self) -> Dict:
+        """Corre la prueba con la configuración anterior y con WAL + BEGIN IMMEDIATE"""
+        return {
+            'anterior': self.ejecutar(wal=False),
+            'wal': self.ejecutar(wal=True)
+        }
+
+    def ejecutar(self, wal: bool = True) -> Dict:
+        """Corre la prueba en una base temporal nueva; no toca la base de la aplicación"""
+        directorio = tempfile.mkdtemp(prefix='estres_pagos_')
+        try:
+            app = Flask(__name__)
+            app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(directorio, 'estres.db')}"
+            app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+            db.init_app(app)
+
+            with app.app_context():
+                if wal:
+                    configurar_sqlite(db.engine)
+                db.create_all()
+                cuarto_ids = self._crear_cuartos()
+
+            contadores = {'registrados': 0, 'rechazados': 0, 'errores': 0}
+            candado = threading.Lock()
+            inicio = time.perf_counter()
+            hilos = [threading.Thread(target=self._trabajador, args=(app, cuarto_ids, contadores, candado))
+                     for _ in range(self.hilos)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            segundos = time.perf_counter() - inicio
+
+            with app.app_context():
+                duplicados = db.session.query(Pago.cuarto_id, db.func.date(Pago.fecha))\
+                    .group_by(Pago.cuarto_id, db.func.date(Pago.fecha))\
+                    .having(db.func.count(Pago.id) > 1).count()
+                db.session.remove()
+                db.engine.dispose()
+
+            completados = contadores['registrados'] + contadores['rechazados']
+            return {
+                'modo': 'wal' if wal else 'anterior',
+                'intentos': self.hilos * self.pagos_por_hilo,
+                'esperados': self.pagos_por_hilo,
+                **contadores,
+                'duplicados_en_base': duplicados,
+                'segundos': round(segundos, 3),
+                'operaciones_por_segundo': round(completados / segundos, 1) if segundos else 0
+            }
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    # Métodos privados
+    def _crear_cuartos(self):
+        apartamento = Apartamento(numero=1, renta_base=500, numero_cuartos=self.cuartos)
+        db.session.add(apartamento)
+        db.session.flush()
+        cuartos = [Cuarto(numero=n, renta=500, activo=True, inquilino=f'Inquilino {n}',
+                          apartamento_id=apartamento.id, fecha_entrada=datetime.utcnow())
+                   for n in range(1, self.cuartos + 1)]
+        db.session.add_all(cuartos)
+        db.session.commit()
+        return [c.id for c in cuartos]
+
+    def _trabajador(self, app, cuarto_ids, contadores, candado):
+        """Recorre la misma secuencia de (cuarto, día) que los demás hilos"""
+        base = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+        with app.app_context():
+            control_pagos = ControlPagos()
+            for i in range(self.pagos_por_hilo):
+                cuarto_id = cuarto_ids[i % len(cuarto_ids)]
+                fecha = base - timedelta(days=i // len(cuarto_ids))
+                try:
+                    resultado = control_pagos.registrar_pago(cuarto_id, 500, fecha)
+                    clave = 'registrados' if resultado['success'] else 'rechazados'
+                except Exception:
+                    db.session.rollback()
+                    clave = 'errores'
+                with candado:
+                    contadores[clave] += 1
+            db.session.remove()
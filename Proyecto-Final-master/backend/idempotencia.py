@@ -0,0 +1,165 @@
+"""
+Módulo de claves de idempotencia (cabecera Idempotency-Key) para APIs de escritura
+"""
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Optional
+
+from flask import Response, g, has_request_context, jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ClaveIdempotencia
+
+CABECERA = 'Idempotency-Key'
+
+
+class SistemaIdempotencia:
+    """Guarda la respuesta de cada clave para contestar los reintentos sin repetir la escritura"""
+
+    def __init__(self, horas_expiracion: int = 24, segundos_reserva: int = 60):
+        self.horas_expiracion = horas_expiracion
+        # Una reserva sin respuesta ni escrituras más vieja que esto es de un proceso que murió
+        self.segundos_reserva = segundos_reserva
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Registra el evento que marca la clave en la misma transacción que las escrituras de la vista"""
+        if self._iniciado:
+            return
+        db.event.listen(db.session, 'before_commit', self._al_confirmar)
+        self._iniciado = True
+
+    def idempotente(self, vista):
+        """Decorador para vistas Flask: si llega Idempotency-Key la vista se ejecuta una sola vez"""
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            clave = request.headers.get(CABECERA)
+            if not clave:
+                return vista(*args, **kwargs)
+
+            huella = hashlib.sha256(request.get_data()).hexdigest()
+            existente = self.reservar(clave, request.path, huella)
+            if existente is not None:
+                return self._respuesta_existente(existente, request.path, huella)
+
+            g.clave_idempotencia = clave
+            try:
+                respuesta = make_response(vista(*args, **kwargs))
+            except Exception:
+                g.pop('clave_idempotencia', None)
+                self.liberar(clave)
+                raise
+            g.pop('clave_idempotencia', None)
+
+            # Lo que la vista haya dejado a medias (p. ej. tras una excepción atrapada) no se guarda
+            db.session.rollback()
+            # Error o fallo transitorio (muchas vistas contestan 200 con ok=False): permitir que
+            # el reintento vuelva a ejecutar, salvo que la vista ya haya confirmado escrituras
+            if self._es_exitosa(respuesta) or not self.liberar(clave):
+                self.guardar_respuesta(clave, respuesta.get_data(as_text=True), respuesta.status_code)
+            return respuesta
+        return envoltura
+
+    def reservar(self, clave: str, endpoint: str, huella: str) -> Optional[ClaveIdempotencia]:
+        """Reserva la clave; si ya existe (y no expiró) devuelve el registro existente. Una reserva
+        abandonada (sin respuesta ni escrituras tras segundos_reserva) se vuelve a tomar."""
+        ahora = datetime.utcnow()
+        existente = db.session.get(ClaveIdempotencia, clave)
+        if existente is not None:
+            if existente.expira > ahora:
+                if existente.endpoint == endpoint and existente.huella == huella \
+                        and self._retomar_reserva(clave, ahora):
+                    return None
+                return existente
+            db.session.delete(existente)
+            db.session.flush()
+
+        db.session.add(ClaveIdempotencia(
+            clave=clave,
+            endpoint=endpoint,
+            huella=huella,
+            expira=ahora + timedelta(hours=self.horas_expiracion)
+        ))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otra petición con la misma clave ganó la reserva
+            db.session.rollback()
+            return db.session.get(ClaveIdempotencia, clave)
+        return None
+
+    def guardar_respuesta(self, clave: str, cuerpo: str, codigo: int):
+        """Guarda la respuesta definitiva de la clave"""
+        registro = db.session.get(ClaveIdempotencia, clave)
+        if registro is None:
+            return
+        registro.respuesta = cuerpo
+        registro.codigo = codigo
+        db.session.commit()
+
+    def liberar(self, clave: str) -> bool:
+        """Elimina la reserva cuando la petición original falló sin confirmar escrituras;
+        devuelve False si las confirmó (la clave se conserva)"""
+        db.session.rollback()
+        eliminadas = ClaveIdempotencia.query.filter_by(clave=clave, escrita_en=None).delete()
+        db.session.commit()
+        return eliminadas > 0
+
+    def limpiar_expiradas(self) -> int:
+        """Elimina las claves expiradas"""
+        eliminadas = ClaveIdempotencia.query.filter(ClaveIdempotencia.expira <= datetime.utcnow())\
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return eliminadas
+
+    # Métodos privados
+    def _retomar_reserva(self, clave: str, ahora: datetime) -> bool:
+        """Toma una reserva abandonada con un UPDATE condicional: si dos reintentos llegan a la
+        vez, solo uno la toma"""
+        limite = ahora - timedelta(seconds=self.segundos_reserva)
+        tomadas = ClaveIdempotencia.query.filter(
+            ClaveIdempotencia.clave == clave,
+            ClaveIdempotencia.respuesta.is_(None),
+            ClaveIdempotencia.escrita_en.is_(None),
+            db.func.coalesce(ClaveIdempotencia.reservada_en, ClaveIdempotencia.fecha_creacion) <= limite
+        ).update({'reservada_en': ahora}, synchronize_session=False)
+        db.session.commit()
+        return tomadas > 0
+
+    def _al_confirmar(self, session):
+        """Durante una vista idempotente, marca la clave como escrita dentro de la transacción
+        que confirma las escrituras: si el proceso muere antes de guardar la respuesta, el
+        reintento sabe que no debe volver a ejecutar"""
+        if not has_request_context() or g.get('clave_idempotencia') is None:
+            return
+        session.flush()
+        if not session.connection().connection.dbapi_connection.in_transaction:
+            return  # la vista solo leyó
+        session.execute(db.update(ClaveIdempotencia).where(
+            ClaveIdempotencia.clave == g.clave_idempotencia,
+            ClaveIdempotencia.escrita_en.is_(None)
+        ).values(escrita_en=datetime.utcnow()))
+
+    def _es_exitosa(self, respuesta: Response) -> bool:
+        """Solo se repiten respuestas 2xx cuyo cuerpo no indique ok/success falso"""
+        if respuesta.status_code >= 300:
+            return False
+        cuerpo = respuesta.get_json(silent=True)
+        if not isinstance(cuerpo, dict):
+            return True
+        return bool(cuerpo.get('ok', cuerpo.get('success', True)))
+
+    def _respuesta_existente(self, registro: ClaveIdempotencia, endpoint: str, huella: str):
+        """Contesta un reintento a partir del registro guardado"""
+        if registro.endpoint != endpoint or registro.huella != huella:
+            return jsonify(ok=False, error='La clave de idempotencia ya se usó con otra petición'), 422
+        if registro.respuesta is None and registro.escrita_en is not None:
+            # Las escrituras se confirmaron pero el proceso murió antes de guardar la respuesta
+            return jsonify(ok=True, msg='La petición original se completó; su respuesta no se conservó'), 200
+        if registro.respuesta is None:
+            return jsonify(ok=False, error='La petición original todavía está en curso'), 409
+        return Response(registro.respuesta, status=registro.codigo, mimetype='application/json')
+
+# Instancia global de idempotencia
+sistema_idempotencia = SistemaIdempotencia()
@@ -1,4 +1,4 @@
-from models import db, Apartamento, Cuarto, Notificacion
+from models import db, Apartamento, Cuarto, Notificacion, OcupacionCuarto
 from datetime import datetime, timedelta
 from typing import Dict, List
 import random
@@ -80,42 +80,43 @@ class MarketingManager:
         """Genera estrategias para retener inquilinos actuales"""
         estrategias = []
         
-        apartamentos = Apartamento.query.all()
+        # Antigüedad real: inicio de la estadía abierta de cada cuarto ocupado
+        estadias = db.session.query(Apartamento.numero, Cuarto, OcupacionCuarto.desde)\
+            .join(Cuarto, OcupacionCuarto.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(OcupacionCuarto.hasta.is_(None), Cuarto.activo == True)\
+            .order_by(Apartamento.id, Cuarto.numero).all()
         
-        for apto in apartamentos:
-            cuartos = Cuarto.query.filter_by(apartamento_id=apto.id, activo=True).all()
+        for apto_numero, cuarto, desde in estadias:
+            dias_inquilino = (self.hoy - desde).days
+            
+            # Estrategia para inquilinos de larga duración
+            if dias_inquilino > 365:  # Más de un año
+                estrategia = {
+                    'tipo': 'fidelidad',
+                    'apartamento': apto_numero,
+                    'cuarto': cuarto.numero,
+                    'inquilino': cuarto.inquilino,
+                    'dias_inquilino': dias_inquilino,
+                    'estrategia': 'Descuento por fidelidad',
+                    'descuento_sugerido': 10,
+                    'descripcion': f'Descuento del 10% por ser inquilino por {dias_inquilino} días'
+                }
+                estrategias.append(estrategia)
             
-            for cuarto in cuartos:
-                if cuarto.ultimo_pago:
-                    dias_inquilino = (self.hoy - cuarto.ultimo_pago).days
-                    
-                    # Estrategia para inquilinos de larga duración
-                    if dias_inquilino > 365:  # Más de un año
-                        estrategia = {
-                            'tipo': 'fidelidad',
-                            'apartamento': apto.numero,
-                            'cuarto': cuarto.numero,
-                            'inquilino': cuarto.inquilino,
-                            'dias_inquilino': dias_inquilino,
-                            'estrategia': 'Descuento por fidelidad',
-                            'descuento_sugerido': 10,
-                            'descripcion': f'Descuento del 10% por ser inquilino por {dias_inquilino} días'
-                        }
-                        estrategias.append(estrategia)
-                    
-                    # Estrategia para inquilinos puntuales
-                    elif dias_inquilino > 90 and self._es_inquilino_puntual(cuarto.id):
-                        estrategia = {
-                            'tipo': 'puntualidad',
-                            'apartamento': apto.numero,
-                            'cuarto': cuarto.numero,
-                            'inquilino': cuarto.inquilino,
-                            'dias_inquilino': dias_inquilino,
-                            'estrategia': 'Bonificación por puntualidad',
-                            'bonificacion_sugerida': 50,
-                            'descripcion': 'Bonificación de $50 por pagos puntuales'
-                        }
-                        estrategias.append(estrategia)
+            # Estrategia para inquilinos puntuales
+            elif dias_inquilino > 90 and self._es_inquilino_puntual(cuarto.id):
+                estrategia = {
+                    'tipo': 'puntualidad',
+                    'apartamento': apto_numero,
+                    'cuarto': cuarto.numero,
+                    'inquilino': cuarto.inquilino,
+                    'dias_inquilino': dias_inquilino,
+                    'estrategia': 'Bonificación por puntualidad',
+                    'bonificacion_sugerida': 50,
+                    'descripcion': 'Bonificación de $50 por pagos puntuales'
+                }
+                estrategias.append(estrategia)
         
         return estrategias
     
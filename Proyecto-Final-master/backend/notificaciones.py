@@ -1,6 +1,18 @@
-from models import db, Notificacion, SolicitudPago, Cuarto, Apartamento, Pago, Gas
+from sqlalchemy.exc import IntegrityError
+from models import db, iniciar_escritura, Notificacion, SolicitudPago, Cuarto, Apartamento, Pago, PagoDiario, Gas
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from backend.entregas import sistema_entregas
+from backend.suscripciones import suscripciones_notificaciones
+from backend.conciliacion import conciliacion_pagos
+from backend.calendario_pagos import calendario_pagos
+
+# Títulos de las notificaciones agregadas por apartamento (modo resumen)
+TITULOS_RESUMEN = {
+    'pago_vencido': 'Pagos vencidos',
+    'gas_agotado': 'Gas agotado',
+    'limpieza_pendiente': 'Limpieza pendiente'
+}
 
 class SistemaNotificaciones:
     """Sistema inteligente de notificaciones para el manejo de apartamentos"""
@@ -10,7 +22,9 @@ class SistemaNotificaciones:
             'dias_antes_vencimiento': 3,
             'dias_gas_agotado': 7,
             'dias_limpieza_pendiente': 2,
-            'max_recordatorios': 3
+            'max_recordatorios': 3,
+            # Una notificación por apartamento, tipo y día en lugar de una por cuarto
+            'modo_resumen': False
         }
     
     def verificar_pagos_vencidos(self) -> List[Dict]:
@@ -21,6 +35,12 @@ class SistemaNotificaciones:
         # Buscar cuartos activos sin pago este mes
         cuartos_activos = Cuarto.query.filter_by(activo=True).all()
         
+        if self.configuraciones['modo_resumen']:
+            return self._crear_resumenes('pago_vencido', 'alta', [
+                c for c in cuartos_activos
+                if not c.ultimo_pago or not self._pago_es_del_mes_actual(c.ultimo_pago, hoy)
+            ])
+        
         for cuarto in cuartos_activos:
             if not cuarto.ultimo_pago or not self._pago_es_del_mes_actual(cuarto.ultimo_pago, hoy):
                 # Verificar si ya existe notificación reciente
@@ -51,6 +71,12 @@ class SistemaNotificaciones:
         
         cuartos_activos = Cuarto.query.filter_by(activo=True).all()
         
+        if self.configuraciones['modo_resumen']:
+            return self._crear_resumenes('gas_agotado', 'media', [
+                c for c in cuartos_activos
+                if not c.gas_ultimo or (hoy - c.gas_ultimo).days >= dias_limite
+            ])
+        
         for cuarto in cuartos_activos:
             if not cuarto.gas_ultimo or (hoy - cuarto.gas_ultimo).days >= dias_limite:
                 if not self._existe_notificacion_reciente(cuarto.id, 'gas_agotado', dias=2):
@@ -79,6 +105,12 @@ class SistemaNotificaciones:
         
         cuartos_activos = Cuarto.query.filter_by(activo=True).all()
         
+        if self.configuraciones['modo_resumen']:
+            return self._crear_resumenes('limpieza_pendiente', 'baja', [
+                c for c in cuartos_activos
+                if not c.limpieza_ultima or (hoy - c.limpieza_ultima).days >= dias_limite
+            ])
+        
         for cuarto in cuartos_activos:
             if not cuarto.limpieza_ultima or (hoy - cuarto.limpieza_ultima).days >= dias_limite:
                 if not self._existe_notificacion_reciente(cuarto.id, 'limpieza_pendiente', dias=1):
@@ -130,25 +162,40 @@ class SistemaNotificaciones:
         db.session.commit()
         return solicitud
     
-    def marcar_pago_recibido(self, cuarto_id: int, monto: float) -> Dict:
-        """Marca un pago como recibido y actualiza solicitudes pendientes"""
+    def marcar_pago_recibido(self, cuarto_id: int, monto: float, verificar_duplicado: bool = True) -> Dict:
+        """Marca un pago como recibido y actualiza solicitudes pendientes.
+        Igual que registrar_pago, sin clave de idempotencia solo admite un pago por cuarto y día."""
+        from backend.control_pagos import control_pagos
+        
+        fecha_pago = datetime.utcnow()
+        # La verificación, el pago y la conciliación van en la misma transacción de escritura
+        iniciar_escritura()
+        
         cuarto = Cuarto.query.get(cuarto_id)
         if not cuarto:
+            db.session.rollback()
             raise ValueError("Cuarto no encontrado")
+        if verificar_duplicado and control_pagos.verificar_pago_duplicado(cuarto_id, fecha_pago):
+            db.session.rollback()
+            raise ValueError("Ya existe un pago registrado para este cuarto en la fecha de hoy")
         
         # Crear registro de pago
-        pago = Pago(cuarto_id=cuarto_id, monto=monto)
-        cuarto.ultimo_pago = datetime.now()
+        pago = Pago(cuarto_id=cuarto_id, monto=monto, fecha=fecha_pago)
+        cuarto.ultimo_pago = fecha_pago
+        calendario_pagos.aplicar_pago(cuarto_id, monto, fecha_pago)
+        control_pagos.sincronizar_proximo_pago([cuarto])
         db.session.add(pago)
+        if verificar_duplicado:
+            db.session.add(PagoDiario(fecha=fecha_pago.date(), cuarto_id=cuarto_id, pago=pago))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Otro registro del mismo cuarto y día ganó la carrera
+            db.session.rollback()
+            raise ValueError("Ya existe un pago registrado para este cuarto en la fecha de hoy")
         
-        # Marcar solicitudes como pagadas
-        solicitudes_pendientes = SolicitudPago.query.filter_by(
-            cuarto_id=cuarto_id, 
-            estado='pendiente'
-        ).all()
-        
-        for solicitud in solicitudes_pendientes:
-            solicitud.estado = 'pagado'
+        # Aplicar el pago a las solicitudes abiertas según monto y fecha
+        conciliacion = conciliacion_pagos.conciliar([pago])
         
         # Marcar notificaciones de pago como leídas
         Notificacion.query.filter_by(
@@ -161,7 +208,9 @@ class SistemaNotificaciones:
         
         return {
             'mensaje': f'Pago de ${monto:.2f} registrado para Hab. {cuarto.numero}',
-            'solicitudes_actualizadas': len(solicitudes_pendientes)
+            'solicitudes_actualizadas': conciliacion['solicitudes_pagadas'] + conciliacion['solicitudes_parciales'],
+            'solicitudes_pagadas': conciliacion['solicitudes_pagadas'],
+            'monto_sin_aplicar': round(monto - conciliacion['monto_aplicado'], 2)
         }
     
     def obtener_notificaciones_pendientes(self, limite: int = 50) -> List[Dict]:
@@ -219,6 +268,67 @@ class SistemaNotificaciones:
             Notificacion.fecha >= fecha_limite
         ).first() is not None
     
+    def _crear_resumenes(self, tipo: str, prioridad: str, cuartos: List[Cuarto]) -> List[Dict]:
+        """Crea o actualiza la notificación del día de cada apartamento con sus cuartos afectados"""
+        por_apartamento = {}
+        for cuarto in cuartos:
+            por_apartamento.setdefault(cuarto.apartamento_id, []).append(cuarto)
+        
+        if not por_apartamento:
+            return []
+        
+        # Resúmenes de hoy ya existentes, en una sola consulta. El día es el local (el mismo
+        # hoy que el resto del módulo); fecha se guarda en UTC, así que el inicio se convierte
+        inicio_local = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        inicio_dia = inicio_local - inicio_local.astimezone().utcoffset()
+        existentes = {
+            n.apartamento_id: n for n in Notificacion.query.filter(
+                Notificacion.tipo == tipo,
+                Notificacion.cuarto_id.is_(None),
+                Notificacion.apartamento_id.in_(list(por_apartamento.keys())),
+                Notificacion.fecha >= inicio_dia
+            ).all()
+        }
+        
+        resumenes = []
+        for apartamento_id, cuartos_apto in por_apartamento.items():
+            numeros = sorted(c.numero for c in cuartos_apto)
+            apartamento = cuartos_apto[0].apartamento
+            titulo = f'{TITULOS_RESUMEN[tipo]} - Apto. {apartamento.numero}'
+            mensaje = f'{len(numeros)} habitación(es): ' + ', '.join(str(n) for n in numeros)
+            if tipo == 'pago_vencido':
+                mensaje += f' - Total ${sum(c.renta or 0 for c in cuartos_apto):.2f}'
+            
+            notif = existentes.get(apartamento_id)
+            if notif is None:
+                self._crear_notificacion(
+                    tipo=tipo,
+                    titulo=titulo,
+                    mensaje=mensaje[:255],
+                    prioridad=prioridad,
+                    apartamento_id=apartamento_id
+                )
+            elif notif.mensaje != mensaje[:255]:
+                # Cambió la lista de cuartos: se reemplaza el resumen del día por uno nuevo
+                # (sigue habiendo una fila por día) para que llegue a los suscriptores, que
+                # avanzan por id y no verían un cambio en la fila anterior
+                db.session.delete(notif)
+                self._crear_notificacion(
+                    tipo=tipo,
+                    titulo=titulo,
+                    mensaje=mensaje[:255],
+                    prioridad=prioridad,
+                    apartamento_id=apartamento_id
+                )
+            
+            resumenes.append({
+                'tipo': tipo,
+                'apartamento': apartamento.numero,
+                'cuartos': numeros
+            })
+        
+        return resumenes
+    
     def crear_notificacion(self, tipo: str, titulo: str, mensaje: str, 
                            prioridad: str, cuarto_id: int = None, apartamento_id: int = None) -> Notificacion:
         """Crea una nueva notificación"""
@@ -231,8 +341,24 @@ class SistemaNotificaciones:
             apartamento_id=apartamento_id
         )
         db.session.add(notif)
+        # Los envíos quedan en cola con el mismo commit; el despachador los manda después
+        sistema_entregas.encolar(notif)
         return notif
     
+    def crear_notificaciones(self, datos: List[Dict]) -> List[Notificacion]:
+        """Crea varias notificaciones con un solo INSERT (se confirman con el commit del llamador)"""
+        if not datos:
+            return []
+        
+        # Un solo INSERT ... RETURNING para todo el lote. SQLite no garantiza que las filas
+        # devueltas salgan en el orden de `datos`, así que no se emparejan por posición
+        notificaciones = db.session.scalars(
+            db.insert(Notificacion).returning(Notificacion), datos
+        ).all()
+        suscripciones_notificaciones.registrar_nuevas(db.session, notificaciones)
+        sistema_entregas.encolar_lote(notificaciones)
+        return notificaciones
+    
     def _crear_notificacion(self, tipo: str, titulo: str, mensaje: str, 
                            prioridad: str, cuarto_id: int = None, apartamento_id: int = None) -> Notificacion:
         """Crea una nueva notificación (método privado)"""
@@ -0,0 +1,182 @@
+"""
+Módulo del historial de ocupación: cada estadía de un inquilino es un intervalo [desde, hasta)
+"""
+import calendar
+from datetime import datetime
+from typing import Dict, List
+
+from models import db, Apartamento, Cuarto, OcupacionCuarto
+
+
+class HistorialOcupacion:
+    """Registra asignaciones y liberaciones como intervalos y responde consultas en el tiempo"""
+
+    def __init__(self):
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Abre los intervalos faltantes de los cuartos ocupados y registra el evento de sesión
+        que guarda cada asignación o liberación, venga de donde venga"""
+        if self._iniciado:
+            return
+        with app.app_context():
+            self.completar_intervalos_abiertos()
+        db.event.listen(db.session, 'before_flush', self._al_hacer_flush)
+        self._iniciado = True
+
+    def completar_intervalos_abiertos(self) -> int:
+        """Crea el intervalo abierto de los cuartos ocupados que todavía no tienen uno
+        (p. ej. los que ya estaban ocupados antes de existir el historial)"""
+        abiertos = db.session.query(OcupacionCuarto.cuarto_id).filter(OcupacionCuarto.hasta.is_(None))
+        cuartos = Cuarto.query.filter(Cuarto.activo == True, Cuarto.id.notin_(abiertos)).all()
+        if cuartos:
+            ahora = datetime.utcnow()
+            db.session.execute(db.insert(OcupacionCuarto), [{
+                'cuarto_id': c.id,
+                'inquilino': c.inquilino,
+                'renta': c.renta,
+                'desde': c.fecha_entrada or ahora
+            } for c in cuartos])
+            db.session.commit()
+        return len(cuartos)
+
+    def ocupacion_en(self, fecha: datetime) -> Dict:
+        """Cuartos ocupados en una fecha dada, por apartamento"""
+        filas = db.session.query(Apartamento.numero, Cuarto.numero, OcupacionCuarto.inquilino)\
+            .join(Cuarto, OcupacionCuarto.cuarto_id == Cuarto.id)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .filter(*self._vigente_en(fecha))\
+            .order_by(Apartamento.numero, Cuarto.numero).all()
+
+        por_apartamento = {}
+        for apto_num, cuarto_num, inquilino in filas:
+            por_apartamento.setdefault(apto_num, []).append({'cuarto': cuarto_num, 'inquilino': inquilino})
+
+        return {
+            'fecha': fecha.strftime('%d/%m/%Y %H:%M'),
+            'cuartos_ocupados': len(filas),
+            'apartamentos': [{'apartamento': n, 'ocupados': len(c), 'cuartos': c}
+                             for n, c in por_apartamento.items()]
+        }
+
+    def dias_ocupados_mes(self, año: int, mes: int) -> Dict:
+        """Días-cuarto ocupados en el mes por apartamento y tasa sobre los días-cuarto disponibles"""
+        inicio = datetime(año, mes, 1)
+        fin = datetime(año + mes // 12, mes % 12 + 1, 1)
+        corte = min(fin, datetime.utcnow())
+        if corte <= inicio:
+            return {'mes': f'{año}-{mes:02d}', 'dias_ocupados': 0, 'apartamentos': []}
+
+        # Parte de cada intervalo que cae dentro del mes (min/max de dos argumentos en SQLite)
+        dias = db.func.julianday(db.func.min(db.func.coalesce(OcupacionCuarto.hasta, corte), corte)) \
+            - db.func.julianday(db.func.max(OcupacionCuarto.desde, inicio))
+        ocupados = dict(db.session.query(Cuarto.apartamento_id, db.func.sum(dias))
+                        .join(Cuarto, OcupacionCuarto.cuarto_id == Cuarto.id)
+                        .filter(OcupacionCuarto.desde < corte,
+                                db.or_(OcupacionCuarto.hasta.is_(None), OcupacionCuarto.hasta > inicio))
+                        .group_by(Cuarto.apartamento_id).all())
+
+        dias_periodo = (corte - inicio).total_seconds() / 86400
+        apartamentos = []
+        for apto_id, numero, cuartos in db.session.query(Apartamento.id, Apartamento.numero, db.func.count(Cuarto.id))\
+                .join(Cuarto, Cuarto.apartamento_id == Apartamento.id)\
+                .group_by(Apartamento.id).order_by(Apartamento.numero).all():
+            dias_apto = float(ocupados.get(apto_id) or 0)
+            apartamentos.append({
+                'apartamento': numero,
+                'dias_ocupados': round(dias_apto, 1),
+                'tasa_ocupacion': round(dias_apto / (cuartos * dias_periodo) * 100, 1) if cuartos else 0
+            })
+
+        return {
+            'mes': f'{año}-{mes:02d}',
+            'dias_del_mes': calendar.monthrange(año, mes)[1],
+            'dias_ocupados': round(sum(a['dias_ocupados'] for a in apartamentos), 1),
+            'apartamentos': apartamentos
+        }
+
+    def duraciones_vacancia(self) -> List[Dict]:
+        """Vacancias entre inquilinos de cada cuarto (LAG sobre los intervalos) y la vacancia
+        actual de los cuartos libres"""
+        anterior = db.func.lag(OcupacionCuarto.hasta).over(
+            partition_by=OcupacionCuarto.cuarto_id, order_by=OcupacionCuarto.desde)
+        intervalos = db.session.query(
+            OcupacionCuarto.cuarto_id.label('cuarto_id'),
+            (db.func.julianday(OcupacionCuarto.desde) - db.func.julianday(anterior)).label('dias')
+        ).subquery()
+        vacancias = {cuarto_id: (cantidad, promedio, maximo) for cuarto_id, cantidad, promedio, maximo in
+                     db.session.query(intervalos.c.cuarto_id, db.func.count(intervalos.c.dias),
+                                      db.func.avg(intervalos.c.dias), db.func.max(intervalos.c.dias))
+                     .filter(intervalos.c.dias.isnot(None))
+                     .group_by(intervalos.c.cuarto_id).all()}
+
+        ultima_salida = dict(db.session.query(OcupacionCuarto.cuarto_id, db.func.max(OcupacionCuarto.hasta))
+                             .group_by(OcupacionCuarto.cuarto_id).all())
+
+        ahora = datetime.utcnow()
+        resultado = []
+        for cuarto_id, cuarto_num, apto_num, activo in db.session.query(
+                Cuarto.id, Cuarto.numero, Apartamento.numero, Cuarto.activo)\
+                .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+                .order_by(Apartamento.numero, Cuarto.numero).all():
+            cantidad, promedio, maximo = vacancias.get(cuarto_id, (0, None, None))
+            salida = ultima_salida.get(cuarto_id)
+            resultado.append({
+                'apartamento': apto_num,
+                'cuarto': cuarto_num,
+                'vacancias': cantidad,
+                'promedio_dias': round(promedio, 1) if promedio is not None else None,
+                'maximo_dias': round(maximo, 1) if maximo is not None else None,
+                'vacante_desde_dias': round((ahora - salida).total_seconds() / 86400, 1)
+                if not activo and salida else None
+            })
+        return resultado
+
+    def intervalos_apartamento(self, apartamento_id: int) -> List[OcupacionCuarto]:
+        """Estadías de los cuartos de un apartamento, de la más reciente a la más antigua.
+        El cuarto sale del mismo join (sin una consulta por estadía al leer estadia.cuarto)."""
+        return OcupacionCuarto.query.join(OcupacionCuarto.cuarto)\
+            .options(db.contains_eager(OcupacionCuarto.cuarto))\
+            .filter(Cuarto.apartamento_id == apartamento_id)\
+            .order_by(OcupacionCuarto.desde.desc()).all()
+
+    # Métodos privados
+    def _vigente_en(self, fecha: datetime) -> tuple:
+        return (OcupacionCuarto.desde <= fecha,
+                db.or_(OcupacionCuarto.hasta.is_(None), OcupacionCuarto.hasta > fecha))
+
+    def _al_hacer_flush(self, session, flush_context, instances):
+        """Abre o cierra intervalos según los cambios de activo / inquilino de los cuartos"""
+        cambios = []
+        for cuarto in list(session.new) + list(session.dirty):
+            if not isinstance(cuarto, Cuarto):
+                continue
+            estado = db.inspect(cuarto)
+            if cuarto in session.new:
+                if cuarto.activo:
+                    cambios.append((cuarto, estado))
+            elif estado.attrs.activo.history.has_changes() or \
+                    (cuarto.activo and estado.attrs.inquilino.history.has_changes()):
+                cambios.append((cuarto, estado))
+        if not cambios:
+            return
+
+        ahora = datetime.utcnow()
+        with session.no_autoflush:
+            ids = [c.id for c, _ in cambios if c.id is not None]
+            abiertos = {o.cuarto_id: o for o in session.query(OcupacionCuarto).filter(
+                OcupacionCuarto.cuarto_id.in_(ids), OcupacionCuarto.hasta.is_(None))} if ids else {}
+
+            for cuarto, estado in cambios:
+                abierto = abiertos.get(cuarto.id)
+                if abierto is not None:
+                    abierto.hasta = ahora
+                if cuarto.activo:
+                    # La fecha de entrada recién asignada marca el inicio de la estadía
+                    desde = cuarto.fecha_entrada if cuarto.fecha_entrada and (
+                        cuarto in session.new or estado.attrs.fecha_entrada.history.has_changes()) else ahora
+                    session.add(OcupacionCuarto(cuarto=cuarto, inquilino=cuarto.inquilino,
+                                                renta=cuarto.renta, desde=desde))
+
+# Instancia global del historial de ocupación
+historial_ocupacion = HistorialOcupacion()
@@ -0,0 +1,222 @@
+"""
+Módulo del programador de recordatorios de pago (montículo ordenado por instante de disparo)
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from models import db, Cuarto, RecordatorioPago
+from backend.notificaciones import sistema_notificaciones
+
+DIAS_RECORDATORIO = (3, 1)
+
+
+class ProgramadorRecordatorios:
+    """Mantiene en memoria los próximos recordatorios y dispara cada uno una sola vez"""
+
+    def __init__(self, espera_maxima: int = 300):
+        self.espera_maxima = espera_maxima  # por si cambia el reloj del sistema
+        self.monticulo: List[Tuple] = []  # (instante, cuarto_id, dias_antes, fecha_pago)
+        self.condicion = threading.Condition()
+        self.logger = logging.getLogger(__name__)
+        self._cargado = False
+        self._detener = threading.Event()
+        self._hilo = None
+        self._app = None
+
+    def iniciar(self, app):
+        """Reconstruye el montículo, registra los eventos de sesión y arranca el hilo"""
+        if self._hilo is not None:
+            return
+        self._app = app
+        with app.app_context():
+            self.reconstruir()
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._hilo = threading.Thread(target=self._bucle, name='recordatorios-pago', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo de disparo"""
+        self._detener.set()
+        with self.condicion:
+            self.condicion.notify_all()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        self._detener.clear()
+
+    def reconstruir(self):
+        """Carga los recordatorios pendientes de los cuartos activos con pago por venir"""
+        ahora = datetime.utcnow()
+        enviados = set(db.session.query(
+            RecordatorioPago.cuarto_id, RecordatorioPago.fecha_pago, RecordatorioPago.dias_antes
+        ).filter(RecordatorioPago.fecha_pago >= ahora).all())
+
+        entradas = []
+        for cuarto_id, proximo_pago in db.session.query(Cuarto.id, Cuarto.proximo_pago).filter(
+            Cuarto.activo == True,
+            Cuarto.proximo_pago >= ahora
+        ).all():
+            for entrada in self._entradas(cuarto_id, proximo_pago, ahora):
+                if (cuarto_id, proximo_pago, entrada[2]) not in enviados:
+                    entradas.append(entrada)
+
+        heapq.heapify(entradas)
+        with self.condicion:
+            self.monticulo = entradas
+            self._cargado = True
+            self.condicion.notify_all()
+
+    def programar(self, cuartos: List[Tuple[int, datetime]]):
+        """Agrega los recordatorios de cuartos cuyo próximo pago cambió (cuarto_id, proximo_pago).
+        Las entradas anteriores del cuarto se descartan al dispararse por no coincidir."""
+        ahora = datetime.utcnow()
+        with self.condicion:
+            for cuarto_id, proximo_pago in cuartos:
+                for entrada in self._entradas(cuarto_id, proximo_pago, ahora):
+                    heapq.heappush(self.monticulo, entrada)
+            self.condicion.notify_all()
+
+    def procesar_vencidos(self, ahora: datetime = None) -> List[Cuarto]:
+        """Dispara los recordatorios cuyo instante ya llegó; devuelve los cuartos notificados"""
+        if not self._cargado:
+            self.reconstruir()
+        ahora = ahora or datetime.utcnow()
+
+        vencidas = []
+        with self.condicion:
+            while self.monticulo and self.monticulo[0][0] <= ahora:
+                vencidas.append(heapq.heappop(self.monticulo))
+        if not vencidas:
+            return []
+
+        try:
+            return self._disparar(vencidas, ahora)
+        except Exception:
+            db.session.rollback()
+            with self.condicion:
+                for entrada in vencidas:
+                    heapq.heappush(self.monticulo, entrada)
+            raise
+
+    def obtener_estadisticas(self) -> Dict:
+        """Tamaño del montículo y próximo instante de disparo"""
+        with self.condicion:
+            proximo = self.monticulo[0][0] if self.monticulo else None
+            return {
+                'programados': len(self.monticulo),
+                'proximo': proximo.strftime('%d/%m/%Y %H:%M') if proximo else None
+            }
+
+    # Métodos privados
+    def _entradas(self, cuarto_id: int, proximo_pago: datetime, ahora: datetime) -> List[Tuple]:
+        """Recordatorios de un próximo pago; uno atrasado solo se conserva si el siguiente
+        más urgente todavía no llega (así un arranque tardío no manda los dos)"""
+        if proximo_pago is None or proximo_pago <= ahora:
+            return []
+        dia_pago = datetime.combine(proximo_pago.date(), datetime.min.time())
+        entradas = []
+        for i, dias in enumerate(DIAS_RECORDATORIO):
+            siguiente = DIAS_RECORDATORIO[i + 1] if i + 1 < len(DIAS_RECORDATORIO) else None
+            if siguiente is not None and dia_pago - timedelta(days=siguiente) <= ahora:
+                continue
+            entradas.append((dia_pago - timedelta(days=dias), cuarto_id, dias, proximo_pago))
+        return entradas
+
+    def _disparar(self, vencidas: List[Tuple], ahora: datetime) -> List[Cuarto]:
+        """Registra y notifica los recordatorios que siguen vigentes, en una transacción"""
+        cuartos = {c.id: c for c in Cuarto.query.filter(
+            Cuarto.id.in_({cuarto_id for _, cuarto_id, _, _ in vencidas})).all()}
+
+        # Solo el recordatorio más urgente de cada cuarto y si su próximo pago no cambió
+        vigentes = {}
+        for _, cuarto_id, dias, fecha_pago in vencidas:
+            cuarto = cuartos.get(cuarto_id)
+            if not cuarto or not cuarto.activo or cuarto.proximo_pago != fecha_pago or fecha_pago <= ahora:
+                continue
+            if cuarto_id not in vigentes or dias < vigentes[cuarto_id]:
+                vigentes[cuarto_id] = dias
+        if not vigentes:
+            return []
+
+        # INSERT OR IGNORE ... RETURNING: solo vuelven las filas nuevas, así cada recordatorio
+        # se dispara una vez aunque otro proceso lo haya registrado antes
+        insertados = db.session.execute(
+            db.insert(RecordatorioPago).prefix_with('OR IGNORE').returning(
+                RecordatorioPago.cuarto_id, RecordatorioPago.dias_antes),
+            [{
+                'cuarto_id': cuarto_id,
+                'fecha_pago': cuartos[cuarto_id].proximo_pago,
+                'dias_antes': dias,
+                'fecha_envio': ahora
+            } for cuarto_id, dias in vigentes.items()]
+        ).all()
+
+        notificaciones = []
+        notificados = []
+        for cuarto_id, dias in insertados:
+            cuarto = cuartos[cuarto_id]
+            fecha = cuarto.proximo_pago.strftime("%d/%m/%Y")
+            restantes = (cuarto.proximo_pago.date() - ahora.date()).days
+            urgente = restantes <= 1
+            notificaciones.append({
+                'tipo': 'recordatorio_pago',
+                'titulo': 'Recordatorio Urgente' if urgente else 'Recordatorio de Pago',
+                'mensaje': f'Habitación {cuarto.numero} - {cuarto.inquilino}: ' + (
+                    f'Pago vence mañana ({fecha})' if restantes == 1 else
+                    f'Pago vence hoy ({fecha})' if restantes <= 0 else
+                    f'Pago vence en {restantes} días ({fecha})'),
+                'prioridad': 'alta' if urgente else 'media',
+                'cuarto_id': cuarto.id,
+                'apartamento_id': cuarto.apartamento_id
+            })
+            notificados.append(cuarto)
+
+        if notificaciones:
+            sistema_notificaciones.crear_notificaciones(notificaciones)
+        db.session.commit()
+        return notificados
+
+    def _bucle(self):
+        """Espera hasta el próximo instante del montículo (o a que se programe uno nuevo)"""
+        with self._app.app_context():
+            while not self._detener.is_set():
+                try:
+                    self.procesar_vencidos()
+                except Exception as e:
+                    self.logger.error(f'Error disparando recordatorios: {e}')
+                finally:
+                    db.session.remove()
+
+                with self.condicion:
+                    espera = self.espera_maxima
+                    if self.monticulo:
+                        espera = min(espera, (self.monticulo[0][0] - datetime.utcnow()).total_seconds())
+                    if espera > 0 and not self._detener.is_set():
+                        self.condicion.wait(espera)
+
+    def _al_hacer_flush(self, session, flush_context):
+        """Anota los cuartos cuyo proximo_pago o estado cambió en este flush"""
+        cambios = session.info.setdefault('recordatorios_cuartos', {})
+        for obj in list(session.new) + list(session.dirty):
+            if not isinstance(obj, Cuarto):
+                continue
+            estado = db.inspect(obj)
+            if obj in session.new or estado.attrs.proximo_pago.history.has_changes() \
+                    or estado.attrs.activo.history.has_changes():
+                cambios[obj.id] = obj.proximo_pago if obj.activo else None
+
+    def _al_hacer_commit(self, session):
+        cambios = session.info.pop('recordatorios_cuartos', {})
+        if cambios:
+            self.programar([(c, p) for c, p in cambios.items() if p is not None])
+
+    def _al_hacer_rollback(self, session):
+        session.info.pop('recordatorios_cuartos', None)
+
+# Instancia global del programador de recordatorios
+programador_recordatorios = ProgramadorRecordatorios()
@@ -0,0 +1,162 @@
+"""
+Módulo de reportes en lote: rentabilidad de todos los apartamentos con las consultas agrupadas
+de AnalyticsManager. Por defecto corre en este proceso; opcionalmente se reparte en procesos,
+cada uno con su propia conexión de solo lectura a la base SQLite (medido con
+`flask reporte-rentabilidad --benchmark`, el pool fue más lento hasta 5000 apartamentos:
+arrancar los procesos cuesta más que las consultas).
+"""
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from flask import Flask
+
+from models import db, Apartamento
+from backend.analytics import AnalyticsManager
+
+# Estado de cada proceso trabajador (lo crea _iniciar_trabajador)
+_trabajador = {}
+
+
+def _iniciar_trabajador(ruta_db: str):
+    """Abre la base en modo de solo lectura con una app propia del proceso"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///file:{ruta_db}?mode=ro&uri=true"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    contexto = app.app_context()
+    contexto.push()
+    _trabajador.update(app=app, contexto=contexto)
+
+
+def _calcular_particion(apartamento_ids: List[int], hoy: datetime) -> List[Dict]:
+    """Rentabilidad de una partición con las consultas agrupadas de AnalyticsManager"""
+    analytics = AnalyticsManager()
+    analytics.hoy, analytics.mes_actual, analytics.año_actual = hoy, hoy.month, hoy.year
+    try:
+        return analytics._calcular_rentabilidades(apartamento_ids)
+    finally:
+        db.session.remove()
+
+
+class ReportesLote:
+    """Calcula la rentabilidad en lote en este proceso o, con paralelo=True, repartida en
+    particiones en un ProcessPoolExecutor; los resultados van ordenados por número de apartamento"""
+
+    def __init__(self, procesos: int = None, particiones_por_proceso: int = 4):
+        self.procesos = procesos or os.cpu_count() or 1
+        self.particiones_por_proceso = particiones_por_proceso  # más particiones reparten mejor la carga
+
+    def generar(self, apartamento_ids: List[int] = None, paralelo: bool = False, procesos: int = None,
+                al_avanzar: Callable[[int, int, int], None] = None) -> Dict:
+        """Rentabilidad de los apartamentos indicados (por defecto todos) con las consultas
+        agrupadas en este proceso; paralelo=True usa el pool de procesos"""
+        if paralelo:
+            return self.generar_paralelo(procesos, apartamento_ids, al_avanzar)
+        return self.generar_agrupado(apartamento_ids)
+
+    def generar_paralelo(self, procesos: int = None, apartamento_ids: List[int] = None,
+                         al_avanzar: Callable[[int, int, int], None] = None) -> Dict:
+        """Rentabilidad repartida en particiones entre procesos. al_avanzar recibe
+        (particiones terminadas, total de particiones, apartamentos calculados)."""
+        procesos = procesos or self.procesos
+        hoy = datetime.now()
+        if apartamento_ids is None:
+            apartamento_ids = [a[0] for a in db.session.query(Apartamento.id).order_by(Apartamento.id).all()]
+        particiones = self._particionar(apartamento_ids, procesos)
+        trabajadores = min(procesos, len(particiones)) or 1
+        ruta_db = db.engine.url.database
+        db.session.remove()
+
+        inicio = time.perf_counter()
+        resultados = []
+        # spawn: los hilos de fondo de la aplicación no se heredan a medio camino como con fork
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto,
+                                 initializer=_iniciar_trabajador, initargs=(ruta_db,)) as ejecutor:
+            futuros = [ejecutor.submit(_calcular_particion, particion, hoy) for particion in particiones]
+            for terminadas, futuro in enumerate(as_completed(futuros), 1):
+                resultados.extend(futuro.result())
+                if al_avanzar:
+                    al_avanzar(terminadas, len(particiones), len(resultados))
+
+        resultados.sort(key=lambda a: a['numero'])
+        return {
+            'fecha_reporte': hoy.isoformat(),
+            'procesos': trabajadores,
+            'particiones': len(particiones),
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'apartamentos': resultados
+        }
+
+    def generar_secuencial(self, apartamento_ids: List[int] = None) -> Dict:
+        """Camino anterior: calcular_rentabilidad_apartamento uno por uno en este proceso"""
+        hoy = datetime.now()
+        analytics = AnalyticsManager()
+        analytics.hoy, analytics.mes_actual, analytics.año_actual = hoy, hoy.month, hoy.year
+        if apartamento_ids is None:
+            apartamento_ids = [a[0] for a in db.session.query(Apartamento.id).order_by(Apartamento.id).all()]
+
+        inicio = time.perf_counter()
+        resultados = [r for r in (analytics._calcular_rentabilidad_apartamento(a) for a in apartamento_ids) if r]
+        resultados.sort(key=lambda a: a['numero'])
+        return {
+            'fecha_reporte': hoy.isoformat(),
+            'procesos': 1,
+            'particiones': 1,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'apartamentos': resultados
+        }
+
+    def generar_agrupado(self, apartamento_ids: List[int] = None) -> Dict:
+        """Las mismas consultas agrupadas que usa el pool, todas en este proceso"""
+        hoy = datetime.now()
+        if apartamento_ids is None:
+            apartamento_ids = [a[0] for a in db.session.query(Apartamento.id).order_by(Apartamento.id).all()]
+
+        inicio = time.perf_counter()
+        resultados = _calcular_particion(apartamento_ids, hoy)
+        resultados.sort(key=lambda a: a['numero'])
+        return {
+            'fecha_reporte': hoy.isoformat(),
+            'procesos': 1,
+            'particiones': 1,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'apartamentos': resultados
+        }
+
+    def medir_rendimiento(self, procesos: int = None, al_avanzar: Callable[[int, int, int], None] = None,
+                          incluir_secuencial: bool = False) -> Dict:
+        """Compara el pool contra las mismas consultas agrupadas en un solo proceso, de modo que
+        la aceleración mide solo el reparto en procesos. incluir_secuencial agrega el tiempo del
+        camino anterior (una consulta por apartamento) como referencia."""
+        agrupado = self.generar_agrupado()
+        paralelo = self.generar_paralelo(procesos, al_avanzar=al_avanzar)
+        medicion = {
+            'apartamentos': len(paralelo['apartamentos']),
+            'procesos': paralelo['procesos'],
+            'particiones': paralelo['particiones'],
+            'segundos_agrupado': agrupado['segundos'],
+            'segundos_paralelo': paralelo['segundos'],
+            'aceleracion': round(agrupado['segundos'] / paralelo['segundos'], 2) if paralelo['segundos'] else None,
+            'resultados_iguales': agrupado['apartamentos'] == paralelo['apartamentos']
+        }
+        if incluir_secuencial:
+            secuencial = self.generar_secuencial()
+            medicion['segundos_secuencial'] = secuencial['segundos']
+            medicion['resultados_iguales'] &= secuencial['apartamentos'] == paralelo['apartamentos']
+        return medicion
+
+    # Métodos privados
+    def _particionar(self, apartamento_ids: List[int], procesos: int) -> List[List[int]]:
+        if not apartamento_ids:
+            return []
+        tamaño = math.ceil(len(apartamento_ids) / (procesos * self.particiones_por_proceso))
+        return [apartamento_ids[i:i + tamaño] for i in range(0, len(apartamento_ids), tamaño)]
+
+# Instancia global de los reportes en lote
+reportes_lote = ReportesLote()
@@ -1,50 +1,103 @@
 import os
-import shutil
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Dict
+import bz2
 import gzip
+import io
 import json
+import lzma
+
+from models import db
+
+# Compresores de la biblioteca estándar: extensión, módulo, niveles y nombre del parámetro de nivel
+CODECS = {
+    'gzip': {'extension': '.gz', 'modulo': gzip, 'niveles': range(1, 10), 'parametro': 'compresslevel'},
+    'bz2': {'extension': '.bz2', 'modulo': bz2, 'niveles': range(1, 10), 'parametro': 'compresslevel'},
+    'lzma': {'extension': '.xz', 'modulo': lzma, 'niveles': range(0, 10), 'parametro': 'preset'},
+}
 
 class SistemaRespaldos:
     """Sistema automático de respaldos para la base de datos"""
     
-    def __init__(self, db_path: str = "apartamentos.db", backup_dir: str = "backups"):
+    def __init__(self, db_path: str = "apartamentos.db", backup_dir: str = "backups",
+                 paginas_por_paso: int = 1024, pausa_ms: int = 5, maximo_reinicios: int = 3,
+                 codec: str = "gzip", nivel: int = 6, hilos: int = 1, tamaño_bloque: int = 4 * 1024 * 1024):
         self.db_path = db_path
         self.backup_dir = backup_dir
+        self.paginas_por_paso = paginas_por_paso  # páginas copiadas por paso de la API de backup
+        self.pausa_ms = pausa_ms  # pausa entre pasos para dejar pasar a las escrituras
+        self.maximo_reinicios = maximo_reinicios  # luego se copia en un solo paso
+        self.codec = codec
+        self.nivel = nivel
+        self.hilos = hilos  # más de uno comprime bloques independientes en paralelo
+        self.tamaño_bloque = tamaño_bloque
         self.ensure_backup_directory()
     
+    def iniciar(self, app):
+        """Toma la ruta de la base de la aplicación y la configuración de los pasos de copia"""
+        with app.app_context():
+            self.db_path = db.engine.url.database
+        self.paginas_por_paso = app.config.get("RESPALDO_PAGINAS_POR_PASO", self.paginas_por_paso)
+        self.pausa_ms = app.config.get("RESPALDO_PAUSA_MS", self.pausa_ms)
+        self.codec = app.config.get("RESPALDO_CODEC", self.codec)
+        self.nivel = app.config.get("RESPALDO_NIVEL", self.nivel)
+        self.hilos = app.config.get("RESPALDO_HILOS", self.hilos)
+    
     def ensure_backup_directory(self):
         """Asegura que el directorio de respaldos existe"""
         if not os.path.exists(self.backup_dir):
             os.makedirs(self.backup_dir)
     
-    def crear_respaldo_completo(self) -> str:
-        """Crea un respaldo completo de la base de datos"""
+    def crear_respaldo_completo(self, codec: str = None, nivel: int = None, hilos: int = None) -> str:
+        """Crea un respaldo completo de la base de datos. La copia se hace en memoria y va
+        directo al compresor: en disco solo se escribe el archivo comprimido. No es un flujo:
+        mientras se serializa la copia hay dos veces el tamaño de la base en RAM (la base en
+        :memory: y sus bytes), y luego una vez durante la compresión."""
+        codec, nivel = self._validar_codec(codec, nivel)
+        hilos = self._validar_hilos(hilos)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"respaldo_completo_{timestamp}.db"
-        backup_path = os.path.join(self.backup_dir, backup_filename)
+        backup_filename = f"respaldo_completo_{timestamp}.db{CODECS[codec]['extension']}"
+        compressed_path = os.path.join(self.backup_dir, backup_filename)
         
         try:
-            # Copiar la base de datos
-            shutil.copy2(self.db_path, backup_path)
+            # Copia consistente con la API de backup de SQLite, por pasos
+            inicio = time.perf_counter()
+            memoria = sqlite3.connect(":memory:")
+            try:
+                copia = self.copiar_en_linea(memoria)
+                
+                # Verificar la copia antes de darla por buena
+                inicio_verificacion = time.perf_counter()
+                integridad = self.verificar_integridad(memoria)
+                segundos_verificacion = time.perf_counter() - inicio_verificacion
+                if integridad != ['ok']:
+                    raise Exception(f"La copia no pasó integrity_check: {'; '.join(integridad[:5])}")
+                datos = memoria.serialize()
+            finally:
+                memoria.close()
             
             # Comprimir el respaldo
-            compressed_path = f"{backup_path}.gz"
-            with open(backup_path, 'rb') as f_in:
-                with gzip.open(compressed_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            
-            # Eliminar el archivo sin comprimir
-            os.remove(backup_path)
+            compresion = self.comprimir(datos, compressed_path, codec, nivel, hilos)
             
             # Crear metadatos del respaldo
             metadata = {
                 'fecha_creacion': datetime.now().isoformat(),
                 'tipo': 'completo',
-                'tamaño_original': os.path.getsize(self.db_path),
-                'tamaño_comprimido': os.path.getsize(compressed_path),
-                'archivo': compressed_path
+                'tamaño_original': len(datos),
+                'tamaño_comprimido': compresion['bytes_escritos'],
+                'archivo': compressed_path,
+                'integridad': 'ok',
+                'copia': copia,
+                'compresion': compresion,
+                'tiempos': {
+                    'copia_segundos': copia['segundos'],
+                    'verificacion_segundos': round(segundos_verificacion, 3),
+                    'compresion_segundos': compresion['segundos'],
+                    'total_segundos': round(time.perf_counter() - inicio, 3)
+                }
             }
             
             metadata_path = f"{compressed_path}.meta"
@@ -54,13 +107,83 @@ class SistemaRespaldos:
             return compressed_path
             
         except Exception as e:
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
             raise Exception(f"Error creando respaldo: {str(e)}")
     
-    def crear_respaldo_incremental(self) -> str:
+    def comprimir(self, datos: bytes, path: str, codec: str = None, nivel: int = None, hilos: int = None) -> Dict:
+        """Escribe los datos comprimidos en una sola pasada. Con varios hilos, cada bloque se
+        comprime por separado en paralelo (zlib, bz2 y lzma sueltan el GIL) y los bloques se
+        concatenan: gzip, bz2 y xz admiten varios miembros seguidos en un archivo."""
+        codec, nivel = self._validar_codec(codec, nivel)
+        hilos = self._validar_hilos(hilos)
+        modulo, parametro = CODECS[codec]['modulo'], CODECS[codec]['parametro']
+        vista = memoryview(datos)
+        bloques = [vista[i:i + self.tamaño_bloque] for i in range(0, len(datos), self.tamaño_bloque)]
+        
+        inicio = time.perf_counter()
+        if hilos > 1 and len(bloques) > 1:
+            with ThreadPoolExecutor(max_workers=hilos) as ejecutor, open(path, 'wb') as f:
+                for comprimido in ejecutor.map(lambda b: modulo.compress(b, **{parametro: nivel}), bloques):
+                    f.write(comprimido)
+        else:
+            with modulo.open(path, 'wb', **{parametro: nivel}) as f:
+                for bloque in bloques:
+                    f.write(bloque)
+        return self._resumen_compresion(codec, nivel, hilos if len(bloques) > 1 else 1, len(bloques),
+                                        len(datos), path, time.perf_counter() - inicio)
+    
+    def copiar_en_linea(self, destino: sqlite3.Connection) -> Dict:
+        """Copia la base con sqlite3.Connection.backup de a `paginas_por_paso` páginas, con una
+        pausa entre pasos; cada paso toma el candado de lectura solo mientras dura. Si otra
+        conexión escribe durante la copia, SQLite la reinicia desde el principio; después de
+        `maximo_reinicios` se termina en un solo paso (en modo WAL no detiene a las escrituras)."""
+        origen = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+        estado = {'pasos': 0, 'paginas': 0, 'reinicios': 0, 'restantes': None}
+        
+        def al_avanzar(status, restantes, total):
+            estado['pasos'] += 1
+            estado['paginas'] = total
+            if estado['restantes'] is not None and restantes > estado['restantes']:
+                estado['reinicios'] += 1
+                if estado['reinicios'] > self.maximo_reinicios:
+                    raise InterruptedError('demasiados reinicios')
+            estado['restantes'] = restantes
+            if restantes and self.pausa_ms:
+                time.sleep(self.pausa_ms / 1000)
+        
+        inicio = time.perf_counter()
+        un_paso = False
+        try:
+            try:
+                origen.backup(destino, pages=self.paginas_por_paso, progress=al_avanzar)
+            except InterruptedError:
+                un_paso = True
+                estado['pasos'] += 1
+                origen.backup(destino, pages=-1)
+        finally:
+            origen.close()
+        
+        return {
+            'paginas': estado['paginas'],
+            'pasos': estado['pasos'],
+            'paginas_por_paso': self.paginas_por_paso,
+            'pausa_ms': self.pausa_ms,
+            'reinicios': min(estado['reinicios'], self.maximo_reinicios),
+            'terminado_en_un_paso': un_paso,
+            'segundos': round(time.perf_counter() - inicio, 3)
+        }
+    
+    def verificar_integridad(self, conn: sqlite3.Connection) -> List[str]:
+        """Resultado de PRAGMA integrity_check (['ok'] si la base está sana)"""
+        return [fila[0] for fila in conn.execute("PRAGMA integrity_check").fetchall()]
+    
+    def crear_respaldo_incremental(self, codec: str = None, nivel: int = None) -> str:
         """Crea un respaldo incremental (solo cambios desde el último respaldo)"""
+        codec, nivel = self._validar_codec(codec, nivel)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"respaldo_incremental_{timestamp}.json"
-        backup_path = os.path.join(self.backup_dir, backup_filename)
+        backup_filename = f"respaldo_incremental_{timestamp}.json{CODECS[codec]['extension']}"
+        compressed_path = os.path.join(self.backup_dir, backup_filename)
         
         try:
             # Obtener el último respaldo para comparar
@@ -81,20 +204,32 @@ class SistemaRespaldos:
                 'cambios': cambios
             }
             
-            with open(backup_path, 'w') as f:
-                json.dump(respaldo_data, f, indent=2, default=str)
-            
-            # Comprimir
-            compressed_path = f"{backup_path}.gz"
-            with open(backup_path, 'rb') as f_in:
-                with gzip.open(compressed_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            
-            os.remove(backup_path)
+            # El JSON se escribe directo en el compresor
+            inicio = time.perf_counter()
+            modulo, parametro = CODECS[codec]['modulo'], CODECS[codec]['parametro']
+            with modulo.open(compressed_path, 'wb', **{parametro: nivel}) as binario:
+                with io.TextIOWrapper(binario, encoding='utf-8') as f:
+                    json.dump(respaldo_data, f, indent=2, default=str)
+                    f.flush()
+                    leidos = binario.tell()  # posición sin comprimir
+            compresion = self._resumen_compresion(codec, nivel, 1, 1, leidos, compressed_path,
+                                                  time.perf_counter() - inicio)
+            
+            with open(f"{compressed_path}.meta", 'w') as f:
+                json.dump({
+                    'fecha_creacion': respaldo_data['fecha_creacion'],
+                    'tipo': 'incremental',
+                    'tamaño_original': leidos,
+                    'tamaño_comprimido': compresion['bytes_escritos'],
+                    'archivo': compressed_path,
+                    'compresion': compresion
+                }, f, indent=2)
             
             return compressed_path
             
         except Exception as e:
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
             raise Exception(f"Error creando respaldo incremental: {str(e)}")
     
     def extraer_cambios_desde(self, fecha_desde: datetime = None) -> Dict:
@@ -179,7 +314,7 @@ class SistemaRespaldos:
             return respaldos
         
         for filename in os.listdir(self.backup_dir):
-            if filename.endswith('.gz'):
+            if self._codec_de_archivo(filename):
                 filepath = os.path.join(self.backup_dir, filename)
                 metadata_path = f"{filepath}.meta"
                 
@@ -214,7 +349,8 @@ class SistemaRespaldos:
         return respaldos[0] if respaldos else None
     
     def restaurar_respaldo(self, backup_path: str) -> bool:
-        """Restaura la base de datos desde un respaldo"""
+        """Restaura la base de datos desde un respaldo. Un respaldo comprimido se descomprime
+        completo en memoria: hace falta RAM para unas dos veces el tamaño de la base."""
         try:
             # Verificar que el respaldo existe
             if not os.path.exists(backup_path):
@@ -224,21 +360,31 @@ class SistemaRespaldos:
             respaldo_actual = self.crear_respaldo_completo()
             print(f"Respaldo de seguridad creado: {respaldo_actual}")
             
-            # Descomprimir si es necesario
-            if backup_path.endswith('.gz'):
-                temp_path = backup_path[:-3]  # Remover .gz
-                with gzip.open(backup_path, 'rb') as f_in:
-                    with open(temp_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                backup_path = temp_path
-            
-            # Restaurar la base de datos
-            shutil.copy2(backup_path, self.db_path)
-            
-            # Limpiar archivo temporal si se creó
-            if backup_path.endswith('.db') and not backup_path.endswith('.gz'):
-                if os.path.exists(backup_path) and backup_path != self.db_path:
-                    os.remove(backup_path)
+            # Descomprimir en memoria si es necesario, sin archivos temporales
+            codec = self._codec_de_archivo(backup_path)
+            if codec:
+                datos = bytearray()
+                with CODECS[codec]['modulo'].open(backup_path, 'rb') as f:
+                    # Por bloques, para no tener a la vez los bytes leídos y su copia
+                    while bloque := f.read(self.tamaño_bloque):
+                        datos += bloque
+                # Bytes 18-19 del encabezado: 2 = WAL, que una base en memoria no puede abrir;
+                # al terminar, la API de backup conserva el modo WAL de la base destino
+                datos[18:20] = b'\x01\x01'
+                origen = sqlite3.connect(":memory:")
+                origen.deserialize(datos)
+                del datos
+            else:
+                origen = sqlite3.connect(backup_path)
+            
+            # Restaurar la base de datos con la API de backup: respeta los candados y el WAL
+            # de la base en uso, que una copia del archivo dejaría inconsistente
+            destino = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                origen.backup(destino)
+            finally:
+                destino.close()
+                origen.close()
             
             return True
             
@@ -321,6 +467,50 @@ class SistemaRespaldos:
             'tamaño_promedio': sum(r['tamaño'] for r in respaldos) / len(respaldos) if respaldos else 0
         }
 
+    def _validar_codec(self, codec: str = None, nivel: int = None):
+        """Codec y nivel a usar (los configurados por defecto); ValueError si no son válidos"""
+        codec = codec or self.codec
+        if codec not in CODECS:
+            raise ValueError(f"Codec no válido: {codec} (use {', '.join(CODECS)})")
+        nivel = self.nivel if nivel is None else int(nivel)
+        if nivel not in CODECS[codec]['niveles']:
+            niveles = CODECS[codec]['niveles']
+            raise ValueError(f"Nivel no válido para {codec}: {nivel} (de {niveles.start} a {niveles.stop - 1})")
+        return codec, nivel
+    
+    def _validar_hilos(self, hilos: int = None) -> int:
+        """Hilos de compresión a usar (los configurados por defecto); ValueError si no son válidos"""
+        hilos = self.hilos if hilos is None else hilos
+        try:
+            hilos = int(hilos)
+        except (TypeError, ValueError):
+            raise ValueError(f"Hilos no válidos: {hilos!r} (debe ser un entero mayor o igual a 1)")
+        if hilos < 1:
+            raise ValueError(f"Hilos no válidos: {hilos} (debe ser un entero mayor o igual a 1)")
+        return hilos
+    
+    def _codec_de_archivo(self, path: str):
+        """Codec según la extensión del archivo, o None si no está comprimido"""
+        for codec, datos in CODECS.items():
+            if path.endswith(datos['extension']):
+                return codec
+        return None
+    
+    def _resumen_compresion(self, codec: str, nivel: int, hilos: int, bloques: int, leidos: int,
+                            path: str, segundos: float) -> Dict:
+        escritos = os.path.getsize(path)
+        return {
+            'codec': codec,
+            'nivel': nivel,
+            'hilos': hilos,
+            'bloques': bloques,
+            'bytes_leidos': leidos,
+            'bytes_escritos': escritos,
+            'ratio': round(leidos / escritos, 2) if escritos else None,
+            'segundos': round(segundos, 3),
+            'mb_por_segundo': round(leidos / 1e6 / segundos, 1) if segundos else None
+        }
+
 # Instancia global del sistema de respaldos
 sistema_respaldos = SistemaRespaldos()
 
@@ -0,0 +1,184 @@
+"""
+Módulo del simulador de rentas: evalúa escenarios de ajuste de renta para todos los cuartos
+y todos los escenarios a la vez como operaciones de matrices (escenarios × cuartos)
+"""
+import math
+from typing import Dict, List
+
+import numpy as np
+
+from models import db, Apartamento, Cuarto
+
+TIPOS_AJUSTE = ('porcentaje', 'absoluto')
+
+
+class SimuladorRentas:
+    """La ocupación esperada de cada cuarto cambia con la variación relativa de su renta
+    según una elasticidad: ocupación = base × (1 + elasticidad × variación)"""
+
+    def __init__(self, elasticidad: float = -0.8, costo_rotacion: float = 300.0, maximo_escenarios: int = 1000):
+        self.elasticidad = elasticidad
+        self.costo_rotacion = costo_rotacion  # costo de reemplazar a un inquilino que se va
+        self.maximo_escenarios = maximo_escenarios
+
+    def simular(self, escenarios: List[Dict], elasticidad: float = None, costo_rotacion: float = None) -> Dict:
+        """Cada escenario es {'nombre', 'ajustes': [{'apartamento'?, 'cuarto'?, 'tipo', 'valor'}]}.
+        Sin apartamento el ajuste aplica a todo el portafolio; con apartamento y cuarto, a ese
+        cuarto (un cuarto sin apartamento es un error). Los ajustes se aplican en orden: porcentaje multiplica, absoluto suma."""
+        try:
+            elasticidad = float(self.elasticidad if elasticidad is None else elasticidad)
+            costo_rotacion = float(self.costo_rotacion if costo_rotacion is None else costo_rotacion)
+        except (TypeError, ValueError):
+            return {'success': False, 'msg': 'elasticidad y costo_rotacion deben ser numéricos'}
+        if not (math.isfinite(elasticidad) and math.isfinite(costo_rotacion)):
+            return {'success': False, 'msg': 'elasticidad y costo_rotacion deben ser numéricos'}
+        if not escenarios:
+            return {'success': False, 'msg': 'Debe indicar al menos un escenario'}
+        if len(escenarios) > self.maximo_escenarios:
+            return {'success': False, 'msg': f'Máximo {self.maximo_escenarios} escenarios por simulación'}
+
+        cuartos = self._cargar_cuartos()
+        factor, suma = self._matrices_ajuste(escenarios, cuartos)
+        if isinstance(factor, str):
+            return {'success': False, 'msg': factor}
+
+        base = cuartos['renta']
+        activo = cuartos['activo']
+        # Los cuartos libres se ocupan con la probabilidad de la ocupación actual del portafolio
+        tasa_actual = activo.mean() if len(activo) else 0.0
+        ocupacion_base = np.where(activo, 1.0, tasa_actual)
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            nueva = np.maximum(base * factor + suma, 0)  # (S, R)
+        if not np.isfinite(nueva).all():
+            # Valores finitos pero tan grandes que la renta se desborda (el JSON no admite NaN)
+            return {'success': False, 'msg': 'Los ajustes producen rentas fuera de rango'}
+        variacion = np.divide(nueva, base, out=np.ones_like(nueva), where=base > 0) - 1
+        ocupacion = np.clip(ocupacion_base * (1 + elasticidad * variacion), 0, 1)
+        ingresos = nueva * ocupacion
+
+        # Agregados por escenario y por apartamento con productos de matrices
+        pertenencia = np.eye(len(cuartos['apartamentos']))[cuartos['indice_apartamento']]  # (R, A)
+        ingreso_base = float(base @ ocupacion_base)
+        ingreso = ingresos.sum(axis=1)
+        por_apartamento = ingresos @ pertenencia
+        ocupacion_apartamento = ocupacion @ pertenencia / np.maximum(pertenencia.sum(axis=0), 1)
+        perdidos = (1 - ocupacion) @ activo.astype(float)
+        costo = perdidos * costo_rotacion
+        ganancia = ingreso - ingreso_base
+        payback = np.divide(costo, ganancia, out=np.full_like(ganancia, np.nan), where=ganancia > 0)
+
+        resultados = [{
+            'nombre': escenario.get('nombre') or f'Escenario {s + 1}',
+            'ingreso_mensual': round(float(ingreso[s]), 2),
+            'variacion': round(float(ganancia[s]), 2),
+            'variacion_porcentaje': round(float(ganancia[s] / ingreso_base * 100), 1) if ingreso_base else 0,
+            'ocupacion_esperada': round(float(ocupacion[s].mean() * 100), 1) if len(activo) else 0,
+            'inquilinos_perdidos': round(float(perdidos[s]), 2),
+            'costo_rotacion': round(float(costo[s]), 2),
+            'payback_meses': None if np.isnan(payback[s]) else round(float(payback[s]), 1),
+            'por_apartamento': [{
+                'apartamento': int(numero),
+                'ingreso_mensual': round(float(por_apartamento[s, a]), 2),
+                'ocupacion_esperada': round(float(ocupacion_apartamento[s, a] * 100), 1)
+            } for a, numero in enumerate(cuartos['apartamentos'])]
+        } for s, escenario in enumerate(escenarios)]
+
+        mejor = int(np.argmax(ingreso)) if len(resultados) else None
+        return {
+            'success': True,
+            'elasticidad': elasticidad,
+            'costo_rotacion': costo_rotacion,
+            'ingreso_actual': round(ingreso_base, 2),
+            'ocupacion_actual': round(float(tasa_actual * 100), 1),
+            'mejor_escenario': resultados[mejor]['nombre'] if mejor is not None else None,
+            'escenarios': resultados
+        }
+
+    def escenarios_sugeridos(self, oportunidades: List[Dict]) -> List[Dict]:
+        """Escenarios a partir de las oportunidades de precios detectadas en analytics,
+        más ajustes uniformes del portafolio de -10 % a +10 %"""
+        escenarios = [{
+            'nombre': f'Portafolio {p:+d}%',
+            'ajustes': [{'tipo': 'porcentaje', 'valor': p}]
+        } for p in range(-10, 11, 5) if p]
+
+        for oportunidad in oportunidades:
+            if oportunidad['tipo'] == 'precios':
+                escenarios.append({
+                    'nombre': f"Apartamento {oportunidad['apartamento']} a 110% de la renta base",
+                    'ajustes': [{'apartamento': oportunidad['apartamento'], 'tipo': 'porcentaje', 'valor': 10}]
+                })
+        return escenarios
+
+    # Métodos privados
+    def _cargar_cuartos(self) -> Dict[str, np.ndarray]:
+        """Rentas actuales de todos los cuartos en una consulta; los libres usan la renta base"""
+        filas = db.session.query(Apartamento.numero, Cuarto.numero, Cuarto.activo, Cuarto.renta,
+                                 Apartamento.renta_base)\
+            .join(Apartamento, Cuarto.apartamento_id == Apartamento.id)\
+            .order_by(Apartamento.numero, Cuarto.numero).all()
+
+        apto = np.array([f[0] for f in filas], dtype=np.int64)
+        activo = np.array([bool(f[2]) for f in filas], dtype=bool)
+        renta = np.array([f[3] or 0 for f in filas], dtype=float)
+        renta_base = np.array([f[4] or 0 for f in filas], dtype=float)
+        apartamentos, indice = np.unique(apto, return_inverse=True)
+        return {
+            'apartamento': apto,
+            'cuarto': np.array([f[1] for f in filas], dtype=np.int64),
+            'activo': activo,
+            'renta': np.where(activo & (renta > 0), renta, renta_base),
+            'apartamentos': apartamentos,
+            'indice_apartamento': indice
+        }
+
+    def _matrices_ajuste(self, escenarios: List[Dict], cuartos: Dict[str, np.ndarray]):
+        """Factor y suma (escenarios × cuartos) tales que renta nueva = renta × factor + suma.
+        Recorre escenarios y ajustes, nunca cuartos; devuelve un mensaje si hay un ajuste inválido."""
+        factor = np.ones((len(escenarios), len(cuartos['renta'])))
+        suma = np.zeros_like(factor)
+        apartamentos = set(cuartos['apartamentos'].tolist())
+
+        for s, escenario in enumerate(escenarios):
+            if not isinstance(escenario, dict):
+                return 'Cada escenario debe ser un objeto con nombre y ajustes', None
+            ajustes = escenario.get('ajustes') or []
+            if not isinstance(ajustes, list) or not all(isinstance(a, dict) for a in ajustes):
+                return 'Los ajustes de cada escenario deben ser una lista de objetos', None
+            for ajuste in ajustes:
+                tipo = ajuste.get('tipo')
+                if tipo not in TIPOS_AJUSTE:
+                    return f"Tipo de ajuste inválido: {tipo} (use {' o '.join(TIPOS_AJUSTE)})", None
+                try:
+                    valor = float(ajuste.get('valor'))
+                except (TypeError, ValueError):
+                    return 'Cada ajuste necesita un valor numérico', None
+                if not math.isfinite(valor):
+                    return 'Cada ajuste necesita un valor numérico', None
+
+                if ajuste.get('cuarto') is not None and ajuste.get('apartamento') is None:
+                    return 'Un ajuste por cuarto debe indicar también el apartamento', None
+                if any(not isinstance(ajuste.get(campo), (int, type(None))) or isinstance(ajuste.get(campo), bool)
+                       for campo in ('apartamento', 'cuarto')):
+                    return 'apartamento y cuarto deben ser números enteros', None
+
+                mascara = np.ones(len(cuartos['renta']), dtype=bool)
+                if ajuste.get('apartamento') is not None:
+                    if ajuste['apartamento'] not in apartamentos:
+                        return f"Apartamento {ajuste['apartamento']} no encontrado", None
+                    mascara &= cuartos['apartamento'] == ajuste['apartamento']
+                    if ajuste.get('cuarto') is not None:
+                        mascara &= cuartos['cuarto'] == ajuste['cuarto']
+                        if not mascara.any():
+                            return f"Cuarto {ajuste['cuarto']} no encontrado en el apartamento {ajuste['apartamento']}", None
+
+                # (r × f + a) × f' + a' = r × (f f') + (a f' + a')
+                f, a = (1 + valor / 100, 0.0) if tipo == 'porcentaje' else (1.0, valor)
+                with np.errstate(over='ignore', invalid='ignore'):
+                    factor[s, mascara] *= f
+                    suma[s, mascara] = suma[s, mascara] * f + a
+        return factor, suma
+
+# Instancia global del simulador de rentas
+simulador_rentas = SimuladorRentas()
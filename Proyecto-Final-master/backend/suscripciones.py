@@ -0,0 +1,137 @@
+"""
+Módulo de suscripciones (long-poll) a notificaciones filtradas por apartamento, tipo y prioridad
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+from models import db, Notificacion
+
+
+class SuscripcionesNotificaciones:
+    """Difusión en memoria de las notificaciones nuevas a los clientes en espera"""
+
+    def __init__(self, capacidad: int = 1000, espera_maxima: int = 30):
+        self.capacidad = capacidad
+        self.espera_maxima = espera_maxima
+        self.eventos = deque()
+        self.id_base = 0  # los eventos en memoria cubren todos los ids > id_base
+        self.condicion = threading.Condition()
+        self._iniciado = False
+
+    def iniciar(self, app):
+        """Registra los eventos de sesión y carga el último id existente"""
+        if self._iniciado:
+            return
+        with app.app_context():
+            self.id_base = db.session.query(db.func.max(Notificacion.id)).scalar() or 0
+        db.event.listen(db.session, 'after_flush', self._al_hacer_flush)
+        db.event.listen(db.session, 'after_commit', self._al_hacer_commit)
+        db.event.listen(db.session, 'after_rollback', self._al_hacer_rollback)
+        self._iniciado = True
+
+    def publicar(self, notificaciones: List[Dict]):
+        """Agrega notificaciones ya guardadas y despierta a los clientes en espera"""
+        if not notificaciones:
+            return
+        with self.condicion:
+            for notif in sorted(notificaciones, key=lambda n: n['id']):
+                if notif['id'] <= self.id_base:
+                    continue
+                # El candado de SQLite se suelta antes de after_commit, así que dos commits pueden
+                # publicar en desorden: insertar en su lugar buscando desde el final
+                posicion = len(self.eventos)
+                while posicion and self.eventos[posicion - 1]['id'] >= notif['id']:
+                    posicion -= 1
+                if posicion < len(self.eventos) and self.eventos[posicion]['id'] == notif['id']:
+                    continue  # ya publicada
+                self.eventos.insert(posicion, notif)
+                if len(self.eventos) > self.capacidad:
+                    self.id_base = self.eventos.popleft()['id']
+            self.condicion.notify_all()
+
+    def esperar(self, desde: int, apartamento_id: int = None, tipo: str = None,
+                prioridad: str = None, espera: float = 25, limite: int = 100) -> Dict:
+        """Devuelve las notificaciones con id > desde, esperando hasta `espera` segundos si no hay"""
+        filtros = {'apartamento_id': apartamento_id, 'tipo': tipo, 'prioridad': prioridad}
+        espera = max(0, min(espera, self.espera_maxima))
+        limite_tiempo = time.monotonic() + espera
+
+        with self.condicion:
+            while True:
+                if desde < self.id_base:
+                    # El cursor es más viejo que la memoria: una sola consulta a la base
+                    break
+                encontradas = self._filtrar(desde, filtros, limite)
+                if encontradas:
+                    return self._respuesta(encontradas, desde)
+                restante = limite_tiempo - time.monotonic()
+                if restante <= 0:
+                    return self._respuesta([], max(desde, self._ultimo_id()))
+                self.condicion.wait(restante)
+
+        return self._respuesta(self._consultar(desde, filtros, limite), desde)
+
+    def registrar_nuevas(self, session, notificaciones: List[Notificacion]):
+        """Guarda en la sesión las notificaciones nuevas hasta que se confirme el commit.
+        Los inserts en lote no pasan por flush y deben llamarlo directamente."""
+        if notificaciones:
+            session.info.setdefault('notificaciones_nuevas', []).extend(
+                self._notificacion_a_dict(n) for n in notificaciones)
+
+    # Métodos privados
+    def _ultimo_id(self) -> int:
+        return self.eventos[-1]['id'] if self.eventos else self.id_base
+
+    def _filtrar(self, desde: int, filtros: Dict, limite: int) -> List[Dict]:
+        """Filtra los eventos en memoria (se llama con la condición tomada)"""
+        encontradas = []
+        for notif in self.eventos:
+            if notif['id'] <= desde or not self._coincide(notif, filtros):
+                continue
+            encontradas.append(notif)
+            if len(encontradas) >= limite:
+                break
+        return encontradas
+
+    def _coincide(self, notif: Dict, filtros: Dict) -> bool:
+        return all(valor is None or notif.get(campo) == valor for campo, valor in filtros.items())
+
+    def _consultar(self, desde: int, filtros: Dict, limite: int) -> List[Dict]:
+        """Consulta de respaldo cuando el cursor ya no está en memoria"""
+        query = Notificacion.query.filter(Notificacion.id > desde)
+        for campo, valor in filtros.items():
+            if valor is not None:
+                query = query.filter(getattr(Notificacion, campo) == valor)
+        return [self._notificacion_a_dict(n) for n in query.order_by(Notificacion.id).limit(limite).all()]
+
+    def _respuesta(self, notificaciones: List[Dict], desde: int) -> Dict:
+        return {
+            'notificaciones': notificaciones,
+            'cursor': notificaciones[-1]['id'] if notificaciones else desde
+        }
+
+    def _notificacion_a_dict(self, notif: Notificacion) -> Dict:
+        return {
+            'id': notif.id,
+            'fecha': notif.fecha.strftime('%d/%m/%Y %H:%M') if notif.fecha else None,
+            'tipo': notif.tipo,
+            'titulo': notif.titulo,
+            'mensaje': notif.mensaje,
+            'prioridad': notif.prioridad,
+            'cuarto_id': notif.cuarto_id,
+            'apartamento_id': notif.apartamento_id
+        }
+
+    def _al_hacer_flush(self, session, flush_context):
+        self.registrar_nuevas(session, [obj for obj in session.new if isinstance(obj, Notificacion)])
+
+    def _al_hacer_commit(self, session):
+        self.publicar(session.info.pop('notificaciones_nuevas', []))
+
+    def _al_hacer_rollback(self, session):
+        session.info.pop('notificaciones_nuevas', None)
+
+# Instancia global de suscripciones
+suscripciones_notificaciones = SuscripcionesNotificaciones()
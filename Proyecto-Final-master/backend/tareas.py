@@ -1,4 +1,5 @@
 from models import db, Cuarto, Pago, Limpieza, Gas
+from backend.calendario_pagos import calendario_pagos
 from datetime import datetime
 
 def toggle_disponibilidad(cuarto: Cuarto, activo: bool, nombre: str, renta: float):
@@ -9,6 +10,7 @@ def toggle_disponibilidad(cuarto: Cuarto, activo: bool, nombre: str, renta: floa
     else:
         cuarto.inquilino = None
         cuarto.renta = 0
+        calendario_pagos.cerrar_estadia(cuarto.id)
     db.session.commit()
     return f"Disponibilidad de cuarto {cuarto.numero} actualizada"
 
@@ -44,6 +46,7 @@ def liberar_cuarto(cuarto: Cuarto):
     cuarto.activo = False
     cuarto.inquilino = None
     cuarto.renta = 0
+    calendario_pagos.cerrar_estadia(cuarto.id)
     db.session.commit()
     return f"Cuarto {cuarto.numero} liberado"
 
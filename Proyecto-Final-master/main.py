@@ -1,5 +1,9 @@
+import os
+import json
+import time
+import click
 from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
-from models import db, Apartamento, Cuarto, Pago, Limpieza, Gas, SolicitudPago, Notificacion
+from models import db, Apartamento, Cuarto, Pago, Limpieza, Gas, SolicitudPago, Notificacion, crear_indices_faltantes, agregar_columnas_faltantes, configurar_sqlite
 from datetime import datetime, timedelta
 from backend.apartamento import Apartamento
 from backend.tareas import (
@@ -11,18 +15,71 @@ from backend.notificaciones import sistema_notificaciones
 from backend.dashboard import dashboard_manager
 from backend.respaldos import sistema_respaldos
 from backend.analytics import analytics_manager
+from backend.analytics_columnar import exportador_columnar
+from backend.cubo_diario import cubo_diario, AGRUPACIONES
+from backend.reportes_lote import reportes_lote
+from backend.pronosticos import pronostico_ingresos
+from backend.cohortes import analisis_cohortes
+from backend.simulador_rentas import simulador_rentas
 from backend.marketing import marketing_manager
 from backend.gestion_apartamentos import gestion_apartamentos
+from backend.entregas import sistema_entregas
+from backend.suscripciones import suscripciones_notificaciones
+from backend.calendario_pagos import calendario_pagos
+from backend.idempotencia import sistema_idempotencia
+from backend.control_pagos import control_pagos
+from backend.conciliacion import conciliacion_pagos
+from backend.cuentas import libro_cuentas
+from backend.recordatorios import programador_recordatorios
+from backend.ocupacion import historial_ocupacion
 
 app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///apartamentos_simple.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.secret_key = 'super_secret_key'
 
+# Entrega de notificaciones (por defecto un servidor SMTP local de pruebas en el puerto 1025)
+app.config["SMTP_HOST"] = os.environ.get("SMTP_HOST", "localhost")
+app.config["SMTP_PORT"] = int(os.environ.get("SMTP_PORT", 1025))
+app.config["SMTP_USUARIO"] = os.environ.get("SMTP_USUARIO")
+app.config["SMTP_PASSWORD"] = os.environ.get("SMTP_PASSWORD")
+
+# SQLite en modo WAL con espera ante bloqueos (SQLITE_WAL=0 vuelve al journal clásico)
+app.config["SQLITE_WAL"] = os.environ.get("SQLITE_WAL", "1") == "1"
+app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Respaldos con la API de backup de SQLite: páginas por paso y pausa entre pasos
+app.config["RESPALDO_PAGINAS_POR_PASO"] = int(os.environ.get("RESPALDO_PAGINAS_POR_PASO", 1024))
+app.config["RESPALDO_PAUSA_MS"] = int(os.environ.get("RESPALDO_PAUSA_MS", 5))
+# Compresión de respaldos: gzip, bz2 o lzma, nivel, e hilos (más de uno comprime por bloques en paralelo)
+app.config["RESPALDO_CODEC"] = os.environ.get("RESPALDO_CODEC", "gzip")
+app.config["RESPALDO_NIVEL"] = int(os.environ.get("RESPALDO_NIVEL", 6))
+app.config["RESPALDO_HILOS"] = int(os.environ.get("RESPALDO_HILOS", 1))
+
+# Snapshot columnar de analytics (por defecto instance/snapshot_analytics)
+app.config["ANALYTICS_SNAPSHOT_DIR"] = os.environ.get("ANALYTICS_SNAPSHOT_DIR")
+
 db.init_app(app)
 
 with app.app_context():
+    configurar_sqlite(db.engine, wal=app.config["SQLITE_WAL"], espera_ms=app.config["SQLITE_BUSY_TIMEOUT_MS"])
     db.create_all()
+    agregar_columnas_faltantes()
+    crear_indices_faltantes()
+
+sistema_notificaciones.configuraciones['modo_resumen'] = os.environ.get("NOTIFICACIONES_RESUMEN") == "1"
+sistema_respaldos.iniciar(app)
+sistema_entregas.iniciar(app)
+suscripciones_notificaciones.iniciar(app)
+libro_cuentas.iniciar(app)
+sistema_idempotencia.iniciar(app)
+programador_recordatorios.iniciar(app)
+historial_ocupacion.iniciar(app)
+calendario_pagos.iniciar(app)
+cubo_diario.iniciar(app)
+analisis_cohortes.iniciar(app)
+control_pagos.iniciar(app)
+analytics_manager.iniciar(app)
 
 # ----- Datos demo: 4 apartamentos, 6 cuartos cada uno -----
 apartamentos = [Apartamento(i+1, 500 + i*50) for i in range(4)]
@@ -324,6 +381,7 @@ def toggle(apto_num, cuarto_num):
     else:
         cuarto.inquilino = None
         cuarto.renta = apartamento.renta_base
+        calendario_pagos.cerrar_estadia(cuarto.id)
     
     db.session.commit()
     
@@ -361,6 +419,7 @@ def liberar_cuarto_api(apto_num, cuarto_num):
     cuarto.activo = False
     cuarto.inquilino = None
     cuarto.renta = apartamento.renta_base
+    calendario_pagos.cerrar_estadia(cuarto.id)
     
     db.session.commit()
     
@@ -377,9 +436,9 @@ def liberar_cuarto_api(apto_num, cuarto_num):
 
 # API para registrar pago
 @app.route('/api/pagos/registrar/<int:apto_num>/<int:cuarto_num>', methods=['POST'])
+@sistema_idempotencia.idempotente
 def registrar_pago_api(apto_num, cuarto_num):
     from models import Apartamento, Cuarto
-    from backend.control_pagos import ControlPagos
     
     data = request.get_json()
     monto = float(data.get('monto', 0))
@@ -398,8 +457,33 @@ def registrar_pago_api(apto_num, cuarto_num):
         monto = cuarto.renta or apartamento.renta_base
     
     # Usar el sistema de control de pagos
-    control_pagos = ControlPagos()
-    resultado = control_pagos.registrar_pago(cuarto.id, monto)
+    # Con Idempotency-Key los reintentos ya están cubiertos; no bloquear un segundo pago del día
+    resultado = control_pagos.registrar_pago(
+        cuarto.id, monto, verificar_duplicado='Idempotency-Key' not in request.headers)
+    
+    return jsonify(resultado)
+
+# API para importar pagos en lote (CSV o JSON)
+@app.route('/api/pagos/importar', methods=['POST'])
+def importar_pagos_api():
+    import csv
+    import io
+    
+    archivo = request.files.get('archivo')
+    if archivo:
+        contenido = io.StringIO(archivo.stream.read().decode('utf-8-sig'))
+        filas = list(csv.DictReader(contenido))
+    else:
+        # Se acepta la lista de pagos sola o dentro de {'pagos': [...]}
+        data = request.get_json(force=True, silent=True)
+        filas = data.get('pagos') if isinstance(data, dict) else data
+        if filas is not None and not isinstance(filas, list):
+            return jsonify({'success': False, 'msg': 'Se esperaba una lista de pagos'}), 400
+    
+    if not filas:
+        return jsonify({'success': False, 'msg': 'No se recibieron pagos para importar'}), 400
+    
+    resultado = control_pagos.importar_pagos(filas)
     
     return jsonify(resultado)
 
@@ -407,7 +491,6 @@ def registrar_pago_api(apto_num, cuarto_num):
 @app.route('/api/cuarto/asignar/<int:apto_num>/<int:cuarto_num>', methods=['POST'])
 def asignar_cuarto_api(apto_num, cuarto_num):
     from models import Apartamento, Cuarto
-    from backend.control_pagos import ControlPagos
     
     data = request.get_json()
     nombre = data.get('nombre', '')
@@ -424,7 +507,6 @@ def asignar_cuarto_api(apto_num, cuarto_num):
         return jsonify({'ok': False, 'msg': 'Habitación no encontrada'})
     
     # Usar el sistema de control de pagos
-    control_pagos = ControlPagos()
     resultado = control_pagos.asignar_inquilino(
         cuarto.id, 
         nombre, 
@@ -451,7 +533,7 @@ def asignar_cuarto_api(apto_num, cuarto_num):
 # ----- Pagos -----
 @app.route('/pagos/marcar/<int:apto_num>/<int:cuarto_num>', methods=['POST'])
 def marcar_pago(apto_num, cuarto_num):
-    from models import Apartamento, Cuarto, Pago
+    from models import Apartamento, Cuarto
     
     monto = float(request.form.get('monto', 0))
     
@@ -470,19 +552,11 @@ def marcar_pago(apto_num, cuarto_num):
     if monto <= 0:
         monto = cuarto.renta or apartamento.renta_base
     
-    # Crear registro de pago
-    pago = Pago(
-        fecha=datetime.utcnow(),
-        monto=monto,
-        estado='pagado',
-        cuarto_id=cuarto.id
-    )
-    
-    # Actualizar último pago del cuarto
-    cuarto.ultimo_pago = datetime.utcnow()
-    
-    db.session.add(pago)
-    db.session.commit()
+    # Mismo camino que la API: un pago por cuarto y día, bajo el candado de escritura
+    resultado = control_pagos.registrar_pago(cuarto.id, monto)
+    if not resultado['success']:
+        flash(resultado['msg'], 'error')
+        return redirect(url_for('index'))
     
     flash(f'Pago registrado para habitación {cuarto_num} - ${monto:.2f}', 'success')
     return redirect(url_for('index'))
@@ -602,15 +676,21 @@ def ver_historial():
                     'monto_sugerido': solicitud.monto
                 })
         
-        # Obtener movimientos de inquilinos (simplificado)
+        # Movimientos de inquilinos: cada estadía registrada es una asignación y, si terminó, una salida
         inquilinos_records = []
-        for cuarto in cuartos:
-            if cuarto.inquilino and cuarto.activo:
+        for estadia in historial_ocupacion.intervalos_apartamento(apartamento.id):
+            inquilinos_records.append({
+                'cuarto': estadia.cuarto.numero,
+                'nombre': estadia.inquilino,
+                'fecha_asignacion': estadia.desde,
+                'fecha_salida': None
+            })
+            if estadia.hasta:
                 inquilinos_records.append({
-                    'cuarto': cuarto.numero,
-                    'nombre': cuarto.inquilino,
-                    'fecha_asignacion': cuarto.ultimo_pago if cuarto.ultimo_pago else datetime.now(),  # Usar último pago como proxy
-                    'fecha_salida': None
+                    'cuarto': estadia.cuarto.numero,
+                    'nombre': estadia.inquilino,
+                    'fecha_asignacion': None,
+                    'fecha_salida': estadia.hasta
                 })
         
         # Solo agregar apartamento si tiene registros
@@ -629,7 +709,7 @@ def ver_historial():
                 'gas': sorted(gas_records, key=lambda x: x['fecha'], reverse=True),
                 'pagos': sorted(pagos_records, key=lambda x: x['fecha'], reverse=True),
                 'solicitudes': sorted(solicitudes_records, key=lambda x: x['fecha'], reverse=True),
-                'inquilinos': sorted(inquilinos_records, key=lambda x: x.get('fecha_asignacion') or datetime.now(), reverse=True)
+                'inquilinos': sorted(inquilinos_records, key=lambda x: x['fecha_asignacion'] or x['fecha_salida'], reverse=True)
             })
     
     return render_template('historial.html', resumen=resumen, hoy=datetime.now())
@@ -637,9 +717,6 @@ def ver_historial():
 # ----- Control de Pagos -----
 @app.route('/api/pagos/verificar-vencidos', methods=['POST'])
 def verificar_pagos_vencidos():
-    from backend.control_pagos import ControlPagos
-    
-    control_pagos = ControlPagos()
     cuartos_vencidos = control_pagos.verificar_pagos_vencidos()
     
     return jsonify({
@@ -650,9 +727,6 @@ def verificar_pagos_vencidos():
 
 @app.route('/api/pagos/verificar-recordatorios', methods=['POST'])
 def verificar_recordatorios():
-    from backend.control_pagos import ControlPagos
-    
-    control_pagos = ControlPagos()
     cuartos_recordatorio = control_pagos.verificar_recordatorios_pago()
     
     return jsonify({
@@ -661,15 +735,172 @@ def verificar_recordatorios():
         'total': len(cuartos_recordatorio)
     })
 
+@app.get('/api/pagos/recordatorios')
+def recordatorios_programados():
+    return jsonify({'success': True, **programador_recordatorios.obtener_estadisticas()})
+
+# ----- Historial de ocupación -----
+@app.get('/api/ocupacion')
+def ocupacion_en_fecha():
+    fecha = request.args.get('fecha')
+    try:
+        fecha = datetime.fromisoformat(fecha) if fecha else datetime.utcnow()
+    except ValueError:
+        return jsonify({'success': False, 'msg': 'Fecha inválida, use AAAA-MM-DD'}), 400
+    
+    return jsonify({'success': True, **historial_ocupacion.ocupacion_en(fecha)})
+
+@app.get('/api/ocupacion/mes')
+def ocupacion_del_mes():
+    mes = request.args.get('mes')
+    try:
+        inicio = datetime.strptime(mes, '%Y-%m') if mes else datetime.utcnow()
+    except ValueError:
+        return jsonify({'success': False, 'msg': 'Mes inválido, use AAAA-MM'}), 400
+    
+    return jsonify({'success': True, **historial_ocupacion.dias_ocupados_mes(inicio.year, inicio.month)})
+
+@app.get('/api/ocupacion/vacancia')
+def vacancia_cuartos():
+    return jsonify({'success': True, 'cuartos': historial_ocupacion.duraciones_vacancia()})
+
+@app.cli.command('verificar-pagos')
+def verificar_pagos_cmd():
+    """Crea las notificaciones de pagos vencidos y recordatorios (para cron)"""
+    vencidos = control_pagos.verificar_pagos_vencidos()
+    recordatorios = control_pagos.verificar_recordatorios_pago()
+    print(f"{len(vencidos)} pagos vencidos, {len(recordatorios)} recordatorios")
+
+@app.cli.command('estres-pagos')
+@click.option('--hilos', default=8, help='Hilos registrando pagos a la vez')
+@click.option('--pagos', default=30, help='Pagos que intenta cada hilo')
+def estres_pagos_cmd(hilos, pagos):
+    """Prueba de concurrencia de pagos sobre una base temporal (journal clásico contra WAL)"""
+    from backend.estres_pagos import PruebaEstresPagos
+    
+    resultados = PruebaEstresPagos(hilos=hilos, pagos_por_hilo=pagos).comparar()
+    for r in resultados.values():
+        print(f"{r['modo']:>8}: {r['registrados']}/{r['esperados']} registrados, {r['rechazados']} duplicados "
+              f"rechazados, {r['errores']} errores, {r['duplicados_en_base']} duplicados en la base, "
+              f"{r['segundos']}s ({r['operaciones_por_segundo']} op/s)")
+
+@app.cli.command('limpiar-idempotencia')
+def limpiar_idempotencia_cmd():
+    """Elimina las claves de idempotencia expiradas"""
+    print(f"{sistema_idempotencia.limpiar_expiradas()} claves eliminadas")
+
 @app.route('/api/pagos/resumen', methods=['GET'])
 def resumen_pagos():
-    from backend.control_pagos import ControlPagos
-    
-    control_pagos = ControlPagos()
-    resumen = control_pagos.obtener_resumen_pagos()
+    limite = request.args.get('limite', 50, type=int)
+    resumen = control_pagos.obtener_resumen_pagos(limite)
     
     return jsonify(resumen)
 
+@app.post('/api/pagos/conciliar')
+def conciliar_pagos():
+    data = request.get_json(force=True, silent=True) or {}
+    resultado = conciliacion_pagos.conciliar(ventana_dias=data.get('ventana_dias'))
+    db.session.commit()
+    
+    return jsonify({'success': True, **resultado})
+
+@app.cli.command('generar-solicitudes')
+@click.option('--mes', default=None, help='Mes a generar (AAAA-MM); por defecto el actual')
+def generar_solicitudes_cmd(mes):
+    """Genera las solicitudes de pago del mes para todos los cuartos activos (para cron)"""
+    from calendar import monthrange
+    
+    try:
+        inicio = datetime.strptime(mes, '%Y-%m') if mes else None
+    except ValueError:
+        raise click.BadParameter('use el formato AAAA-MM', param_hint='--mes')
+    fin = inicio + timedelta(days=monthrange(inicio.year, inicio.month)[1]) if inicio else None
+    resultado = control_pagos.generar_solicitudes_periodo(inicio, fin)
+    print(f"{resultado['creadas']} solicitudes creadas por ${resultado['monto_total']:.2f}, "
+          f"{resultado['omitidas']} ya existían ({resultado['desde']} - {resultado['hasta']})")
+
+@app.cli.command('conciliar-pagos')
+@click.option('--ventana', default=45, help='Días de diferencia permitidos entre pago y vencimiento')
+def conciliar_pagos_cmd(ventana):
+    """Aplica los pagos sin conciliar a las solicitudes de pago abiertas"""
+    resultado = conciliacion_pagos.conciliar(ventana_dias=ventana)
+    db.session.commit()
+    print(f"{resultado['aplicaciones']} aplicaciones por ${resultado['monto_aplicado']:.2f}: "
+          f"{resultado['solicitudes_pagadas']} solicitudes pagadas, {resultado['solicitudes_parciales']} parciales, "
+          f"{resultado['pagos_sin_conciliar']} pagos sin conciliar, {resultado['solicitudes_sin_pago']} solicitudes sin pago")
+
+@app.route('/api/pagos/cuotas/proximas', methods=['GET'])
+def cuotas_proximas():
+    dias = request.args.get('dias', 3, type=int)
+    cuotas = calendario_pagos.cuotas_por_vencer(dias)
+    
+    return jsonify({'success': True, 'cuotas': cuotas, 'total': len(cuotas)})
+
+@app.route('/api/pagos/cuotas/vencidas', methods=['GET'])
+def cuotas_vencidas_por_apartamento():
+    return jsonify({'success': True, 'apartamentos': calendario_pagos.monto_vencido_por_apartamento()})
+
+@app.cli.command('extender-cuotas')
+@click.option('--meses', default=3, help='Meses hacia adelante a materializar')
+def extender_cuotas_cmd(meses):
+    """Genera las cuotas faltantes del calendario de pagos (para cron)"""
+    total = calendario_pagos.extender_horizonte(meses)
+    print(f"{total} cuotas generadas")
+
+# ----- Cuentas por cuarto (cargos, pagos y ajustes) -----
+@app.get('/api/cuentas/<int:apto_num>/<int:cuarto_num>')
+def cuenta_cuarto(apto_num, cuarto_num):
+    from models import Apartamento, Cuarto
+    
+    apartamento = Apartamento.query.filter_by(numero=apto_num, activo=True).first()
+    if not apartamento:
+        return jsonify({'ok': False, 'msg': 'Apartamento no encontrado'})
+    
+    cuarto = Cuarto.query.filter_by(apartamento_id=apartamento.id, numero=cuarto_num).first()
+    if not cuarto:
+        return jsonify({'ok': False, 'msg': 'Habitación no encontrada'})
+    
+    limite = request.args.get('limite', 50, type=int)
+    return jsonify({
+        'ok': True,
+        'saldo': libro_cuentas.obtener_saldo(cuarto.id),
+        'movimientos': libro_cuentas.obtener_movimientos(cuarto.id, limite)
+    })
+
+@app.post('/api/cuentas/ajuste/<int:apto_num>/<int:cuarto_num>')
+@sistema_idempotencia.idempotente
+def ajuste_cuenta_cuarto(apto_num, cuarto_num):
+    from models import Apartamento, Cuarto
+    
+    data = request.get_json(force=True, silent=True) or {}
+    
+    apartamento = Apartamento.query.filter_by(numero=apto_num, activo=True).first()
+    if not apartamento:
+        return jsonify({'ok': False, 'msg': 'Apartamento no encontrado'})
+    
+    cuarto = Cuarto.query.filter_by(apartamento_id=apartamento.id, numero=cuarto_num).first()
+    if not cuarto:
+        return jsonify({'ok': False, 'msg': 'Habitación no encontrada'})
+    
+    try:
+        monto = float(data.get('monto', 0))
+    except (TypeError, ValueError):
+        return jsonify({'ok': False, 'msg': 'Monto inválido'}), 400
+    if not monto:
+        return jsonify({'ok': False, 'msg': 'El monto del ajuste no puede ser cero'}), 400
+    
+    movimiento = libro_cuentas.registrar_ajuste(cuarto.id, monto, data.get('concepto', ''))
+    return jsonify({'ok': True, 'saldo': movimiento.saldo})
+
+@app.get('/api/cuentas/por-cobrar')
+def cuentas_por_cobrar():
+    return jsonify({'ok': True, **libro_cuentas.obtener_cuentas_por_cobrar()})
+
+@app.cli.command('contabilizar-cargos')
+def contabilizar_cargos_cmd():
+    """Asienta en las cuentas las cuotas del calendario ya vencidas (para cron)"""
+    print(f"{libro_cuentas.contabilizar_cargos()} cargos asentados")
+
 # ----- Dashboard y Notificaciones -----
 @app.route('/dashboard')
 def dashboard():
@@ -680,6 +911,7 @@ def dashboard():
     estadisticas_gas = dashboard_manager.obtener_estadisticas_gas()
     top_inquilinos = dashboard_manager.obtener_top_inquilinos()
     alertas_urgentes = dashboard_manager.obtener_alertas_urgentes()
+    rotacion = analisis_cohortes.obtener_cohortes()['rotacion']
     
     return render_template('dashboard.html',
                          metricas=metricas,
@@ -689,6 +921,7 @@ def dashboard():
                          estadisticas_gas=estadisticas_gas,
                          top_inquilinos=top_inquilinos,
                          alertas_urgentes=alertas_urgentes,
+                         rotacion=rotacion,
                          hoy=datetime.now())
 
 @app.route('/notificaciones')
@@ -706,7 +939,21 @@ def marcar_notificacion_leida(notif_id):
     success = sistema_notificaciones.marcar_notificacion_leida(notif_id)
     return jsonify(ok=success)
 
+@app.get('/api/notificaciones/suscribir')
+def suscribir_notificaciones():
+    """Long-poll: responde en cuanto haya notificaciones nuevas que coincidan con los filtros"""
+    resultado = suscripciones_notificaciones.esperar(
+        desde=request.args.get('desde', 0, type=int),
+        apartamento_id=request.args.get('apartamento_id', type=int),
+        tipo=request.args.get('tipo') or None,
+        prioridad=request.args.get('prioridad') or None,
+        espera=request.args.get('espera', 25, type=float),
+        limite=request.args.get('limite', 100, type=int)
+    )
+    return jsonify(ok=True, **resultado)
+
 @app.post('/api/solicitudes-pago/crear')
+@sistema_idempotencia.idempotente
 def crear_solicitud_pago():
     data = request.get_json()
     cuarto_id = data.get('cuarto_id')
@@ -720,18 +967,64 @@ def crear_solicitud_pago():
     except Exception as e:
         return jsonify(ok=False, error=str(e))
 
+@app.post('/api/solicitudes-pago/generar-mes')
+@sistema_idempotencia.idempotente
+def generar_solicitudes_mes():
+    from calendar import monthrange
+    
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        inicio = datetime.strptime(data['mes'], '%Y-%m') if data.get('mes') else None
+    except ValueError:
+        return jsonify({'success': False, 'msg': 'Mes inválido, use el formato AAAA-MM'}), 400
+    fin = inicio + timedelta(days=monthrange(inicio.year, inicio.month)[1]) if inicio else None
+    
+    return jsonify(control_pagos.generar_solicitudes_periodo(inicio, fin))
+
 @app.post('/api/pagos/registrar-mejorado')
+@sistema_idempotencia.idempotente
 def registrar_pago_mejorado():
     data = request.get_json()
     cuarto_id = data.get('cuarto_id')
     monto = float(data.get('monto', 0))
     
     try:
-        resultado = sistema_notificaciones.marcar_pago_recibido(cuarto_id, monto)
+        resultado = sistema_notificaciones.marcar_pago_recibido(
+            cuarto_id, monto, verificar_duplicado='Idempotency-Key' not in request.headers)
         return jsonify(ok=True, **resultado)
     except Exception as e:
         return jsonify(ok=False, error=str(e))
 
+@app.post('/api/cuarto/contacto/<int:apto_num>/<int:cuarto_num>')
+def guardar_contacto_inquilino(apto_num, cuarto_num):
+    from models import Apartamento, Cuarto, ContactoInquilino
+    
+    data = request.get_json(force=True, silent=True) or {}
+    
+    # Buscar apartamento y cuarto en la base de datos
+    apartamento = Apartamento.query.filter_by(numero=apto_num, activo=True).first()
+    if not apartamento:
+        return jsonify({'ok': False, 'msg': 'Apartamento no encontrado'})
+    
+    cuarto = Cuarto.query.filter_by(apartamento_id=apartamento.id, numero=cuarto_num).first()
+    if not cuarto:
+        return jsonify({'ok': False, 'msg': 'Habitación no encontrada'})
+    
+    contacto = ContactoInquilino.query.filter_by(cuarto_id=cuarto.id).first()
+    if not contacto:
+        contacto = ContactoInquilino(cuarto_id=cuarto.id)
+        db.session.add(contacto)
+    
+    contacto.email = data.get('email') or None
+    contacto.telefono = data.get('telefono') or None
+    db.session.commit()
+    
+    return jsonify({'ok': True, 'msg': f'Contacto actualizado para habitación {cuarto_num}'})
+
+@app.get('/api/notificaciones/entregas')
+def estadisticas_entregas():
+    return jsonify(ok=True, estadisticas=sistema_entregas.obtener_estadisticas())
+
 # ----- Respaldos -----
 @app.route('/respaldos')
 def respaldos():
@@ -746,12 +1039,14 @@ def respaldos():
 @app.post('/api/respaldos/crear')
 def crear_respaldo():
     tipo = request.json.get('tipo', 'completo')
+    codec = request.json.get('codec')
+    nivel = request.json.get('nivel')
     
     try:
         if tipo == 'completo':
-            respaldo_path = sistema_respaldos.crear_respaldo_completo()
+            respaldo_path = sistema_respaldos.crear_respaldo_completo(codec, nivel, request.json.get('hilos'))
         elif tipo == 'incremental':
-            respaldo_path = sistema_respaldos.crear_respaldo_incremental()
+            respaldo_path = sistema_respaldos.crear_respaldo_incremental(codec, nivel)
         else:
             return jsonify(ok=False, error="Tipo de respaldo no válido")
         
@@ -789,29 +1084,114 @@ def analytics():
     """Página de analytics y métricas comerciales"""
     try:
         reporte_comercial = analytics_manager.generar_reporte_comercial()
-        return render_template('analytics.html', reporte=reporte_comercial)
+        return render_template('analytics.html', reporte=reporte_comercial, hoy=datetime.now())
     except Exception as e:
         flash(f'Error al generar reporte: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def leer_rango_fechas():
+    """(desde, hasta) de ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD, ambos inclusive; None si no se pidió
+    rango. Sin desde, el rango empieza el primer día del mes de hasta; sin hasta, termina hoy."""
+    desde, hasta = request.args.get('desde'), request.args.get('hasta')
+    if not desde and not hasta:
+        return None
+    hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else datetime.utcnow().date()
+    desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else hasta.replace(day=1)
+    if desde > hasta:
+        raise ValueError('desde debe ser anterior o igual a hasta')
+    return desde, hasta
+
 @app.route('/api/analytics/rentabilidad/<int:apartamento_id>')
 def obtener_rentabilidad_apartamento(apartamento_id):
-    """Obtiene análisis de rentabilidad de un apartamento específico"""
+    """Obtiene análisis de rentabilidad de un apartamento específico; con ?desde=&hasta=,
+    la del rango de fechas calculada sobre el cubo diario"""
     try:
+        rango = leer_rango_fechas()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Rango inválido, use AAAA-MM-DD ({e})'}), 400
+    try:
+        if rango:
+            analisis = analytics_manager.calcular_rentabilidad_periodo(*rango, [apartamento_id])
+            return jsonify({'success': True, 'data': analisis[0] if analisis else {}})
         analisis = analytics_manager.calcular_rentabilidad_apartamento(apartamento_id)
         return jsonify({'success': True, 'data': analisis})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/analytics/periodo')
+def obtener_analisis_periodo():
+    """Comparativo, totales y serie de un rango de fechas (?desde=&hasta=&agrupar=dia|mes),
+    por defecto el mes en curso"""
+    agrupar = request.args.get('agrupar', 'mes')
+    if agrupar not in AGRUPACIONES:
+        return jsonify({'success': False, 'error': f"agrupar debe ser {' o '.join(AGRUPACIONES)}"}), 400
+    try:
+        hoy = datetime.utcnow().date()
+        desde, hasta = leer_rango_fechas() or (hoy.replace(day=1), hoy)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Rango inválido, use AAAA-MM-DD ({e})'}), 400
+    try:
+        return jsonify({'success': True, 'data': analytics_manager.obtener_analisis_periodo(desde, hasta, agrupar)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/analytics/prediccion')
 def obtener_prediccion_ingresos():
-    """Obtiene predicción de ingresos del mes siguiente"""
+    """Obtiene predicción de ingresos del mes siguiente; con ?horizonte=N (1-12), el pronóstico
+    Holt-Winters por apartamento con intervalos de predicción"""
+    horizonte = request.args.get('horizonte', type=int)
+    if horizonte is not None and not 1 <= horizonte <= 12:
+        return jsonify({'success': False, 'error': 'El horizonte debe estar entre 1 y 12 meses'}), 400
     try:
+        if horizonte:
+            return jsonify({'success': True, 'data': pronostico_ingresos.pronosticar(horizonte)})
         prediccion = analytics_manager.predecir_ingresos_mes_siguiente()
         return jsonify({'success': True, 'data': prediccion})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/analytics/cohortes')
+def obtener_cohortes_inquilinos():
+    """Retención por cohorte de entrada y rotación mensual de inquilinos"""
+    meses = request.args.get('meses', 12, type=int)
+    if not 1 <= meses <= 60:
+        return jsonify({'success': False, 'error': 'meses debe estar entre 1 y 60'}), 400
+    try:
+        return jsonify({'success': True, 'data': analisis_cohortes.obtener_cohortes(meses)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/analytics/simulador-rentas', methods=['GET', 'POST'])
+def simular_rentas():
+    """Evalúa escenarios de ajuste de renta (POST) o los sugeridos por las oportunidades de precios (GET)"""
+    try:
+        if request.method == 'GET':
+            escenarios = simulador_rentas.escenarios_sugeridos(analytics_manager.identificar_oportunidades_mejora())
+            resultado = simulador_rentas.simular(escenarios)
+        else:
+            data = request.get_json(force=True, silent=True) or {}
+            escenarios = data.get('escenarios')
+            if not isinstance(escenarios, list):
+                return jsonify({'success': False, 'error': 'escenarios debe ser una lista'}), 400
+            resultado = simulador_rentas.simular(escenarios, data.get('elasticidad'), data.get('costo_rotacion'))
+        
+        if resultado['success']:
+            return jsonify(resultado)
+        else:
+            return jsonify(resultado), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.cli.command('benchmark-pronostico')
+@click.option('--apartamentos', default=10000, help='Series sintéticas a ajustar')
+@click.option('--horizonte', default=12, help='Meses a pronosticar')
+def benchmark_pronostico_cmd(apartamentos, horizonte):
+    """Mide el ajuste Holt-Winters vectorizado sobre series sintéticas (no usa la base)"""
+    r = pronostico_ingresos.medir_rendimiento(apartamentos, horizonte)
+    print(f"{r['apartamentos']} apartamentos x {r['meses_historia']} meses, horizonte {r['horizonte']}: "
+          f"{r['segundos']}s; error medio {r['error_medio_abs']} (ingenuo estacional "
+          f"{r['error_medio_abs_ingenuo']}), cobertura del intervalo 95%: {r['cobertura_intervalo']}%")
+
 @app.route('/api/analytics/oportunidades')
 def obtener_oportunidades_mejora():
     """Obtiene oportunidades de mejora identificadas"""
@@ -821,6 +1201,86 @@ def obtener_oportunidades_mejora():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/analytics/cache')
+def obtener_metricas_cache_analytics():
+    """Métricas de la memoización de reportes (tasa de aciertos, tiempo de recálculo)"""
+    return jsonify({'success': True, 'data': analytics_manager.obtener_metricas_memo()})
+
+@app.post('/api/analytics/snapshot')
+def exportar_snapshot_analytics():
+    """Exporta los hechos al snapshot columnar"""
+    try:
+        manifiesto = exportador_columnar.exportar()
+        return jsonify({'success': True, 'data': {
+            'generado': manifiesto['generado'],
+            'filas': {nombre: t['filas'] for nombre, t in manifiesto['tablas'].items()}
+        }})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/analytics/snapshot/reporte')
+def obtener_reporte_snapshot():
+    """Reporte comercial calculado sobre el último snapshot columnar"""
+    try:
+        analytics_snapshot = exportador_columnar.crear_analytics()
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'No hay snapshot, ejecute flask exportar-snapshot'}), 404
+    try:
+        reporte = {
+            **analytics_snapshot.generar_reporte_comercial(),
+            'snapshot_generado': analytics_snapshot.manifiesto.get('generado'),
+            'actividad_mes': analytics_snapshot.obtener_actividad_mes()
+        }
+        return jsonify({'success': True, 'data': reporte})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.cli.command('reporte-rentabilidad')
+@click.option('--paralelo', is_flag=True,
+              help='Reparte el cálculo en procesos; hasta 5000 apartamentos fue más lento que en un solo proceso')
+@click.option('--procesos', default=None, type=int, help='Con --paralelo, procesos trabajadores (por defecto uno por CPU)')
+@click.option('--salida', default=None, help='Archivo JSON donde guardar el reporte')
+@click.option('--benchmark', is_flag=True, help='Compara el cálculo en un solo proceso contra el de procesos')
+@click.option('--secuencial', is_flag=True, help='Con --benchmark, mide también el cálculo apartamento por apartamento')
+def reporte_rentabilidad_cmd(paralelo, procesos, salida, benchmark, secuencial):
+    """Rentabilidad de todos los apartamentos con consultas agrupadas en un solo proceso
+    (con --paralelo, repartida en procesos por particiones)"""
+    def avance(terminadas, total, apartamentos):
+        print(f"  particiones {terminadas}/{total} ({apartamentos} apartamentos)")
+    
+    if benchmark:
+        r = reportes_lote.medir_rendimiento(procesos, al_avanzar=avance, incluir_secuencial=secuencial)
+        if secuencial:
+            print(f"Secuencial (un apartamento a la vez): {r['segundos_secuencial']}s")
+        print(f"{r['apartamentos']} apartamentos: agrupado {r['segundos_agrupado']}s, "
+              f"{r['procesos']} procesos / {r['particiones']} particiones {r['segundos_paralelo']}s "
+              f"(x{r['aceleracion']}), resultados iguales: {'sí' if r['resultados_iguales'] else 'NO'}")
+        return
+    
+    reporte = reportes_lote.generar(paralelo=paralelo, procesos=procesos, al_avanzar=avance)
+    print(f"{len(reporte['apartamentos'])} apartamentos en {reporte['segundos']}s "
+          f"con {reporte['procesos']} procesos ({reporte['particiones']} particiones)")
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"Reporte guardado en {salida}")
+
+@app.cli.command('reconstruir-cubo')
+def reconstruir_cubo_cmd():
+    """Recalcula el cubo diario de analytics desde las tablas de pagos, limpiezas, gas y ocupación"""
+    inicio = time.perf_counter()
+    filas = cubo_diario.reconstruir()
+    print(f"Cubo diario reconstruido: {filas} filas (apartamento x día) en {time.perf_counter() - inicio:.2f}s")
+
+@app.cli.command('exportar-snapshot')
+@click.option('--directorio', default=None, help='Directorio destino (por defecto instance/snapshot_analytics)')
+def exportar_snapshot_cmd(directorio):
+    """Exporta pagos, limpiezas, gas y ocupación a arreglos .npy para analytics (para cron)"""
+    inicio = time.perf_counter()
+    manifiesto = exportador_columnar.exportar(directorio)
+    filas = ', '.join(f"{nombre}: {t['filas']}" for nombre, t in manifiesto['tablas'].items())
+    print(f"Snapshot {manifiesto['generacion']} ({filas}) en {time.perf_counter() - inicio:.2f}s")
+
 # =========================
 # RUTAS DE MARKETING
 # =========================
@@ -831,7 +1291,7 @@ def marketing():
     try:
         campanas = marketing_manager.generar_campanas_promocionales()
         estrategias = marketing_manager.generar_estrategias_retencion()
-        return render_template('marketing.html', campanas=campanas, estrategias=estrategias)
+        return render_template('marketing.html', campanas=campanas, estrategias=estrategias, hoy=datetime.now())
     except Exception as e:
         flash(f'Error al cargar marketing: {str(e)}', 'error')
         return redirect(url_for('index'))
@@ -3,6 +3,58 @@ from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+def configurar_sqlite(engine, wal: bool = True, espera_ms: int = 5000):
+    """Modo WAL (las lecturas no esperan a las escrituras), busy_timeout (las escrituras
+    concurrentes esperan en vez de fallar) y transacciones de escritura con BEGIN IMMEDIATE"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @db.event.listens_for(engine, "connect")
+    def _al_conectar(conexion, registro):
+        # sqlite3 abre la transacción al primer INSERT/UPDATE/DELETE; con IMMEDIATE toma el
+        # candado de escritura en ese momento (las lecturas siguen fuera de transacción)
+        conexion.isolation_level = "IMMEDIATE"
+        cursor = conexion.cursor()
+        if wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(espera_ms)}")
+        cursor.close()
+
+    engine.update_execution_options(escritura_inmediata=True)
+    # Las conexiones ya abiertas no pasaron por el evento connect
+    engine.dispose()
+
+def iniciar_escritura():
+    """Abre ya la transacción con BEGIN IMMEDIATE para que las lecturas de validación
+    (p. ej. buscar duplicados) queden dentro del mismo candado que la escritura. No confirma
+    nada: los cambios que el llamador tenga en la sesión entran en esa misma transacción, y
+    si ya escribió algo la transacción (y el candado) ya estaban abiertos."""
+    conexion = db.session.connection()
+    if conexion.get_execution_options().get("escritura_inmediata") \
+            and not conexion.connection.dbapi_connection.in_transaction:
+        conexion.exec_driver_sql("BEGIN IMMEDIATE")
+
+def crear_indices_faltantes():
+    """create_all no agrega índices nuevos a tablas que ya existen; los crea aquí"""
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(db.engine, checkfirst=True)
+
+def agregar_columnas_faltantes():
+    """create_all tampoco agrega columnas nuevas a tablas que ya existen; las agrega con
+    ALTER TABLE (solo sirve para columnas opcionales, sin restricciones)"""
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conexion:
+        for tabla in db.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}")
+
 class Apartamento(db.Model):
     __tablename__ = "apartamentos"
     id = db.Column(db.Integer, primary_key=True)
@@ -18,6 +70,7 @@ class Apartamento(db.Model):
 
 class Cuarto(db.Model):
     __tablename__ = "cuartos"
+    __table_args__ = (db.Index("ix_cuartos_activo_proximo_pago", "activo", "proximo_pago"),)
     id = db.Column(db.Integer, primary_key=True)
     numero = db.Column(db.Integer, nullable=False)
     renta = db.Column(db.Float, default=0.0)
@@ -63,6 +116,7 @@ class Gas(db.Model):
 
 class SolicitudPago(db.Model):
     __tablename__ = "solicitudes_pago"
+    __table_args__ = (db.Index("ix_solicitudes_cuarto_estado", "cuarto_id", "estado"),)
     id = db.Column(db.Integer, primary_key=True)
     fecha_solicitud = db.Column(db.DateTime, default=datetime.utcnow)
     fecha_vencimiento = db.Column(db.DateTime)
@@ -90,4 +144,142 @@ class Configuracion(db.Model):
     clave = db.Column(db.String(100), unique=True, nullable=False)
     valor = db.Column(db.String(255), nullable=False)
     descripcion = db.Column(db.String(255))
-    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ContactoInquilino(db.Model):
+    __tablename__ = "contactos_inquilino"
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120))
+    telefono = db.Column(db.String(30))
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), unique=True, nullable=False)
+
+class EnvioNotificacion(db.Model):
+    __tablename__ = "envios_notificacion"
+    __table_args__ = (db.Index("ix_envios_estado_proximo", "estado", "proximo_intento"),)
+    id = db.Column(db.Integer, primary_key=True)
+    canal = db.Column(db.String(20), nullable=False)  # email, sms
+    destino = db.Column(db.String(120), nullable=False)
+    estado = db.Column(db.String(20), default="pendiente")  # pendiente, enviando, enviado, fallido
+    reclamado_por = db.Column(db.String(32))  # lote del despachador que lo está enviando
+    reclamado_en = db.Column(db.DateTime)
+    intentos = db.Column(db.Integer, default=0)
+    proximo_intento = db.Column(db.DateTime, default=datetime.utcnow)
+    ultimo_error = db.Column(db.String(255))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_envio = db.Column(db.DateTime)
+    notificacion_id = db.Column(db.Integer, db.ForeignKey("notificaciones.id"), nullable=False)
+
+    notificacion = db.relationship("Notificacion", lazy="joined")
+
+class CuotaPago(db.Model):
+    __tablename__ = "cuotas_pago"
+    __table_args__ = (
+        db.UniqueConstraint("cuarto_id", "fecha_vencimiento", name="uq_cuota_cuarto_fecha"),
+        db.Index("ix_cuotas_estado_vencimiento", "estado", "fecha_vencimiento"),
+        db.Index("ix_cuotas_ocupacion_estado", "ocupacion_id", "estado", "fecha_vencimiento"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    fecha_vencimiento = db.Column(db.Date, nullable=False)
+    monto = db.Column(db.Float, nullable=False)
+    monto_pagado = db.Column(db.Float, default=0.0)
+    estado = db.Column(db.String(20), default="pendiente")  # pendiente, pagada, transferida
+    fecha_pago = db.Column(db.DateTime)
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), nullable=False)
+    ocupacion_id = db.Column(db.Integer, db.ForeignKey("ocupaciones_cuarto.id"))  # estadía a la que pertenece
+
+class ClaveIdempotencia(db.Model):
+    __tablename__ = "claves_idempotencia"
+    clave = db.Column(db.String(100), primary_key=True)
+    endpoint = db.Column(db.String(255), nullable=False)
+    huella = db.Column(db.String(64))  # sha256 del cuerpo de la petición
+    respuesta = db.Column(db.Text)  # None mientras la petición original está en curso
+    codigo = db.Column(db.Integer)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    expira = db.Column(db.DateTime, nullable=False, index=True)
+    reservada_en = db.Column(db.DateTime, default=datetime.utcnow)  # inicio de la ejecución en curso
+    escrita_en = db.Column(db.DateTime)  # commit de la vista, en su misma transacción
+
+class MovimientoCuenta(db.Model):
+    __tablename__ = "movimientos_cuenta"
+    __table_args__ = (
+        db.Index("ix_movimientos_cuarto_id", "cuarto_id", "id"),
+        # Antigüedad de la deuda: ventana por cuarto ordenada por fecha
+        db.Index("ix_movimientos_cuarto_fecha", "cuarto_id", "fecha", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    tipo = db.Column(db.String(20), nullable=False)  # cargo, pago, ajuste
+    concepto = db.Column(db.String(255))
+    monto = db.Column(db.Float, nullable=False)  # cargos positivos, pagos negativos
+    saldo = db.Column(db.Float, nullable=False)  # saldo del cuarto después del movimiento
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), nullable=False)
+    pago_id = db.Column(db.Integer, db.ForeignKey("pagos.id"), unique=True)
+    cuota_id = db.Column(db.Integer, db.ForeignKey("cuotas_pago.id"), unique=True)
+
+    pago = db.relationship("Pago")
+
+class SaldoCuarto(db.Model):
+    __tablename__ = "saldos_cuarto"
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), primary_key=True)
+    saldo = db.Column(db.Float, default=0.0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RecordatorioPago(db.Model):
+    __tablename__ = "recordatorios_pago"
+    __table_args__ = (
+        db.UniqueConstraint("cuarto_id", "fecha_pago", "dias_antes", name="uq_recordatorio_cuarto_fecha"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    fecha_pago = db.Column(db.DateTime, nullable=False)  # proximo_pago al que corresponde
+    dias_antes = db.Column(db.Integer, nullable=False)
+    fecha_envio = db.Column(db.DateTime, default=datetime.utcnow)
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), nullable=False)
+
+# Un registro por cuarto y día: el índice único impide pagos duplicados concurrentes
+class PagoDiario(db.Model):
+    __tablename__ = "pagos_diarios"
+    __table_args__ = (db.UniqueConstraint("cuarto_id", "fecha", name="uq_pago_diario_cuarto_fecha"),)
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False)
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), nullable=False)
+    pago_id = db.Column(db.Integer, db.ForeignKey("pagos.id"))
+
+    pago = db.relationship("Pago")
+
+class AplicacionPago(db.Model):
+    __tablename__ = "aplicaciones_pago"
+    id = db.Column(db.Integer, primary_key=True)
+    monto = db.Column(db.Float, nullable=False)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow)
+    pago_id = db.Column(db.Integer, db.ForeignKey("pagos.id"), nullable=False, index=True)
+    solicitud_id = db.Column(db.Integer, db.ForeignKey("solicitudes_pago.id"), nullable=False, index=True)
+
+class OcupacionCuarto(db.Model):
+    __tablename__ = "ocupaciones_cuarto"
+    __table_args__ = (
+        db.Index("ix_ocupaciones_cuarto_desde", "cuarto_id", "desde"),
+        db.Index("ix_ocupaciones_desde_hasta", "desde", "hasta"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    inquilino = db.Column(db.String(100))
+    renta = db.Column(db.Float)
+    desde = db.Column(db.DateTime, nullable=False)
+    hasta = db.Column(db.DateTime)  # NULL mientras el cuarto siga ocupado
+    cuarto_id = db.Column(db.Integer, db.ForeignKey("cuartos.id"), nullable=False)
+
+    cuarto = db.relationship("Cuarto")
+
+# Hechos pre-agregados por apartamento y día; la ocupación se guarda como altas y bajas
+# del día (los cuartos ocupados en una fecha son la suma acumulada hasta esa fecha)
+class HechoDiario(db.Model):
+    __tablename__ = "hechos_diarios"
+    __table_args__ = (db.Index("ix_hechos_diarios_fecha", "fecha"),)
+    apartamento_id = db.Column(db.Integer, db.ForeignKey("apartamentos.id"), primary_key=True)
+    fecha = db.Column(db.Date, primary_key=True)
+    ingresos = db.Column(db.Float, nullable=False, default=0.0)
+    pagos = db.Column(db.Integer, nullable=False, default=0)
+    limpiezas = db.Column(db.Integer, nullable=False, default=0)
+    minutos_limpieza = db.Column(db.Integer, nullable=False, default=0)
+    recargas_gas = db.Column(db.Integer, nullable=False, default=0)
+    entradas = db.Column(db.Integer, nullable=False, default=0)
+    salidas = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, configurar_sqlite  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App mínima sobre una base SQLite temporal (main.py usa la base real de instance/)"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'pruebas.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        configurar_sqlite(db.engine)
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Apartamento, Cuarto, Pago, Limpieza, Gas, HechoDiario, OcupacionCuarto
+from backend.cubo_diario import cubo_diario, MEDIDAS
+from backend.ocupacion import historial_ocupacion
+
+HOY = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+
+
+def foto():
+    """Filas del cubo con alguna medida distinta de cero (el mantenimiento incremental deja
+    en cero las filas que se vacían; la reconstrucción no las crea)"""
+    filas = []
+    for h in HechoDiario.query.all():
+        valores = tuple(round(getattr(h, m) or 0, 2) for m in MEDIDAS)
+        if any(valores):
+            filas.append((h.apartamento_id, h.fecha, valores))
+    return sorted(filas)
+
+
+def assert_igual_a_reconstruir():
+    db.session.commit()
+    incremental = foto()
+    cubo_diario.reconstruir()
+    assert incremental == foto()
+
+
+@pytest.fixture
+def datos(app):
+    historial_ocupacion.iniciar(app)
+    cubo_diario.iniciar(app)
+    for numero in (1, 2):
+        apartamento = Apartamento(numero=numero, renta_base=500 + numero * 10)
+        db.session.add(apartamento)
+        db.session.flush()
+        for n in (1, 2, 3):
+            activo = n != 3
+            cuarto = Cuarto(numero=n, renta=apartamento.renta_base, activo=activo, apartamento_id=apartamento.id,
+                            inquilino=f'Inquilino {numero}-{n}' if activo else None,
+                            fecha_entrada=HOY - timedelta(days=90) if activo else None)
+            db.session.add(cuarto)
+            db.session.flush()
+            if activo:
+                for m in range(3):
+                    db.session.add(Pago(cuarto_id=cuarto.id, monto=cuarto.renta, fecha=HOY - timedelta(days=30 * m)))
+                db.session.add(Limpieza(cuarto_id=cuarto.id, minutos=30, fecha=HOY - timedelta(days=3)))
+                db.session.add(Gas(cuarto_id=cuarto.id, fecha=HOY - timedelta(days=9)))
+    db.session.commit()
+    return {
+        'apartamentos': Apartamento.query.order_by(Apartamento.numero).all(),
+        'cuartos': Cuarto.query.order_by(Cuarto.apartamento_id, Cuarto.numero).all()
+    }
+
+
+def test_inserciones(datos):
+    assert foto()
+    assert_igual_a_reconstruir()
+
+
+def test_editar_pago(datos):
+    pago = Pago.query.first()
+    pago.monto = 1234.5
+    pago.fecha = HOY - timedelta(days=400)
+    assert_igual_a_reconstruir()
+
+    # Mover el pago a un cuarto de otro apartamento
+    otro = next(c for c in datos['cuartos'] if c.apartamento_id != pago.cuarto.apartamento_id)
+    pago.cuarto_id = otro.id
+    assert_igual_a_reconstruir()
+
+
+def test_editar_objeto_expirado(datos):
+    pago = Pago.query.first()
+    db.session.expire(pago)
+    pago.monto = 10
+    assert_igual_a_reconstruir()
+
+
+def test_borrar(datos):
+    db.session.delete(Pago.query.first())
+    db.session.delete(Limpieza.query.first())
+    db.session.delete(Gas.query.first())
+    assert_igual_a_reconstruir()
+
+
+def test_borrar_apartamento(datos):
+    apartamento = datos['apartamentos'][1]
+    db.session.delete(apartamento)
+    assert_igual_a_reconstruir()
+    assert HechoDiario.query.filter_by(apartamento_id=apartamento.id).count() == 0
+
+
+def test_estadias_abrir_y_cerrar(datos):
+    libre = next(c for c in datos['cuartos'] if not c.activo)
+    libre.activo = True
+    libre.inquilino = 'Nuevo'
+    libre.fecha_entrada = HOY - timedelta(days=5)
+    assert_igual_a_reconstruir()
+
+    ocupado = next(c for c in datos['cuartos'] if c.activo and c.id != libre.id)
+    ocupado.activo = False
+    ocupado.inquilino = None
+    assert_igual_a_reconstruir()
+
+    # Cambio de inquilino: cierra una estadía y abre otra el mismo día
+    libre.inquilino = 'Otro'
+    assert_igual_a_reconstruir()
+
+    estadia = OcupacionCuarto.query.filter(OcupacionCuarto.hasta.isnot(None)).first()
+    estadia.hasta = HOY - timedelta(days=1)
+    assert_igual_a_reconstruir()
+
+
+def test_rollback_no_deja_cambios(datos):
+    antes = foto()
+    db.session.add(Pago(cuarto_id=datos['cuartos'][0].id, monto=999, fecha=HOY))
+    db.session.flush()
+    db.session.rollback()
+    assert foto() == antes
+    assert_igual_a_reconstruir()
@@ -0,0 +1,106 @@
+import threading
+import time
+import warnings
+
+import pytest
+
+from models import db, Apartamento, Cuarto, ContactoInquilino, Notificacion, EnvioNotificacion
+from backend.entregas import SistemaEntregas
+
+# smtpd/asyncore están deprecados y ya no existen desde Python 3.12
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    asyncore = pytest.importorskip('asyncore')
+    smtpd = pytest.importorskip('smtpd')
+
+
+class ServidorSMTP(smtpd.SMTPServer):
+    """Servidor SMTP local que guarda los mensajes recibidos"""
+
+    def __init__(self):
+        super().__init__(('localhost', 0), None, decode_data=True)
+        self.mensajes = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.mensajes.append((rcpttos, data))
+
+
+def esperar(condicion, plazo=5.0):
+    limite = time.monotonic() + plazo
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def servidor():
+    servidor = ServidorSMTP()
+    hilo = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    hilo.start()
+    yield servidor
+    servidor.close()
+    hilo.join(timeout=5)
+
+
+@pytest.fixture
+def entregas(app, servidor):
+    app.config['SMTP_PORT'] = servidor.socket.getsockname()[1]
+    # Un sondeo largo: si el envío llega a tiempo es porque el commit despertó al despachador
+    sistema = SistemaEntregas(intervalo_sondeo=60)
+    sistema.iniciar(app)
+    yield sistema
+    sistema.detener()
+    db.event.remove(db.session, 'after_commit', sistema._al_hacer_commit)
+    db.event.remove(db.session, 'after_rollback', sistema._al_hacer_rollback)
+
+
+def crear_notificacion(email='inquilino@example.com'):
+    apartamento = Apartamento(numero=1, renta_base=500)
+    db.session.add(apartamento)
+    db.session.flush()
+    cuarto = Cuarto(numero=1, renta=500, activo=True, apartamento_id=apartamento.id)
+    db.session.add(cuarto)
+    db.session.flush()
+    db.session.add(ContactoInquilino(cuarto_id=cuarto.id, email=email))
+    notif = Notificacion(tipo='pago_vencido', titulo='Pago vencido', mensaje='Renta pendiente',
+                         cuarto_id=cuarto.id, apartamento_id=apartamento.id)
+    db.session.add(notif)
+    db.session.flush()
+    return notif
+
+
+def estado_envio(app, envio_id):
+    with app.app_context():
+        estado = db.session.get(EnvioNotificacion, envio_id).estado
+        db.session.remove()
+        return estado
+
+
+def test_encolar_despierta_solo_tras_el_commit(entregas):
+    envios = entregas.encolar(crear_notificacion())
+    assert len(envios) == 1
+    assert not entregas._despertar.is_set()
+
+    db.session.rollback()
+    assert not entregas._despertar.is_set()
+
+    entregas.encolar(crear_notificacion())
+    db.session.commit()
+    assert entregas._despertar.is_set()
+
+
+def test_envia_por_smtp_local(app, servidor, entregas):
+    entregas.arrancar()
+    # Dejar que el despachador haga su primera pasada (vacía) y se duerma
+    time.sleep(0.3)
+
+    envio = entregas.encolar(crear_notificacion())[0]
+    db.session.commit()
+
+    assert esperar(lambda: servidor.mensajes)
+    destinatarios, cuerpo = servidor.mensajes[0]
+    assert destinatarios == ['inquilino@example.com']
+    assert 'Renta pendiente' in cuerpo
+    assert esperar(lambda: estado_envio(app, envio.id) == 'enviado')
@@ -0,0 +1,11 @@
+from backend.estres_pagos import PruebaEstresPagos
+
+
+def test_pagos_concurrentes_sin_duplicados():
+    """Con WAL + BEGIN IMMEDIATE cada (cuarto, día) queda registrado una sola vez"""
+    resultado = PruebaEstresPagos(hilos=4, pagos_por_hilo=10, cuartos=5).ejecutar(wal=True)
+
+    assert resultado['errores'] == 0
+    assert resultado['duplicados_en_base'] == 0
+    assert resultado['registrados'] == resultado['esperados']
+    assert resultado['registrados'] + resultado['rechazados'] == resultado['intentos']